@@ -12,8 +12,6 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-from stevedore import driver
-
 from oslo_log import log as logging
 from oslo_utils import netutils
 
@@ -21,6 +19,7 @@ from zaqar.common.api import errors as api_errors
 from zaqar.common.api import response
 from zaqar.common.api import utils as api_utils
 from zaqar.i18n import _
+from zaqar.notification import notifier
 from zaqar.storage import errors as storage_errors
 from zaqar.transport import validation
 
@@ -862,10 +861,9 @@ class Endpoints(object):
 
         try:
             url = netutils.urlsplit(subscriber)
-            mgr = driver.DriverManager('zaqar.notification.tasks', url.scheme,
-                                       invoke_on_load=True)
             req_data = req._env.copy()
-            mgr.driver.register(subscriber, options, ttl, project_id, req_data)
+            task = notifier.get_task(url.scheme)
+            task.register(subscriber, options, ttl, project_id, req_data)
 
             data = {'subscriber': subscriber,
                     'options': options,
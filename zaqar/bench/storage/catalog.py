@@ -0,0 +1,163 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cost of queue to pool lookups on a pooled deployment.
+
+The benchmark maps a large number of queues to a pool of its own, and
+then times pool catalog lookups for a random sample of them:
+
+- cold lookups, which go to the catalogue store
+- warm lookups, answered by the oslo.cache backend
+- lookups answered by the in-process cache
+- lookups of unmapped queues, with and without negative caching
+- warming a page of mappings with one request, versus one per queue
+- registering new queues
+
+Enable the oslo.cache backend in the ``[cache]`` section to get
+meaningful numbers for warm lookups, and use a management store that
+supports pooling (MongoDB or SQLAlchemy).
+
+Usage::
+
+    $ python -m zaqar.bench.storage.catalog --config-file zaqar.conf \\
+        --pool_uri redis://127.0.0.1:6379 --queues 100000
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import random
+import uuid
+
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar.storage import pooling
+from zaqar.storage.sqlalchemy import tables
+
+PAGE_SIZE = 20
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('queues', default=100000,
+               help='Number of queues to map in the catalogue.'),
+    cfg.IntOpt('lookups', default=1000,
+               help='Number of lookups to time for each case.'),
+    cfg.StrOpt('pool_uri', required=True,
+               help=('URI of the message store to register as the pool '
+                     'that queues are mapped to.')),
+)
+
+
+def _new_catalog(conf, boot, **overrides):
+    for name, value in overrides.items():
+        conf.set_override(name, value, group=pooling._CATALOG_GROUP)
+
+    return pooling.Catalog(conf, boot.cache, boot.control)
+
+
+def _time_each(func, args_list):
+    samples = []
+    for args in args_list:
+        __, elapsed = helpers.timed(func, *args)
+        samples.append(elapsed)
+
+    return samples
+
+
+def _row(case, samples):
+    row = {'case': case}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot):
+    conf.register_opts(pooling._CATALOG_OPTIONS, group=pooling._CATALOG_GROUP)
+
+    control = boot.control
+    if hasattr(control, 'engine'):
+        # NOTE: Make sure the SQLAlchemy schema exists, e.g. when
+        # running against sqlite.
+        tables.metadata.create_all(control.engine)
+
+    pools_ctrl = control.pools_controller
+    catalogue_ctrl = control.catalogue_controller
+
+    pool = 'bench-catalog-%s' % uuid.uuid4().hex[:8]
+    project = 'bench-catalog-%s' % uuid.uuid4().hex[:8]
+    pools_ctrl.create(pool, 100, conf.pool_uri, options={})
+
+    rows = []
+
+    try:
+        queues = ['q-%d' % i for i in range(conf.queues)]
+        for queue in queues:
+            catalogue_ctrl.insert(project, queue, pool)
+
+        sample = random.sample(queues, min(conf.lookups, len(queues)))
+        args_list = [(queue, project) for queue in sample]
+
+        catalog = _new_catalog(conf, boot, local_cache_ttl=0,
+                               negative_cache_ttl=0)
+        rows.append(_row('cold', _time_each(catalog.lookup, args_list)))
+        rows.append(_row('warm', _time_each(catalog.lookup, args_list)))
+
+        catalog = _new_catalog(conf, boot, local_cache_ttl=5)
+        _time_each(catalog.lookup, args_list)
+        rows.append(_row('local', _time_each(catalog.lookup, args_list)))
+
+        missing = [('missing-%d' % (i % 10), project)
+                   for i in range(conf.lookups)]
+        for ttl in (0, 5):
+            catalog = _new_catalog(conf, boot, negative_cache_ttl=ttl)
+            rows.append(_row('unmapped_neg_ttl_%d' % ttl,
+                             _time_each(catalog.lookup, missing)))
+
+        pages = [sample[i:i + PAGE_SIZE]
+                 for i in range(0, len(sample), PAGE_SIZE)]
+        rows.append(_row('page_get_many', _time_each(
+            catalogue_ctrl.get_many, [(project, page) for page in pages])))
+
+        def get_each(page):
+            for queue in page:
+                catalogue_ctrl.get(project, queue)
+
+        rows.append(_row('page_get_each',
+                         _time_each(get_each, [(page,) for page in pages])))
+
+        catalog = _new_catalog(conf, boot, local_cache_ttl=0,
+                               negative_cache_ttl=0)
+        new_queues = [('new-%d' % i, project) for i in range(conf.lookups)]
+        rows.append(_row('register', _time_each(catalog.register,
+                                                new_queues)))
+
+    finally:
+        for entry in list(catalogue_ctrl.list(project)):
+            catalogue_ctrl.delete(project, entry['queue'])
+
+        pools_ctrl.delete(pool)
+
+    return rows
+
+
+def main():
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-catalog',
+                                           _CLI_OPTIONS)
+
+    helpers.print_table('Pool catalog lookups with %d mapped queues' %
+                        conf.queues,
+                        ['case', 'count', 'p50_ms', 'p99_ms', 'max_ms'],
+                        run(conf, boot))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Claim fill rate and latency of the mongodb driver with parallel consumers.
+
+A queue is filled with enough messages for every claim to be served in
+full, and then a number of consumer threads claim messages from it at
+the same time. The fill rate is the share of the requested messages
+that claims actually returned.
+
+The workload runs once with the previous claim algorithm (list active
+messages, tag them, extend the messages expiring before the claim,
+then read the claim back) and once with the current one.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.claim_contention \\
+        --config-file zaqar.conf --consumers 20
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import datetime
+import threading
+
+from bson import objectid
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from zaqar.bench.storage import helpers
+from zaqar.storage.mongodb import utils
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('consumers', default=20,
+               help='Number of concurrent consumers.'),
+    cfg.IntOpt('claims', default=20,
+               help='Number of claims per consumer.'),
+    cfg.IntOpt('limit', default=10,
+               help='Number of messages requested per claim.'),
+)
+
+_METADATA = {'ttl': 300, 'grace': 60}
+
+
+def _legacy_create(claim_ctrl, queue, metadata, limit):
+    """The claim algorithm this benchmark compares against."""
+
+    msg_ctrl = claim_ctrl.driver.message_controller
+    oid = objectid.ObjectId()
+
+    now = timeutils.utcnow_ts()
+    claim_expires = now + metadata['ttl']
+    claim_expires_dt = datetime.datetime.utcfromtimestamp(claim_expires)
+    meta = {'id': oid, 't': metadata['ttl'], 'e': claim_expires}
+
+    msgs = msg_ctrl._active(queue, projection={'_id': 1}, limit=limit)
+    ids = [msg['_id'] for msg in msgs]
+    if not ids:
+        return None, iter([])
+
+    collection = msg_ctrl._collection(queue)
+    updated = collection.update({'_id': {'$in': ids},
+                                 'c.e': {'$lte': timeutils.utcnow_ts()}},
+                                {'$set': {'c': meta}},
+                                upsert=False, multi=True)['n']
+
+    collection.update({'p_q': utils.scope_queue_name(queue),
+                       'e': {'$lt': claim_expires_dt},
+                       'c.id': oid},
+                      {'$set': {'e': datetime.datetime.utcfromtimestamp(
+                                    claim_expires + metadata['grace']),
+                                't': metadata['ttl'] + metadata['grace']}},
+                      upsert=False, multi=True)
+
+    if updated == 0:
+        return str(oid), iter([])
+
+    __, messages = claim_ctrl.get(queue, oid)
+    return str(oid), messages
+
+
+def _run_mode(conf, storage, legacy):
+    driver = getattr(storage, '_storage', storage)
+    claim_ctrl = driver.claim_controller
+
+    if legacy:
+        def create(queue):
+            return _legacy_create(claim_ctrl, queue, _METADATA, conf.limit)
+    else:
+        def create(queue):
+            return claim_ctrl.create(queue, _METADATA, limit=conf.limit)
+
+    queue = helpers.new_queue_name('bench-claim-contention')
+    storage.queue_controller.create(queue)
+
+    total = conf.consumers * conf.claims * conf.limit
+    batch = [{'ttl': 600, 'body': {'event': i}} for i in range(10)]
+    for __ in range(0, total, len(batch)):
+        driver.message_controller.post(queue, batch, 'bench')
+
+    samples = []
+    claimed = []
+    lock = threading.Lock()
+    barrier = threading.Event()
+
+    def consumer():
+        barrier.wait()
+        for __ in range(conf.claims):
+            (__, messages), elapsed = helpers.timed(create, queue)
+            count = len(list(messages))
+
+            with lock:
+                samples.append(elapsed)
+                claimed.append(count)
+
+    threads = [threading.Thread(target=consumer)
+               for __ in range(conf.consumers)]
+
+    try:
+        for thread in threads:
+            thread.start()
+
+        barrier.set()
+        for thread in threads:
+            thread.join()
+
+    finally:
+        storage.queue_controller.delete(queue)
+
+    requested = len(claimed) * conf.limit
+    row = {'algorithm': 'legacy' if legacy else 'current',
+           'fill_rate': sum(claimed) / requested if requested else 0.0,
+           'short': len([c for c in claimed if c < conf.limit])}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot):
+    storage = boot.storage
+    return [_run_mode(conf, storage, legacy) for legacy in (True, False)]
+
+
+def main():
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-claim-contention',
+                                           _CLI_OPTIONS)
+
+    helpers.print_table('Claiming %d messages at a time with %d consumers' %
+                        (conf.limit, conf.consumers),
+                        ['algorithm', 'count', 'p50_ms', 'p99_ms', 'max_ms',
+                         'fill_rate', 'short'],
+                        run(conf, boot))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cost of renewing and releasing a claim as a function of its size.
+
+For each claim size, the benchmark claims that many messages and then
+times a series of renewals followed by a release. With the Redis driver
+it also reports the number of bytes Redis received per operation, which
+is a good proxy for the write bandwidth that claim renewals use.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.claim_renew --config-file zaqar.conf \\
+        --claim_sizes 10,100,1000
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import uuid
+
+from oslo_config import cfg
+from oslo_config import types
+
+from zaqar.bench.storage import helpers
+
+POST_BATCH_SIZE = 100
+LONG_TTL = 3600
+
+_CLI_OPTIONS = (
+    cfg.ListOpt('claim_sizes', item_type=types.Integer(),
+                default=[10, 100, 1000],
+                help='Numbers of messages per claim to test.'),
+    cfg.IntOpt('renewals', default=200,
+               help='Number of renewals to time for each claim size.'),
+)
+
+
+def _post(message_ctrl, queue, count):
+    client_uuid = str(uuid.uuid4())
+    message = {'ttl': LONG_TTL, 'body': {'event': 'bench'}}
+
+    while count > 0:
+        batch = min(count, POST_BATCH_SIZE)
+        message_ctrl.post(queue, [message] * batch, client_uuid)
+        count -= batch
+
+
+def _bytes_in(client):
+    return helpers.redis_bytes_in(client) if client else 0
+
+
+def run(conf, storage):
+    queue_ctrl = storage.queue_controller
+    message_ctrl = storage.message_controller
+    claim_ctrl = storage.claim_controller
+    client = helpers.redis_client(storage)
+
+    rows = []
+
+    for claim_size in conf.claim_sizes:
+        queue = helpers.new_queue_name('bench-renew')
+        queue_ctrl.create(queue)
+
+        try:
+            _post(message_ctrl, queue, claim_size)
+            claim_id, messages = claim_ctrl.create(
+                queue, {'ttl': 60, 'grace': 60}, limit=claim_size)
+
+            samples = []
+            bytes_before = _bytes_in(client)
+
+            for i in range(conf.renewals):
+                # NOTE: Alternate the TTL so that every renewal has to
+                # extend some of the messages.
+                meta = {'ttl': 60 + i % 2 * 60, 'grace': 60}
+                __, elapsed = helpers.timed(claim_ctrl.update, queue,
+                                            claim_id, meta)
+                samples.append(elapsed)
+
+            renew_bytes = _bytes_in(client) - bytes_before
+
+            bytes_before = _bytes_in(client)
+            __, release_ms = helpers.timed(claim_ctrl.delete, queue,
+                                           claim_id)
+            release_bytes = _bytes_in(client) - bytes_before
+
+            row = {
+                'claim_size': claim_size,
+                'renew_bytes': renew_bytes // conf.renewals,
+                'release_ms': release_ms,
+                'release_bytes': release_bytes,
+            }
+            row.update(helpers.summarize(samples))
+            rows.append(row)
+
+        finally:
+            queue_ctrl.delete(queue)
+
+    return rows
+
+
+def main():
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-claim-renew',
+                                           _CLI_OPTIONS)
+    rows = run(conf, boot.storage)
+
+    helpers.print_table('Claim renewal and release cost vs. claim size',
+                        ['claim_size', 'count', 'p50_ms', 'p99_ms',
+                         'renew_bytes', 'release_ms', 'release_bytes'],
+                        rows)
+
+
+if __name__ == '__main__':
+    main()
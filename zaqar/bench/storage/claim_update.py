@@ -0,0 +1,156 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bytes read from MongoDB per claim renewal with the mongodb driver.
+
+For each claim size, the benchmark claims that many messages, with
+bodies of ``--body_size`` bytes, and then renews the claim a number of
+times, once with the previous renewal (read the first claimed message
+back to check that the claim exists, then update the claim) and once
+with the current one. The bytes read are the size of the replies to
+the commands sent to MongoDB, as seen by a pymongo command listener.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.claim_update --config-file zaqar.conf \\
+        --claim_sizes 10,100 --body_size 1024
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import datetime
+
+from oslo_config import cfg
+from oslo_config import types
+from oslo_utils import timeutils
+
+from zaqar.bench.storage import helpers
+from zaqar.storage import errors
+from zaqar.storage.mongodb import utils
+
+_CLI_OPTIONS = (
+    cfg.ListOpt('claim_sizes', item_type=types.Integer(),
+                default=[10, 100],
+                help='Numbers of messages per claim to test.'),
+    cfg.IntOpt('body_size', default=1024,
+               help='Size of the message bodies, in bytes.'),
+    cfg.IntOpt('renewals', default=200,
+               help='Number of renewals to time for each claim size.'),
+)
+
+
+def _legacy_update(claim_ctrl, queue, claim_id, metadata):
+    """The claim renewal this benchmark compares against."""
+
+    msg_ctrl = claim_ctrl.driver.message_controller
+    cid = utils.to_oid(claim_id)
+
+    now = timeutils.utcnow_ts()
+    claim_expires = now + metadata['ttl']
+    claim_expires_dt = datetime.datetime.utcfromtimestamp(claim_expires)
+
+    claimed = msg_ctrl._claimed(queue, cid, expires=now, limit=1)
+    try:
+        next(claimed)
+    except StopIteration:
+        raise errors.ClaimDoesNotExist(claim_id, queue, None)
+
+    meta = {'id': cid, 't': metadata['ttl'], 'e': claim_expires}
+
+    scope = utils.scope_queue_name(queue)
+    collection = msg_ctrl._collection(queue)
+    collection.update({'p_q': scope, 'c.id': cid},
+                      {'$set': {'c': meta}},
+                      upsert=False, multi=True)
+
+    collection.update({'p_q': scope,
+                       'e': {'$lt': claim_expires_dt},
+                       'c.id': cid},
+                      {'$set': {'e': datetime.datetime.utcfromtimestamp(
+                                    claim_expires + metadata['grace']),
+                                't': metadata['ttl'] + metadata['grace']}},
+                      upsert=False, multi=True)
+
+
+def _run_case(conf, storage, counter, claim_size, legacy):
+    driver = getattr(storage, '_storage', storage)
+    claim_ctrl = driver.claim_controller
+
+    if legacy:
+        def update(queue, claim_id, meta):
+            return _legacy_update(claim_ctrl, queue, claim_id, meta)
+    else:
+        update = claim_ctrl.update
+
+    queue = helpers.new_queue_name('bench-claim-update')
+    storage.queue_controller.create(queue)
+
+    body = {'payload': 'x' * conf.body_size}
+    batch = [{'ttl': 3600, 'body': body}] * min(claim_size, 100)
+    for __ in range(0, claim_size, len(batch)):
+        driver.message_controller.post(queue, batch, 'bench')
+
+    samples = []
+
+    try:
+        claim_id, __ = claim_ctrl.create(queue, {'ttl': 60, 'grace': 60},
+                                         limit=claim_size)
+
+        commands = counter.count
+        bytes_read = counter.bytes_read
+
+        for i in range(conf.renewals):
+            # NOTE: Alternate the TTL so that every other renewal has
+            # to extend the messages.
+            meta = {'ttl': 60 + i % 2 * 60, 'grace': 60}
+            __, elapsed = helpers.timed(update, queue, claim_id, meta)
+            samples.append(elapsed)
+
+        commands = counter.count - commands
+        bytes_read = counter.bytes_read - bytes_read
+
+    finally:
+        storage.queue_controller.delete(queue)
+
+    row = {'claim_size': claim_size,
+           'renewal': 'legacy' if legacy else 'current',
+           'round_trips': commands / conf.renewals,
+           'bytes_read': bytes_read // conf.renewals}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot, counter):
+    storage = boot.storage
+    return [_run_case(conf, storage, counter, claim_size, legacy)
+            for claim_size in conf.claim_sizes
+            for legacy in (True, False)]
+
+
+def main():
+    # NOTE: Must be called before any client is created
+    counter = helpers.count_mongodb_commands()
+
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-claim-update',
+                                           _CLI_OPTIONS)
+
+    helpers.print_table('Renewing claims of messages with %d byte bodies' %
+                        conf.body_size,
+                        ['claim_size', 'renewal', 'count', 'p50_ms',
+                         'p99_ms', 'round_trips', 'bytes_read'],
+                        run(conf, boot, counter))
+
+
+if __name__ == '__main__':
+    main()
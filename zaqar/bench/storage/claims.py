@@ -0,0 +1,117 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Claim latency as a function of the number of in-flight messages.
+
+For each level, the benchmark claims that many messages up front and
+keeps them claimed, then times a series of small claims against the
+rest of the queue. With an index of available messages the latency
+should not depend on how many messages are already in flight.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.claims --config-file zaqar.conf \\
+        --in_flight 0,1000,10000,50000
+"""
+
+from __future__ import print_function
+
+import uuid
+
+from oslo_config import cfg
+from oslo_config import types
+
+from zaqar.bench.storage import helpers
+
+POST_BATCH_SIZE = 100
+IN_FLIGHT_CLAIM_SIZE = 1000
+LONG_TTL = 3600
+
+_CLI_OPTIONS = (
+    cfg.ListOpt('in_flight', item_type=types.Integer(),
+                default=[0, 1000, 10000, 50000],
+                help='Numbers of in-flight (claimed) messages to test.'),
+    cfg.IntOpt('claims', default=200,
+               help='Number of claims to time at each level.'),
+    cfg.IntOpt('claim_size', default=10,
+               help='Number of messages requested by each timed claim.'),
+)
+
+
+def _post(message_ctrl, queue, count):
+    client_uuid = str(uuid.uuid4())
+    message = {'ttl': LONG_TTL, 'body': {'event': 'bench'}}
+
+    while count > 0:
+        batch = min(count, POST_BATCH_SIZE)
+        message_ctrl.post(queue, [message] * batch, client_uuid)
+        count -= batch
+
+
+def _claim_in_flight(claim_ctrl, queue, count):
+    meta = {'ttl': LONG_TTL, 'grace': LONG_TTL}
+
+    while count > 0:
+        limit = min(count, IN_FLIGHT_CLAIM_SIZE)
+        claim_ctrl.create(queue, meta, limit=limit)
+        count -= limit
+
+
+def run(conf, storage):
+    queue_ctrl = storage.queue_controller
+    message_ctrl = storage.message_controller
+    claim_ctrl = storage.claim_controller
+
+    meta = {'ttl': 60, 'grace': 60}
+    rows = []
+
+    for in_flight in conf.in_flight:
+        queue = helpers.new_queue_name('bench-claims')
+        queue_ctrl.create(queue)
+
+        try:
+            _post(message_ctrl, queue, in_flight + conf.claim_size)
+            _claim_in_flight(claim_ctrl, queue, in_flight)
+
+            samples = []
+            for __ in range(conf.claims):
+                (claim_id, messages), elapsed = helpers.timed(
+                    claim_ctrl.create, queue, meta, limit=conf.claim_size)
+                samples.append(elapsed)
+
+                # NOTE: Release the claim so that the number of
+                # in-flight messages stays constant for the next one.
+                claim_ctrl.delete(queue, claim_id)
+
+            row = {'in_flight': in_flight}
+            row.update(helpers.summarize(samples))
+            rows.append(row)
+
+        finally:
+            queue_ctrl.delete(queue)
+
+    return rows
+
+
+def main():
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-claims',
+                                           _CLI_OPTIONS)
+    rows = run(conf, boot.storage)
+
+    helpers.print_table('Claim latency vs. in-flight messages',
+                        ['in_flight', 'count', 'p50_ms', 'p99_ms', 'max_ms'],
+                        rows)
+
+
+if __name__ == '__main__':
+    main()
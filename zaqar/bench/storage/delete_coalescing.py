@@ -0,0 +1,132 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Delete throughput of the mongodb driver for several coalescing windows.
+
+A number of consumer threads delete messages from the same queue, one
+message per request, with acknowledged deletes. The workload runs once
+for each ``delete_coalesce_window``, 0 meaning that every delete is sent
+on its own, and reports the deletes per second along with the number of
+commands sent to MongoDB per delete.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.delete_coalescing \\
+        --config-file zaqar.conf --consumers 50 \\
+        --windows 0 0.001 0.005 0.02
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar.storage.mongodb import messages
+from zaqar.storage.mongodb import options
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('consumers', default=50,
+               help='Number of concurrent consumers.'),
+    cfg.IntOpt('deletes', default=100,
+               help='Number of deletes per consumer.'),
+    cfg.ListOpt('windows', default=['0', '0.001', '0.005', '0.02'],
+                help='Coalescing windows to try, in seconds.'),
+    cfg.StrOpt('write_concern', default='1',
+               help='Write concern of the deletes.'),
+)
+
+
+def _run_window(conf, storage, counter, window):
+    conf.set_override('delete_write_concern', conf.write_concern,
+                      group=options.MESSAGE_MONGODB_GROUP)
+    conf.set_override('delete_coalesce_window', window,
+                      group=options.MESSAGE_MONGODB_GROUP)
+
+    # NOTE: The write options are read when the controller is created
+    driver = getattr(storage, '_storage', storage)
+    controller = messages.MessageController(driver)
+
+    queue = helpers.new_queue_name('bench-delete-coalescing')
+    storage.queue_controller.create(queue)
+
+    batch = [{'ttl': 600, 'body': {'event': i}} for i in range(10)]
+    ids = []
+    for __ in range(0, conf.consumers * conf.deletes, len(batch)):
+        ids.extend(controller.post(queue, batch, 'bench'))
+
+    samples = []
+    lock = threading.Lock()
+    barrier = threading.Event()
+
+    def consumer(own_ids):
+        barrier.wait()
+        for message_id in own_ids:
+            __, elapsed = helpers.timed(controller.bulk_delete, queue,
+                                        [message_id])
+            with lock:
+                samples.append(elapsed)
+
+    threads = [threading.Thread(target=consumer,
+                                args=(ids[i::conf.consumers],))
+               for i in range(conf.consumers)]
+
+    try:
+        commands = counter.count
+        start = time.time()
+
+        for thread in threads:
+            thread.start()
+
+        barrier.set()
+        for thread in threads:
+            thread.join()
+
+        duration = time.time() - start
+        commands = counter.count - commands
+
+    finally:
+        storage.queue_controller.delete(queue)
+
+    row = {'window_ms': window * 1000,
+           'deletes_per_sec': len(samples) / duration,
+           'commands': commands / len(samples) if samples else 0.0}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot, counter):
+    storage = boot.storage
+    return [_run_window(conf, storage, counter, float(window))
+            for window in conf.windows]
+
+
+def main():
+    # NOTE: Must be called before any client is created
+    counter = helpers.count_mongodb_commands()
+
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-delete-coalescing',
+                                           _CLI_OPTIONS)
+
+    helpers.print_table('Deleting messages from %d consumers' %
+                        conf.consumers,
+                        ['window_ms', 'count', 'p50_ms', 'p99_ms', 'max_ms',
+                         'deletes_per_sec', 'commands'],
+                        run(conf, boot, counter))
+
+
+if __name__ == '__main__':
+    main()
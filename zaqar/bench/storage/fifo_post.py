@@ -0,0 +1,127 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Post latency of the mongodb.fifo driver under producer contention.
+
+A number of producer threads (50 by default) post batches of messages
+to the same queue at the same time. The workload runs once for each
+marker allocation mode of the driver (``retry`` and ``reserve``), and
+reports the post latency along with how often posts had to retry or
+wait because of a concurrent producer.
+
+Point the benchmark at a ``mongodb.fifo://`` message store.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.fifo_post --config-file zaqar.conf \\
+        --producers 50 --posts 20
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import uuid
+
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar.storage.mongodb import options
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('producers', default=50,
+               help='Number of concurrent producers.'),
+    cfg.IntOpt('posts', default=20,
+               help='Number of posts per producer.'),
+    cfg.IntOpt('batch', default=1,
+               help='Number of messages per post.'),
+)
+
+
+def _run_mode(conf, storage, mode):
+    conf.set_override('marker_allocation', mode,
+                      group=options.MESSAGE_MONGODB_GROUP)
+
+    queue_ctrl = storage.queue_controller
+    message_ctrl = storage.message_controller
+
+    driver = getattr(storage, '_storage', storage)
+    post_stats = driver.message_controller._post_stats
+    post_stats.clear()
+
+    queue = helpers.new_queue_name('bench-fifo-post')
+    queue_ctrl.create(queue)
+
+    samples = []
+    failures = []
+    lock = threading.Lock()
+    barrier = threading.Event()
+
+    def producer():
+        client_uuid = str(uuid.uuid4())
+        messages = [{'ttl': 300, 'body': {'event': i}}
+                    for i in range(conf.batch)]
+
+        barrier.wait()
+        for __ in range(conf.posts):
+            try:
+                __, elapsed = helpers.timed(message_ctrl.post, queue,
+                                            messages, client_uuid)
+            except Exception as ex:
+                with lock:
+                    failures.append(ex)
+                continue
+
+            with lock:
+                samples.append(elapsed)
+
+    threads = [threading.Thread(target=producer)
+               for __ in range(conf.producers)]
+
+    try:
+        for thread in threads:
+            thread.start()
+
+        barrier.set()
+        for thread in threads:
+            thread.join()
+
+    finally:
+        queue_ctrl.delete(queue)
+
+    row = {'mode': mode, 'failed': len(failures),
+           'retries': post_stats['retries'],
+           'waits': post_stats['waits'],
+           'skipped': post_stats['skipped']}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot):
+    storage = boot.storage
+    return [_run_mode(conf, storage, mode) for mode in ('retry', 'reserve')]
+
+
+def main():
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-fifo-post',
+                                           _CLI_OPTIONS)
+
+    helpers.print_table('Posting to one queue from %d producers' %
+                        conf.producers,
+                        ['mode', 'count', 'p50_ms', 'p99_ms', 'max_ms',
+                         'retries', 'waits', 'skipped', 'failed'],
+                        run(conf, boot))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared plumbing for the storage micro-benchmarks.
+
+Unlike zaqar-bench, which drives a running zaqar-server over HTTP, these
+benchmarks load the storage drivers directly from a regular Zaqar
+configuration file, so they measure the storage layer in isolation.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import uuid
+
+from oslo_config import cfg
+
+from zaqar import bootstrap
+
+
+def bootstrap_storage(prog, cli_opts=()):
+    """Parse the command line and load the configured storage drivers.
+
+    :param prog: Program name to use in --help output
+    :param cli_opts: Additional options understood by the benchmark
+    :returns: A (conf, Bootstrap) tuple
+    """
+
+    conf = cfg.CONF
+    conf.register_cli_opts(cli_opts)
+    conf(project='zaqar', prog=prog)
+
+    return conf, bootstrap.Bootstrap(conf)
+
+
+def redis_client(storage):
+    """Return the Redis client behind a storage pipeline, if any.
+
+    Only works when pooling is disabled, since the pipeline then wraps
+    the data driver directly.
+    """
+
+    driver = getattr(storage, '_storage', storage)
+    return getattr(driver, 'connection', None)
+
+
+def redis_bytes_in(client):
+    """Total number of bytes Redis has received from clients so far."""
+
+    return client.info('stats')['total_net_input_bytes']
+
+
+def count_mongodb_commands():
+    """Count the commands sent to MongoDB from now on.
+
+    Must be called before the storage drivers create their clients.
+
+    :returns: An object whose `count` attribute is the number of
+        commands sent so far, and `bytes_read` the total size of
+        their (BSON encoded) replies.
+    """
+
+    import bson
+    from pymongo import monitoring
+
+    class CommandCounter(monitoring.CommandListener):
+
+        def __init__(self):
+            self.count = 0
+            self.bytes_read = 0
+
+        def started(self, event):
+            self.count += 1
+
+        def succeeded(self, event):
+            self.bytes_read += len(bson.BSON.encode(event.reply))
+
+        def failed(self, event):
+            pass
+
+    counter = CommandCounter()
+    monitoring.register(counter)
+    return counter
+
+
+def stub_http_server(delay=0.0):
+    """Start an HTTP server that accepts and counts POST requests.
+
+    The server runs in a daemon thread and answers every POST with a
+    204, after `delay` seconds.
+
+    :returns: A (url, server) tuple. The `requests` attribute of the
+        server is the number of requests received so far; call its
+        `shutdown` method to stop it.
+    """
+
+    import threading
+
+    from six.moves import BaseHTTPServer
+    from six.moves import socketserver
+
+    class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+        requests = 0
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+
+            self.server.requests += 1
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return 'http://127.0.0.1:%d/' % server.server_address[1], server
+
+
+def stub_smtp_server():
+    """Start an SMTP server that accepts and counts emails.
+
+    The server runs in a daemon thread, speaks just enough SMTP for
+    smtplib, and drops the emails it receives.
+
+    :returns: A (port, server) tuple. The `emails` and `sessions`
+        attributes of the server are the number of emails and of
+        connections received so far; call its `shutdown` method to
+        stop it.
+    """
+
+    import threading
+
+    from six.moves import socketserver
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+        emails = 0
+        sessions = 0
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def reply(self, line):
+            self.wfile.write(line + b'\r\n')
+            self.wfile.flush()
+
+        def handle(self):
+            self.server.sessions += 1
+            self.reply(b'220 stub')
+
+            for line in self.rfile:
+                command = line[:4].upper()
+                if command == b'DATA':
+                    self.reply(b'354 go ahead')
+                    for line in self.rfile:
+                        if line in (b'.\r\n', b'.\n'):
+                            break
+                    self.server.emails += 1
+                    self.reply(b'250 OK')
+                elif command == b'QUIT':
+                    self.reply(b'221 bye')
+                    return
+                else:
+                    self.reply(b'250 OK')
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server.server_address[1], server
+
+
+def new_queue_name(prefix):
+    return '%s-%s' % (prefix, uuid.uuid4().hex[:8])
+
+
+def timed(func, *args, **kwargs):
+    """Call func and return a (result, elapsed milliseconds) tuple."""
+
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, (time.time() - start) * 1000
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples."""
+
+    if not samples:
+        return 0.0
+
+    ordered = sorted(samples)
+    rank = int(round(pct / 100 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 50),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': max(samples) if samples else 0.0,
+    }
+
+
+def print_table(title, columns, rows):
+    """Print a list of dicts as a fixed-width table."""
+
+    print(title)
+    print('=' * len(title))
+
+    widths = [max(len(col), 12) for col in columns]
+    print('  '.join(col.rjust(w) for col, w in zip(columns, widths)))
+
+    for row in rows:
+        cells = []
+        for col, width in zip(columns, widths):
+            value = row.get(col, '')
+            if isinstance(value, float):
+                value = '{:.3f}'.format(value)
+
+            cells.append(str(value).rjust(width))
+
+        print('  '.join(cells))
+
+    print()
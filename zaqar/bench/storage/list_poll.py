@@ -0,0 +1,126 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cost of polling idle queues for new messages with the mongodb driver.
+
+A number of queues get a few messages each, and then observers list
+them repeatedly from the marker of their last message, as clients
+polling for new messages do. The polls are run without the marker
+watcher, and then with it. The watcher needs MongoDB change streams,
+so the benchmark must run against a replica set.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.list_poll --config-file zaqar.conf \\
+        --queues 100 --polls 20
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar.storage.mongodb import markers
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('queues', default=100,
+               help='Number of idle queues to poll.'),
+    cfg.IntOpt('polls', default=20,
+               help='Number of times each queue is polled.'),
+    cfg.FloatOpt('watch_timeout', default=10.0,
+                 help='Number of seconds to wait for the change streams '
+                      'to open.'),
+)
+
+
+def _poll(msg_ctrl, queue, marker):
+    interaction = msg_ctrl.list(queue, marker=marker)
+    messages = list(next(interaction))
+    assert not messages, 'Idle queue %s has new messages' % queue
+
+
+def _run_case(conf, msg_ctrl, counter, markers_by_queue, watcher):
+    msg_ctrl._marker_watcher = watcher
+
+    samples = []
+    commands = counter.count
+
+    for __ in range(conf.polls):
+        for queue, marker in markers_by_queue.items():
+            __, elapsed = helpers.timed(_poll, msg_ctrl, queue, marker)
+            samples.append(elapsed)
+
+    polls = len(samples)
+    row = {'watcher': 'off' if watcher is None else 'on',
+           'round_trips': (counter.count - commands) / polls}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot, counter):
+    storage = boot.storage
+    driver = getattr(storage, '_storage', storage)
+    msg_ctrl = driver.message_controller
+
+    watcher = markers.MarkerWatcher(msg_ctrl._collections)
+    watcher.start()
+
+    queues = [helpers.new_queue_name('bench-list-poll')
+              for __ in range(conf.queues)]
+    markers_by_queue = {}
+
+    try:
+        for queue in queues:
+            storage.queue_controller.create(queue)
+            msg_ctrl.post(queue, [{'ttl': 3600, 'body': {'n': i}}
+                                  for i in range(3)], 'bench')
+
+            interaction = msg_ctrl.list(queue)
+            list(next(interaction))
+            markers_by_queue[queue] = next(interaction)
+
+        deadline = time.time() + conf.watch_timeout
+        while not watcher.ready:
+            if time.time() > deadline:
+                raise RuntimeError('The change streams did not open, is '
+                                   'MongoDB running as a replica set?')
+            time.sleep(0.1)
+
+        return [_run_case(conf, msg_ctrl, counter, markers_by_queue, None),
+                _run_case(conf, msg_ctrl, counter, markers_by_queue,
+                          watcher)]
+
+    finally:
+        for queue in queues:
+            storage.queue_controller.delete(queue)
+
+
+def main():
+    # NOTE: Must be called before any client is created
+    counter = helpers.count_mongodb_commands()
+
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-list-poll',
+                                           _CLI_OPTIONS)
+
+    helpers.print_table('Polling %d idle queues %d times each' %
+                        (conf.queues, conf.polls),
+                        ['watcher', 'count', 'p50_ms', 'p99_ms',
+                         'round_trips'],
+                        run(conf, boot, counter))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Email delivery throughput against a local stub SMTP server.
+
+Posts of ``--batch_size`` messages are fanned out to a number of email
+subscribers (20 by default) through a pool of notifier workers, the way
+the notifier does. The deliveries are made once by running
+``--command`` for each email, once through the stub SMTP server, and
+once through the stub SMTP server with a digest window.
+
+The command gets the emails on its standard input and drops them, so
+its figures only account for starting a process per email, which is
+less than what sendmail costs.
+
+This benchmark does not need a database.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.mailto_delivery \\
+        --subscribers 20 --posts 50 --batch_size 10
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+import futurist
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar.common import configs
+from zaqar.notification.tasks import mailto
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('subscribers', default=20,
+               help='Number of email subscribers.'),
+    cfg.IntOpt('posts', default=50,
+               help='Number of posts to deliver in each mode.'),
+    cfg.IntOpt('batch_size', default=10,
+               help='Number of messages per post.'),
+    cfg.StrOpt('command', default='dd of=/dev/null status=none',
+               help='Command to run for each email in the command mode.'),
+    cfg.FloatOpt('digest_window', default=0.5,
+                 help='Number of seconds of the digest window in the '
+                      'digest mode.'),
+)
+
+
+def _run_mode(conf, port, server, mode):
+    group = configs._NOTIFICATION_GROUP
+    conf.set_override('smtp_command', conf.command, group=group)
+    conf.set_override('smtp_host',
+                      None if mode == 'command' else '127.0.0.1',
+                      group=group)
+    conf.set_override('smtp_port', port, group=group)
+    conf.set_override('smtp_digest_window',
+                      conf.digest_window if mode == 'digest' else 0,
+                      group=group)
+
+    task = mailto.MailtoTask()
+    subscriptions = [{'subscriber': 'mailto:bench-%d@example.com' % i,
+                      'source': 'bench',
+                      'options': {'from': 'zaqar@example.com'}}
+                     for i in range(conf.subscribers)]
+
+    executor = futurist.ThreadPoolExecutor(
+        max_workers=conf.notification.max_notifier_workers)
+
+    emails = server.emails
+    sessions = server.sessions
+    start = time.time()
+
+    for i in range(conf.posts):
+        messages = [{'ttl': 300, 'body': {'event': i, 'n': n}}
+                    for n in range(conf.batch_size)]
+        for subscription in subscriptions:
+            executor.submit(task.execute, subscription, messages,
+                            conf=conf)
+
+    executor.shutdown(wait=True)
+
+    # NOTE: Wait for the digests to be sent. threading.Timer is a
+    # factory function on Python 2.
+    timer_class = getattr(threading, '_Timer', threading.Timer)
+    for thread in threading.enumerate():
+        if isinstance(thread, timer_class):
+            thread.join()
+
+    elapsed = time.time() - start
+
+    deliveries = conf.posts * conf.subscribers * conf.batch_size
+    return {'mode': mode,
+            'emails': server.emails - emails,
+            'sessions': server.sessions - sessions,
+            'elapsed_s': elapsed,
+            'deliveries_per_s': deliveries / elapsed}
+
+
+def run(conf):
+    port, server = helpers.stub_smtp_server()
+
+    try:
+        return [_run_mode(conf, port, server, mode)
+                for mode in ('command', 'smtp', 'digest')]
+    finally:
+        server.shutdown()
+
+
+def main():
+    conf = cfg.CONF
+    conf.register_cli_opts(_CLI_OPTIONS)
+    conf.register_opts(configs._NOTIFICATION_OPTIONS,
+                       group=configs._NOTIFICATION_GROUP)
+    conf(project='zaqar', prog='zaqar-bench-mailto-delivery')
+
+    helpers.print_table('Delivering %d posts of %d messages to %d email '
+                        'subscribers' % (conf.posts, conf.batch_size,
+                                         conf.subscribers),
+                        ['mode', 'emails', 'sessions', 'elapsed_s',
+                         'deliveries_per_s'],
+                        run(conf))
+
+
+if __name__ == '__main__':
+    main()
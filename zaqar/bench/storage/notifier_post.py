@@ -0,0 +1,136 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Post latency to a queue with many webhook subscribers.
+
+The messages pipeline runs the notifier, and the queue gets a number
+of webhook subscribers (50 by default), all pointing to a local stub
+HTTP server. Messages are then posted one at a time, once with the
+previous task lookup (load the task from its entry point for every
+subscriber on every post) and once with the current one. The post
+latency includes dispatching the notifications, not delivering them.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.notifier_post --config-file zaqar.conf \\
+        --subscribers 50 --posts 200
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import uuid
+
+from oslo_config import cfg
+from stevedore import driver
+
+from zaqar.bench.storage import helpers
+from zaqar import bootstrap
+from zaqar.notification import notifier
+from zaqar.storage import pipeline
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('subscribers', default=50,
+               help='Number of webhook subscribers of the queue.'),
+    cfg.IntOpt('posts', default=200,
+               help='Number of messages to post in each mode.'),
+    cfg.FloatOpt('drain_timeout', default=60.0,
+                 help='Number of seconds to wait for the notifications '
+                      'to be delivered after each mode.'),
+)
+
+
+def _legacy_get_task(scheme):
+    """The task lookup this benchmark compares against."""
+
+    mgr = driver.DriverManager('zaqar.notification.tasks', scheme,
+                               invoke_on_load=True)
+    return mgr.driver
+
+
+def _run_mode(conf, url, server, legacy):
+    notifier._TASKS.clear()
+
+    storage = bootstrap.Bootstrap(conf).storage
+    queue_ctrl = storage.queue_controller
+    message_ctrl = storage.message_controller
+    subscription_ctrl = storage.subscription_controller
+    client_uuid = str(uuid.uuid4())
+
+    queue = helpers.new_queue_name('bench-notifier-post')
+    queue_ctrl.create(queue)
+
+    for i in range(conf.subscribers):
+        subscription_ctrl.create(queue, '%s?s=%d' % (url, i), 3600, {})
+
+    samples = []
+    delivered = server.requests
+    expected = delivered + conf.subscribers * conf.posts
+
+    get_task = notifier.get_task
+    if legacy:
+        notifier.get_task = _legacy_get_task
+
+    try:
+        start = time.time()
+        for i in range(conf.posts):
+            __, elapsed = helpers.timed(
+                message_ctrl.post, queue,
+                [{'ttl': 300, 'body': {'event': i}}], client_uuid)
+            samples.append(elapsed)
+
+        deadline = time.time() + conf.drain_timeout
+        while server.requests < expected and time.time() < deadline:
+            time.sleep(0.05)
+
+        elapsed = time.time() - start
+
+    finally:
+        notifier.get_task = get_task
+        queue_ctrl.delete(queue)
+
+    row = {'lookup': 'legacy' if legacy else 'current',
+           'delivered': server.requests - delivered,
+           'deliveries_per_s': (server.requests - delivered) / elapsed}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf):
+    url, server = helpers.stub_http_server()
+
+    try:
+        return [_run_mode(conf, url, server, legacy)
+                for legacy in (True, False)]
+    finally:
+        server.shutdown()
+
+
+def main():
+    conf, __ = helpers.bootstrap_storage('zaqar-bench-notifier-post',
+                                         _CLI_OPTIONS)
+    conf.register_opts(pipeline._PIPELINE_CONFIGS,
+                       group=pipeline._PIPELINE_GROUP)
+    conf.set_override('message_pipeline', ['zaqar.notification.notifier'],
+                      group=pipeline._PIPELINE_GROUP)
+
+    helpers.print_table('Posting to a queue with %d webhook subscribers' %
+                        conf.subscribers,
+                        ['lookup', 'count', 'p50_ms', 'p99_ms', 'max_ms',
+                         'delivered', 'deliveries_per_s'],
+                        run(conf))
+
+
+if __name__ == '__main__':
+    main()
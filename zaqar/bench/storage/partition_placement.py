@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Distribution of queues over MongoDB partitions for each placement mode.
+
+A large number of queue names (1M by default) are placed on a number of
+partitions, with the ``modulo`` placement and with the ``ring``
+placement for several numbers of points per partition. For each, the
+benchmark reports how evenly the queues are spread, the share of the
+queues that would move if one partition was added, and the cost of a
+lookup.
+
+This benchmark does not need a database.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.partition_placement \\
+        --queues 1000000 --partitions 4
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import math
+import time
+
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar.storage.mongodb import partitions
+from zaqar.storage.mongodb import utils
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('queues', default=1000000,
+               help='Number of queue names to place.'),
+    cfg.IntOpt('projects', default=1000,
+               help='Number of projects the queues belong to.'),
+    cfg.IntOpt('partitions', default=4,
+               help='Number of partitions to place queues on.'),
+    cfg.ListOpt('vnodes', default=['16', '64', '128', '256'],
+                help='Numbers of points per partition to try on the ring.'),
+)
+
+
+def _modulo(num_partitions):
+    def get_partition(queue, project):
+        return utils.get_partition(num_partitions, queue, project)
+
+    return get_partition
+
+
+def _ring(num_partitions, vnodes):
+    ring = partitions.HashRing(num_partitions, vnodes)
+
+    def get_partition(queue, project):
+        return ring.get_partition(project + queue)
+
+    return get_partition
+
+
+def _run_case(names, placement, new_placement, num_partitions):
+    start = time.time()
+    placed = [placement(queue, project) for project, queue in names]
+    elapsed = time.time() - start
+
+    counts = collections.Counter(placed)
+    sizes = [counts[partition] for partition in range(num_partitions)]
+    mean = len(names) / num_partitions
+    stddev = math.sqrt(sum((size - mean) ** 2 for size in sizes) /
+                       num_partitions)
+
+    moved = sum(1 for (project, queue), partition in zip(names, placed)
+                if new_placement(queue, project) != partition)
+
+    return {'min_pct': min(sizes) / mean * 100,
+            'max_pct': max(sizes) / mean * 100,
+            'stddev_pct': stddev / mean * 100,
+            'moved_pct': moved / len(names) * 100,
+            'lookup_us': elapsed / len(names) * 10 ** 6}
+
+
+def run(conf):
+    names = [('project-%d' % (i % conf.projects), 'queue-%d' % i)
+             for i in range(conf.queues)]
+
+    count = conf.partitions
+
+    row = {'placement': 'modulo'}
+    row.update(_run_case(names, _modulo(count), _modulo(count + 1), count))
+    rows = [row]
+
+    for vnodes in map(int, conf.vnodes):
+        row = {'placement': 'ring/%d' % vnodes}
+        row.update(_run_case(names, _ring(count, vnodes),
+                             _ring(count + 1, vnodes), count))
+        rows.append(row)
+
+    return rows
+
+
+def main():
+    conf = cfg.CONF
+    conf.register_cli_opts(_CLI_OPTIONS)
+    conf(project='zaqar', prog='zaqar-bench-partition-placement')
+
+    helpers.print_table('Placing %d queues on %d partitions, then adding '
+                        'one' % (conf.queues, conf.partitions),
+                        ['placement', 'min_pct', 'max_pct', 'stddev_pct',
+                         'moved_pct', 'lookup_us'],
+                        run(conf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latency of popping messages with the mongodb driver.
+
+Messages are popped 1, 10 and 20 at a time, once with the previous
+implementation, which removed messages one find_and_modify at a time,
+and once with the current batched one. The number of commands sent to
+MongoDB per pop is counted with a pymongo command listener.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.pop --config-file zaqar.conf \\
+        --pops 200
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from zaqar.bench.storage import helpers
+from zaqar.storage.mongodb import messages
+from zaqar.storage.mongodb import utils
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('pops', default=200,
+               help='Number of pops to time for each pop size.'),
+)
+
+POP_SIZES = (1, 10, 20)
+
+
+def _legacy_pop(controller, queue, limit):
+    """The pop implementation this benchmark compares against."""
+
+    now = timeutils.utcnow_ts()
+    query = {
+        'p_q': utils.scope_queue_name(queue),
+        'c.e': {'$lte': now},
+    }
+
+    collection = controller._collection(queue)
+    projection = {'_id': 1, 't': 1, 'b': 1, 'c.id': 1}
+
+    popped = (collection.find_and_modify(query, projection=projection,
+                                         remove=True)
+              for __ in range(limit))
+
+    return [messages._basic_message(msg, now) for msg in popped if msg]
+
+
+def _run_case(conf, storage, counter, size, legacy):
+    driver = getattr(storage, '_storage', storage)
+    controller = driver.message_controller
+
+    if legacy:
+        def pop(queue):
+            return _legacy_pop(controller, queue, size)
+    else:
+        def pop(queue):
+            return controller.pop(queue, size)
+
+    queue = helpers.new_queue_name('bench-pop')
+    storage.queue_controller.create(queue)
+
+    batch = [{'ttl': 600, 'body': {'event': i}} for i in range(size)]
+    for __ in range(conf.pops):
+        controller.post(queue, batch, 'bench')
+
+    samples = []
+    popped = 0
+
+    try:
+        commands = counter.count
+        for __ in range(conf.pops):
+            msgs, elapsed = helpers.timed(pop, queue)
+            samples.append(elapsed)
+            popped += len(msgs)
+
+        commands = counter.count - commands
+
+    finally:
+        storage.queue_controller.delete(queue)
+
+    row = {'size': size,
+           'implementation': 'legacy' if legacy else 'batched',
+           'round_trips': commands / conf.pops,
+           'popped': popped}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot, counter):
+    storage = boot.storage
+    return [_run_case(conf, storage, counter, size, legacy)
+            for size in POP_SIZES
+            for legacy in (True, False)]
+
+
+def main():
+    # NOTE: Must be called before any client is created
+    counter = helpers.count_mongodb_commands()
+
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-pop', _CLI_OPTIONS)
+
+    helpers.print_table('Popping messages',
+                        ['size', 'implementation', 'count', 'p50_ms',
+                         'p99_ms', 'max_ms', 'round_trips', 'popped'],
+                        run(conf, boot, counter))
+
+
+if __name__ == '__main__':
+    main()
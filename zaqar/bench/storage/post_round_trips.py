@@ -0,0 +1,124 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Round trips and throughput of posting messages with the mongodb driver.
+
+Posts go straight to the message controller of the ``mongodb`` driver,
+once with the previous post path (check that the queue exists, make
+sure the counter exists, then increment it) and once with the current
+one, which reserves the markers with a single counter update. The
+number of commands sent to MongoDB is counted with a pymongo command
+listener.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.post_round_trips \\
+        --config-file zaqar.conf --posts 2000
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import time
+import uuid
+
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar.storage import errors
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('posts', default=1000,
+               help='Number of posts to time in each mode.'),
+    cfg.IntOpt('batch', default=1,
+               help='Number of messages per post.'),
+)
+
+
+def _legacy_reserve(controller):
+    def reserve(queue_name, project=None, amount=1):
+        if not controller._queue_ctrl.exists(queue_name, project):
+            raise errors.QueueDoesNotExist(queue_name, project)
+
+        controller._get_counter(queue_name, project)
+        marker = controller._inc_counter(queue_name, project, amount=amount)
+        return marker - amount, None
+
+    return reserve
+
+
+def _run_mode(conf, storage, counter, legacy):
+    driver = getattr(storage, '_storage', storage)
+    controller = driver.message_controller
+
+    queue = helpers.new_queue_name('bench-post-round-trips')
+    storage.queue_controller.create(queue)
+
+    client_uuid = str(uuid.uuid4())
+    messages = [{'ttl': 300, 'body': {'event': i}}
+                for i in range(conf.batch)]
+
+    if legacy:
+        controller._reserve_markers = _legacy_reserve(controller)
+
+    samples = []
+
+    try:
+        # NOTE: Warm up the queue caches
+        controller.post(queue, messages, client_uuid)
+
+        commands = counter.count
+        start = time.time()
+
+        for __ in range(conf.posts):
+            __, elapsed = helpers.timed(controller.post, queue,
+                                        messages, client_uuid)
+            samples.append(elapsed)
+
+        duration = time.time() - start
+        commands = counter.count - commands
+
+    finally:
+        if legacy:
+            del controller._reserve_markers
+
+        storage.queue_controller.delete(queue)
+
+    row = {'mode': 'legacy' if legacy else 'collapsed',
+           'round_trips': commands / conf.posts,
+           'posts_per_sec': conf.posts / duration}
+    row.update(helpers.summarize(samples))
+    return row
+
+
+def run(conf, boot, counter):
+    storage = boot.storage
+    return [_run_mode(conf, storage, counter, legacy)
+            for legacy in (True, False)]
+
+
+def main():
+    # NOTE: Must be called before any client is created
+    counter = helpers.count_mongodb_commands()
+
+    conf, boot = helpers.bootstrap_storage('zaqar-bench-post-round-trips',
+                                           _CLI_OPTIONS)
+
+    helpers.print_table('Posting %d message(s) at a time' % conf.batch,
+                        ['mode', 'count', 'p50_ms', 'p99_ms', 'max_ms',
+                         'round_trips', 'posts_per_sec'],
+                        run(conf, boot, counter))
+
+
+if __name__ == '__main__':
+    main()
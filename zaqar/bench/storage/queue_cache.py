@@ -0,0 +1,113 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latency of the hot POST/GET message path with and without the
+in-process queue cache.
+
+Each iteration looks up the queue metadata and posts a message, the way
+the v2 messages resource does, and then lists and gets messages, which
+check that the queue exists first. The same workload runs once with the
+``[queue_cache]`` disabled and once with it enabled.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.queue_cache --config-file zaqar.conf \\
+        --iterations 2000
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import uuid
+
+from oslo_config import cfg
+
+from zaqar.bench.storage import helpers
+from zaqar import bootstrap
+from zaqar.common import configs
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('iterations', default=1000,
+               help='Number of POST/GET iterations to time in each mode.'),
+)
+
+
+def _run_mode(conf, enabled):
+    conf.set_override('enabled', enabled, group=configs._QUEUE_CACHE_GROUP)
+    boot = bootstrap.Bootstrap(conf)
+    storage = boot.storage
+
+    queue_ctrl = storage.queue_controller
+    message_ctrl = storage.message_controller
+    client_uuid = str(uuid.uuid4())
+
+    queue = helpers.new_queue_name('bench-queue-cache')
+    queue_ctrl.create(queue, metadata={'_max_messages_post_size': 65536})
+
+    post_samples = []
+    get_samples = []
+
+    try:
+        for i in range(conf.iterations):
+            def post():
+                queue_ctrl.get_metadata(queue)
+                return message_ctrl.post(
+                    queue, [{'ttl': 300, 'body': {'event': i}}],
+                    client_uuid)
+
+            msg_ids, elapsed = helpers.timed(post)
+            post_samples.append(elapsed)
+
+            def get():
+                next(message_ctrl.list(queue, limit=1, echo=True,
+                                       client_uuid=client_uuid))
+                message_ctrl.get(queue, msg_ids[0])
+
+            __, elapsed = helpers.timed(get)
+            get_samples.append(elapsed)
+
+    finally:
+        queue_ctrl.delete(queue)
+
+    stats = {'hits': 0, 'misses': 0}
+    if boot.control.queue_cache is not None:
+        stats = boot.control.queue_cache.stats()
+
+    rows = []
+    for op, samples in (('post', post_samples), ('get', get_samples)):
+        row = {'cache': 'on' if enabled else 'off', 'op': op,
+               'hits': stats['hits'], 'misses': stats['misses']}
+        row.update(helpers.summarize(samples))
+        rows.append(row)
+
+    return rows
+
+
+def run(conf):
+    return _run_mode(conf, False) + _run_mode(conf, True)
+
+
+def main():
+    conf, __ = helpers.bootstrap_storage('zaqar-bench-queue-cache',
+                                         _CLI_OPTIONS)
+    conf.register_opts(configs._QUEUE_CACHE_OPTIONS,
+                       group=configs._QUEUE_CACHE_GROUP)
+
+    helpers.print_table('Hot POST/GET path with and without the queue cache',
+                        ['cache', 'op', 'count', 'p50_ms', 'p99_ms',
+                         'max_ms', 'hits', 'misses'],
+                        run(conf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Webhook delivery throughput against a local stub HTTP server.
+
+Posts of ``--batch_size`` messages are fanned out to a number of
+webhook subscribers (20 by default) through a pool of notifier
+workers, the way the notifier does. The deliveries are made once with
+the previous webhook task (a new connection for every message), once
+with the current one, and once with the current one and the
+``post_batch`` subscription option.
+
+This benchmark does not need a database.
+
+Usage::
+
+    $ python -m zaqar.bench.storage.webhook_delivery \\
+        --subscribers 20 --posts 50 --batch_size 10
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import time
+
+import futurist
+from oslo_config import cfg
+import requests
+
+from zaqar.bench.storage import helpers
+from zaqar.common import configs
+from zaqar.notification.tasks import webhook
+
+_CLI_OPTIONS = (
+    cfg.IntOpt('subscribers', default=20,
+               help='Number of webhook subscribers.'),
+    cfg.IntOpt('posts', default=50,
+               help='Number of posts to deliver in each mode.'),
+    cfg.IntOpt('batch_size', default=10,
+               help='Number of messages per post.'),
+    cfg.FloatOpt('delay', default=0.0,
+                 help='Number of seconds the stub server waits before '
+                      'answering each request.'),
+)
+
+
+class _LegacyWebhookTask(object):
+    """The webhook task this benchmark compares against."""
+
+    def execute(self, subscription, messages, **kwargs):
+        headers = {'Content-Type': 'application/json'}
+        for msg in messages:
+            msg['queue_name'] = subscription['source']
+            requests.post(subscription['subscriber'],
+                          data=json.dumps(msg),
+                          headers=headers)
+
+
+def _run_mode(conf, url, server, mode):
+    task = _LegacyWebhookTask() if mode == 'legacy' else webhook.WebhookTask()
+    options = {'post_batch': True} if mode == 'batch' else {}
+    subscriptions = [{'subscriber': '%s?s=%d' % (url, i),
+                      'source': 'bench',
+                      'options': options}
+                     for i in range(conf.subscribers)]
+
+    executor = futurist.ThreadPoolExecutor(
+        max_workers=conf.notification.max_notifier_workers)
+
+    received = server.requests
+    start = time.time()
+
+    for i in range(conf.posts):
+        messages = [{'ttl': 300, 'body': {'event': i, 'n': n}}
+                    for n in range(conf.batch_size)]
+        for subscription in subscriptions:
+            executor.submit(task.execute, subscription, messages,
+                            conf=conf)
+
+    executor.shutdown(wait=True)
+    elapsed = time.time() - start
+
+    deliveries = conf.posts * conf.subscribers * conf.batch_size
+    return {'mode': mode,
+            'requests': server.requests - received,
+            'elapsed_s': elapsed,
+            'deliveries_per_s': deliveries / elapsed}
+
+
+def run(conf):
+    url, server = helpers.stub_http_server(conf.delay)
+
+    try:
+        return [_run_mode(conf, url, server, mode)
+                for mode in ('legacy', 'current', 'batch')]
+    finally:
+        server.shutdown()
+
+
+def main():
+    conf = cfg.CONF
+    conf.register_cli_opts(_CLI_OPTIONS)
+    conf.register_opts(configs._NOTIFICATION_OPTIONS,
+                       group=configs._NOTIFICATION_GROUP)
+    conf(project='zaqar', prog='zaqar-bench-webhook-delivery')
+
+    helpers.print_table('Delivering %d posts of %d messages to %d webhook '
+                        'subscribers' % (conf.posts, conf.batch_size,
+                                         conf.subscribers),
+                        ['mode', 'requests', 'elapsed_s',
+                         'deliveries_per_s'],
+                        run(conf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Manages the placement of queues on MongoDB message partitions.
+
+To add partitions to a deployment, or to switch to another placement
+mode:
+
+1. Run ``zaqar-partitions pin`` to pin every existing queue to the
+   partition that holds it.
+2. Change the ``partitions`` and placement options, and restart the
+   servers. Pinned queues stay where they are, new queues are placed
+   with the new options.
+3. Run ``zaqar-partitions pin`` again, in case queues were created by
+   servers that still had the old options.
+4. Run ``zaqar-partitions rebalance`` to move the pinned queues to the
+   partition they hash to. Queues stay available while they are moved.
+
+With pools, run the tool against the configuration of each MongoDB
+pool.
+"""
+
+from __future__ import print_function
+
+from oslo_config import cfg
+from oslo_log import log
+
+from zaqar import bootstrap
+from zaqar.common import cli
+from zaqar.storage.mongodb import driver as mongodb_driver
+from zaqar.storage.mongodb import partitions
+from zaqar.storage.mongodb import utils
+
+LOG = log.getLogger(__name__)
+
+
+def _pin(driver, conf):
+    print('Pinned %d queue(s)' % partitions.pin_queues(driver))
+
+
+def _rebalance(driver, conf):
+    moved = partitions.rebalance(driver,
+                                 settle_time=conf.command.settle_time)
+    print('Moved %d queue(s)' % moved)
+
+
+def _move(driver, conf):
+    scope = utils.scope_queue_name(conf.command.queue, conf.command.project)
+    partitions.move_queues(driver, [(scope, conf.command.partition)],
+                           settle_time=conf.command.settle_time)
+
+
+def _list(driver, conf):
+    for doc in driver.partition_placement.table.list():
+        moving = doc.get('m')
+        print('%s\t%d%s' % (doc[utils.PROJ_QUEUE_KEY], doc['p'],
+                            '' if moving is None else '\t(%d)' % moving))
+
+
+def _add_command_parsers(subparsers):
+    parser = subparsers.add_parser('pin')
+    parser.set_defaults(func=_pin)
+
+    parser = subparsers.add_parser('rebalance')
+    parser.add_argument('--settle-time', type=float)
+    parser.set_defaults(func=_rebalance)
+
+    parser = subparsers.add_parser('move')
+    parser.add_argument('--project')
+    parser.add_argument('--settle-time', type=float)
+    parser.add_argument('queue')
+    parser.add_argument('partition', type=int)
+    parser.set_defaults(func=_move)
+
+    parser = subparsers.add_parser('list')
+    parser.set_defaults(func=_list)
+
+
+@cli.runnable
+def run():
+    # Use the global CONF instance
+    conf = cfg.CONF
+    conf.register_cli_opt(cfg.SubCommandOpt('command',
+                                            title='Command',
+                                            help='Available commands',
+                                            handler=_add_command_parsers))
+    conf(project='zaqar', prog='zaqar-partitions')
+
+    server = bootstrap.Bootstrap(conf)
+
+    # NOTE: Skip the storage pipeline, if any
+    storage = getattr(server.storage, '_storage', server.storage)
+    if not isinstance(storage, mongodb_driver.DataDriver):
+        raise RuntimeError('zaqar-partitions only supports the mongodb '
+                           'message store')
+
+    LOG.debug(u'Running the %s command', conf.command.name)
+    conf.command.func(storage, conf)
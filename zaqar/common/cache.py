@@ -12,7 +12,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import threading
+
 from oslo_cache import core
+from oslo_utils import timeutils
 
 
 def register_config(conf):
@@ -22,3 +26,132 @@ def register_config(conf):
 def get_cache(conf):
     region = core.create_region()
     return core.configure_cache_region(conf, region)
+
+
+class LRUCache(object):
+    """Bounded in-process cache whose entries expire after a TTL.
+
+    Once max_entries is reached, the least recently used entry is
+    evicted to make room for a new one. Lookups return
+    `oslo_cache.core.NO_VALUE` on a miss, like an oslo.cache region.
+
+    :param max_entries: Maximum number of entries to keep
+    :param ttl: Number of seconds after which an entry expires
+    """
+
+    def __init__(self, max_entries, ttl):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        now = timeutils.now()
+
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return core.NO_VALUE
+
+            if expires <= now:
+                self.misses += 1
+                return core.NO_VALUE
+
+            # NOTE: Re-insert the entry to mark it most recently used
+            self._entries[key] = (expires, value)
+            self.hits += 1
+
+        return value
+
+    def set(self, key, value):
+        expires = timeutils.now() + self._ttl
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+            while len(self._entries) >= self._max_entries:
+                self._entries.popitem(last=False)
+
+            self._entries[key] = (expires, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the hit and miss counters and the number of entries."""
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries)}
+
+
+class CacheStats(object):
+    """Hit, miss and latency counters, kept per cache key prefix.
+
+    Counters are kept for each prefix as a dict with the following
+    items:
+
+    - ``local_hits``: lookups answered by the in-process cache
+    - ``hits``: lookups answered by the oslo.cache backend
+    - ``misses``: lookups that had to load the value
+    - ``lookup_seconds``: total time spent querying the backend
+    - ``load_seconds``: total time spent loading values on a miss
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def record(self, prefix, **increments):
+        with self._lock:
+            try:
+                counters = self._counters[prefix]
+            except KeyError:
+                counters = self._counters[prefix] = {
+                    'local_hits': 0,
+                    'hits': 0,
+                    'misses': 0,
+                    'lookup_seconds': 0.0,
+                    'load_seconds': 0.0,
+                }
+
+            for name, value in increments.items():
+                counters[name] += value
+
+    def snapshot(self):
+        """Return a copy of the counters, keyed by prefix."""
+
+        with self._lock:
+            return dict((prefix, dict(counters))
+                        for prefix, counters in self._counters.items())
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+# NOTE: Counters for every cached getter in the process
+STATS = CacheStats()
+
+
+def key_prefix(key):
+    """Return the prefix of a cache key, e.g. 'pooling:'.
+
+    Cache keys are expected to start with a prefix ending in a colon;
+    keys without one are counted under their full value.
+    """
+
+    return key[:key.find(':') + 1] or key
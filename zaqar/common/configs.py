@@ -62,6 +62,30 @@ _NOTIFICATION_OPTIONS = (
     cfg.StrOpt('smtp_command', default='/usr/sbin/sendmail -t -oi',
                help=('The command of smtp to send email. The format is '
                      '"command_name arg1 arg2".')),
+    cfg.StrOpt('smtp_host',
+               help='Host of the SMTP relay to send emails through. Emails '
+                    'are then sent over kept-alive connections, with the '
+                    'emails of a notification sent in one session. When '
+                    'not set, smtp_command is run once per email.'),
+    cfg.PortOpt('smtp_port', default=25,
+                help='Port of the SMTP relay.'),
+    cfg.BoolOpt('smtp_starttls', default=False,
+                help='Switch the connections to the SMTP relay to TLS.'),
+    cfg.StrOpt('smtp_username',
+               help='User name to log in to the SMTP relay with, if it '
+                    'requires authentication.'),
+    cfg.StrOpt('smtp_password', secret=True,
+               help='Password to log in to the SMTP relay with.'),
+    cfg.FloatOpt('smtp_timeout', default=10.0, min=0.0,
+                 help='Number of seconds to wait for the SMTP relay.'),
+    cfg.IntOpt('smtp_max_connections', default=4, min=1,
+               help='Maximum number of connections to the SMTP relay.'),
+    cfg.FloatOpt('smtp_digest_window', default=0.0, min=0.0,
+                 help='Number of seconds during which the notifications to '
+                      'an email subscriber are combined into one email, as '
+                      'a JSON array. Notifications waiting for their email '
+                      'are lost if the server stops. 0 sends one email per '
+                      'message.'),
     cfg.IntOpt('max_notifier_workers', default=10,
                help='The max amount of the notification workers.'),
     cfg.BoolOpt('require_confirmation', default=False,
@@ -100,11 +124,108 @@ _NOTIFICATION_OPTIONS = (
                      "a mapping is {0} -> queue name, {1} ->project id, "
                      "{2}-> confirm url in body string. User can use any of "
                      "the three value. But they can't use more than three."),
+    cfg.FloatOpt('webhook_connect_timeout', default=5.0, min=0.0,
+                 help='Number of seconds to wait for the connection to a '
+                      'webhook subscriber to be established.'),
+    cfg.FloatOpt('webhook_read_timeout', default=10.0, min=0.0,
+                 help='Number of seconds to wait for a webhook subscriber '
+                      'to answer a notification.'),
+    cfg.IntOpt('webhook_max_retries', default=3, min=0,
+               help='Number of times a webhook notification is sent again '
+                    'when the connection fails, times out, or the '
+                    'subscriber answers with a 429, 500, 502, 503 or 504 '
+                    'status.'),
+    cfg.FloatOpt('webhook_retry_backoff', default=1.0, min=0.0,
+                 help='Number of seconds to wait before the first retry of '
+                      'a webhook notification. The wait doubles with each '
+                      'retry.'),
+    cfg.IntOpt('webhook_max_concurrency', default=4, min=1,
+               help='Maximum number of notifications sent at the same time '
+                    'to each webhook subscriber. Connections are kept alive '
+                    'and shared between the notifications sent to the same '
+                    'host.'),
+    cfg.BoolOpt('outbox', default=False,
+                help='Record the notifications to send in a queue of the '
+                     'message store, and send them from background workers, '
+                     'instead of looking the subscribers up and notifying '
+                     'them while posting messages. Notifications are then '
+                     'sent at least once, even if the server restarts.'),
+    cfg.StrOpt('outbox_queue', default='notification-outbox',
+               help='Name of the queue the notification outbox lives in.'),
+    cfg.StrOpt('outbox_project', default='zaqar-internal',
+               help='Project of the queue the notification outbox lives '
+                    'in.'),
+    cfg.IntOpt('outbox_workers', default=2, min=0,
+               help='Number of workers sending the notifications of the '
+                    'outbox. Set to 0 on servers that should only record '
+                    'notifications, for other servers to send.'),
+    cfg.IntOpt('outbox_batch_size', default=10, min=1,
+               help='Maximum number of outbox entries a worker takes at '
+                    'once.'),
+    cfg.IntOpt('outbox_claim_ttl', default=60, min=1,
+               help='Number of seconds a worker has to send the '
+                    'notifications of the outbox entries it took, before '
+                    'they are sent again by another worker.'),
+    cfg.FloatOpt('outbox_poll_interval', default=1.0, min=0.0,
+                 help='Number of seconds an idle worker waits before looking '
+                      'for new outbox entries.'),
+    cfg.IntOpt('outbox_entry_ttl', default=86400, min=60,
+               help='Number of seconds after which the notifications of an '
+                    'outbox entry are dropped if they were not sent.'),
 )
 
 _NOTIFICATION_GROUP = 'notification'
 
 
+_QUEUE_CACHE_OPTIONS = (
+    cfg.BoolOpt('enabled', default=True,
+                help=('Cache queue existence and metadata lookups '
+                      'in-process, in front of the management store. '
+                      'Changes made through other processes may take '
+                      'up to ``ttl`` seconds to be seen.')),
+    cfg.IntOpt('max_entries', default=10000, min=1,
+               help='Maximum number of queues to keep in the cache.'),
+    cfg.IntOpt('ttl', default=5, min=1,
+               help=('Number of seconds after which a cached queue '
+                     'entry expires.')),
+)
+
+_QUEUE_CACHE_GROUP = 'queue_cache'
+
+
+_SUBSCRIPTION_CACHE_OPTIONS = (
+    cfg.BoolOpt('enabled', default=True,
+                help=('Cache the subscriptions of each queue in-process '
+                      'for the notifier, instead of listing them from the '
+                      'message store for every posted message. Changes '
+                      'made through other processes may take up to '
+                      '``ttl`` seconds to be seen.')),
+    cfg.IntOpt('max_entries', default=10000, min=1,
+               help='Maximum number of queues to keep in the cache.'),
+    cfg.IntOpt('ttl', default=5, min=1,
+               help=('Number of seconds after which the cached '
+                     'subscriptions of a queue expire.')),
+)
+
+_SUBSCRIPTION_CACHE_GROUP = 'subscription_cache'
+
+
+_HEALTH_OPTIONS = (
+    cfg.IntOpt('kpi_cache_ttl', default=30, min=0,
+               help=('Number of seconds the storage KPIs reported by the '
+                     'health API are cached for. Stale KPIs are returned '
+                     'while they are refreshed in the background. Set to 0 '
+                     'to compute them on every request.')),
+    cfg.IntOpt('probe_interval', default=60, min=0,
+               help=('Minimum number of seconds between two runs of the '
+                     'synthetic operations probe, which is only run when '
+                     'the health API is asked for it. Requests in between '
+                     'get the result of the last run.')),
+)
+
+_HEALTH_GROUP = 'health'
+
+
 _PROFILER_OPTIONS = [
     cfg.BoolOpt("trace_wsgi_transport", default=False,
                 help="If False doesn't trace any transport requests."
@@ -123,4 +244,7 @@ def _config_options():
             (_DRIVER_GROUP, _DRIVER_OPTIONS),
             (_SIGNED_URL_GROUP, _SIGNED_URL_OPTIONS),
             (_NOTIFICATION_GROUP, _NOTIFICATION_OPTIONS),
+            (_QUEUE_CACHE_GROUP, _QUEUE_CACHE_OPTIONS),
+            (_SUBSCRIPTION_CACHE_GROUP, _SUBSCRIPTION_CACHE_OPTIONS),
+            (_HEALTH_GROUP, _HEALTH_OPTIONS),
             (_PROFILER_GROUP, _PROFILER_OPTIONS)]
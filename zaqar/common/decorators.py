@@ -13,13 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import functools
 
 import msgpack
 from oslo_cache import core
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import timeutils
 
+from zaqar.common import cache
 from zaqar.i18n import _LW
 
 
@@ -87,6 +90,14 @@ def caches(keygen, ttl, cond=None):
     getter must return a value that can be encoded with
     msgpack.
 
+    If the containing class also defines an attribute named
+    `_local_cache` that is an instance of
+    `zaqar.common.cache.LRUCache`, it is used as a first tier in
+    front of the oslo_cache backend. Values found there are neither
+    fetched from the backend nor decoded. Its entries expire
+    according to the TTL the LRU cache was created with, which
+    should be shorter than `ttl`.
+
     Note that you can also flag a remover method such that it
     will purge an associated item from the cache, e.g.::
 
@@ -106,6 +117,20 @@ def caches(keygen, ttl, cond=None):
             def del_project(self, user, project=None):
                 self._db.delete_project(user, project)
 
+    Purging goes through both tiers. Other processes only see the
+    purge once their own in-process entry expires, unless the
+    containing class defines a `_cache_purge_hook` attribute. When
+    set, it is called with the purged key, e.g. to tell other
+    processes to delete that key from their `_local_cache`.
+
+    Values loaded in bulk can be stored through the `prime` function
+    of the decorated getter, e.g.::
+
+        Project.get_project.prime(instance, {('kgriffs', None): value})
+
+    Hits, misses and time spent are counted per key prefix in
+    `zaqar.common.cache.STATS`.
+
     :param keygen: A static key generator function. This function
         must accept the same arguments as the getter, sans `self`.
     :param ttl: TTL for the cache entry, in seconds.
@@ -122,8 +147,19 @@ def caches(keygen, ttl, cond=None):
             key = keygen(*args, **kwargs)
             self._cache.delete(key)
 
-            # Remove/delete from origin
-            remover(self, *args, **kwargs)
+            try:
+                # Remove/delete from origin
+                remover(self, *args, **kwargs)
+            finally:
+                # NOTE: Purge the in-process tier last, so that a
+                # concurrent lookup can not put the old value back.
+                local_cache = getattr(self, '_local_cache', None)
+                if local_cache is not None:
+                    local_cache.delete(key)
+
+                purge_hook = getattr(self, '_cache_purge_hook', None)
+                if purge_hook is not None:
+                    purge_hook(key)
 
         return wrapper
 
@@ -132,10 +168,25 @@ def caches(keygen, ttl, cond=None):
         @functools.wraps(getter)
         def wrapper(self, *args, **kwargs):
             key = keygen(*args, **kwargs)
+            prefix = cache.key_prefix(key)
+
+            local_cache = getattr(self, '_local_cache', None)
+            if local_cache is not None:
+                value = local_cache.get(key)
+                if value is not core.NO_VALUE:
+                    cache.STATS.record(prefix, local_hits=1)
+                    return copy.deepcopy(value)
+
+            start = timeutils.now()
             packed_value = self._cache.get(key, expiration_time=ttl)
+            lookup_seconds = timeutils.now() - start
 
             if packed_value is core.NO_VALUE:
+                start = timeutils.now()
                 value = getter(self, *args, **kwargs)
+                cache.STATS.record(prefix, misses=1,
+                                   lookup_seconds=lookup_seconds,
+                                   load_seconds=timeutils.now() - start)
 
                 # Cache new value if desired
                 if cond is None or cond(value):
@@ -147,13 +198,111 @@ def caches(keygen, ttl, cond=None):
                     packed_value = msgpack.packb(value, use_bin_type=True)
 
                     self._cache.set(key, packed_value)
+
+                    if local_cache is not None:
+                        local_cache.set(key, copy.deepcopy(value))
             else:
+                cache.STATS.record(prefix, hits=1,
+                                   lookup_seconds=lookup_seconds)
+
                 # NOTE(kgriffs): unpackb does not default to UTF-8,
                 # so we have to explicitly ask for it.
                 value = msgpack.unpackb(packed_value, encoding='utf-8')
 
+                if local_cache is not None:
+                    local_cache.set(key, copy.deepcopy(value))
+
             return value
 
+        def prime(self, values):
+            """Store values that were loaded by other means.
+
+            :param values: A dict mapping tuples of getter arguments,
+                sans `self`, to the corresponding values.
+            """
+
+            local_cache = getattr(self, '_local_cache', None)
+            packed_values = {}
+
+            for args, value in values.items():
+                key = keygen(*args)
+                packed_values[key] = msgpack.packb(value, use_bin_type=True)
+
+                if local_cache is not None:
+                    local_cache.set(key, copy.deepcopy(value))
+
+            if packed_values:
+                self._cache.set_multi(packed_values)
+
+        wrapper.purges = purges_prop
+        wrapper.prime = prime
+        return wrapper
+
+    return prop
+
+
+def caches_locally(keygen, cond=None):
+    """Flags a getter method as being cached in-process.
+
+    This works like `caches`, except that the containing class
+    is expected to define an attribute named `_local_cache` that
+    is either an instance of `zaqar.common.cache.LRUCache`, or
+    None to disable caching. Entries expire according to the TTL
+    the cache was created with.
+
+    Values are copied on the way in and out of the cache, so that
+    callers may modify what they get back. Like `caches`, the
+    decorated getter exposes a `purges` decorator; the entry is
+    purged once the remover returns or raises. Hits and misses are
+    also counted in `zaqar.common.cache.STATS`.
+
+    :param keygen: A static key generator function. This function
+        must accept the same arguments as the getter, sans `self`.
+    :param cond: Conditional for whether or not to cache the
+        value. Must be a function that takes a single value, and
+        returns True or False.
+    """
+
+    def purges_prop(remover):
+
+        @functools.wraps(remover)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return remover(self, *args, **kwargs)
+            finally:
+                # NOTE: Purge after the change has been made, so that
+                # a concurrent lookup can not cache the old value.
+                if self._local_cache is not None:
+                    self._local_cache.delete(keygen(*args, **kwargs))
+
+        return wrapper
+
+    def prop(getter):
+
+        @functools.wraps(getter)
+        def wrapper(self, *args, **kwargs):
+            local_cache = self._local_cache
+            if local_cache is None:
+                return getter(self, *args, **kwargs)
+
+            key = keygen(*args, **kwargs)
+            prefix = cache.key_prefix(key)
+            value = local_cache.get(key)
+
+            if value is core.NO_VALUE:
+                start = timeutils.now()
+                value = getter(self, *args, **kwargs)
+                cache.STATS.record(prefix, misses=1,
+                                   load_seconds=timeutils.now() - start)
+
+                if cond is None or cond(value):
+                    local_cache.set(key, copy.deepcopy(value))
+
+                return value
+
+            cache.STATS.record(prefix, local_hits=1)
+            return copy.deepcopy(value)
+
         wrapper.purges = purges_prop
         return wrapper
 
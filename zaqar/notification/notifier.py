@@ -14,9 +14,13 @@
 # limitations under the License.
 
 import enum
+import threading
+
 from stevedore import driver
 
 import futurist
+from futurist import waiters
+from oslo_cache import core
 from oslo_log import log as logging
 from six.moves import urllib_parse
 
@@ -24,6 +28,8 @@ from zaqar.common import auth
 from zaqar.common import urls
 from zaqar.i18n import _LE
 from zaqar.i18n import _LI
+from zaqar.notification import outbox
+from zaqar.storage import base as storage_base
 from zaqar.storage import pooling
 
 LOG = logging.getLogger(__name__)
@@ -37,6 +43,33 @@ class MessageType(enum.IntEnum):
     Notification = 3
 
 
+_TASKS = {}
+_TASKS_LOCK = threading.Lock()
+
+
+def get_task(scheme):
+    """Returns the notification task for a subscriber URI scheme.
+
+    Tasks are loaded from the `zaqar.notification.tasks` entry points
+    the first time their scheme is used, and shared afterwards.
+
+    :raises stevedore.exception.NoMatches: if no task handles `scheme`
+    """
+    try:
+        return _TASKS[scheme]
+    except KeyError:
+        pass
+
+    with _TASKS_LOCK:
+        if scheme not in _TASKS:
+            mgr = driver.DriverManager('zaqar.notification.tasks',
+                                       scheme,
+                                       invoke_on_load=True)
+            _TASKS[scheme] = mgr.driver
+
+        return _TASKS[scheme]
+
+
 class NotifierDriver(object):
     """Notifier which is responsible for sending messages to subscribers.
 
@@ -48,37 +81,87 @@ class NotifierDriver(object):
         self.executor = futurist.ThreadPoolExecutor(max_workers=max_workers)
         self.require_confirmation = kwargs.get('require_confirmation', False)
 
+        self.outbox = None
+        if (self.subscription_controller and
+                not isinstance(self.subscription_controller,
+                               pooling.SubscriptionController)):
+            data_driver = self.subscription_controller.driver
+            if data_driver.conf.notification.outbox:
+                self.outbox = outbox.Outbox(data_driver, data_driver.conf)
+                self.outbox.start(self._notify_and_wait)
+
     def post(self, queue_name, messages, client_uuid, project=None):
         """Send messages to the subscribers."""
         if self.subscription_controller:
             if not isinstance(self.subscription_controller,
                               pooling.SubscriptionController):
-                marker = None
-                while True:
-                    subscribers = self.subscription_controller.list(
-                        queue_name, project, marker=marker)
-                    for sub in next(subscribers):
-                        LOG.debug("Notifying subscriber %r" % (sub,))
-                        s_type = urllib_parse.urlparse(
-                            sub['subscriber']).scheme
-                        # If the subscriber doesn't contain 'confirmed', it
-                        # means that this kind of subscriber was created before
-                        # the confirm feature be introduced into Zaqar. We
-                        # should allow them be subscribed.
-                        if (self.require_confirmation and
-                                not sub.get('confirmed', True)):
-                            LOG.info(_LI('The subscriber %s is not '
-                                         'confirmed.'), sub['subscriber'])
-                            continue
-                        for msg in messages:
-                            msg['Message_Type'] = MessageType.Notification.name
-                        self._execute(s_type, sub, messages)
-                    marker = next(subscribers)
-                    if not marker:
-                        break
+                if self.outbox is None:
+                    self._notify(queue_name, messages, project)
+                elif self._has_subscribers(queue_name, project):
+                    self.outbox.put(queue_name, messages, project)
         else:
             LOG.error(_LE('Failed to get subscription controller.'))
 
+    def _has_subscribers(self, queue_name, project=None):
+        return bool(self._subscribers(queue_name, project))
+
+    def _subscribers(self, queue_name, project=None):
+        """Returns the subscribers of a queue.
+
+        The subscribers are cached in the subscription cache of the
+        data driver, if it is enabled.
+
+        :returns: A list of (scheme, confirmed, subscription) tuples
+        """
+        cache = self.subscription_controller.driver.subscription_cache
+        key = storage_base.subscriptions_key(queue_name, project)
+        if cache is not None:
+            subscribers = cache.get(key)
+            if subscribers is not core.NO_VALUE:
+                return subscribers
+
+        subscribers = []
+        marker = None
+        while True:
+            page = self.subscription_controller.list(
+                queue_name, project, marker=marker)
+            for sub in next(page):
+                s_type = urllib_parse.urlparse(sub['subscriber']).scheme
+                # If the subscriber doesn't contain 'confirmed', it
+                # means that this kind of subscriber was created before
+                # the confirm feature be introduced into Zaqar. We
+                # should allow them be subscribed.
+                subscribers.append((s_type, sub.get('confirmed', True), sub))
+            marker = next(page)
+            if not marker:
+                break
+
+        if cache is not None:
+            cache.set(key, subscribers)
+
+        return subscribers
+
+    def _notify(self, queue_name, messages, project=None):
+        """Notifies the subscribers of a queue.
+
+        :returns: The futures of the notifications
+        """
+        futures = []
+        for s_type, confirmed, sub in self._subscribers(queue_name, project):
+            LOG.debug("Notifying subscriber %r" % (sub,))
+            if self.require_confirmation and not confirmed:
+                LOG.info(_LI('The subscriber %s is not '
+                             'confirmed.'), sub['subscriber'])
+                continue
+            for msg in messages:
+                msg['Message_Type'] = MessageType.Notification.name
+            futures.append(self._execute(s_type, sub, messages))
+
+        return futures
+
+    def _notify_and_wait(self, queue_name, messages, project=None):
+        waiters.wait_for_all(self._notify(queue_name, messages, project))
+
     def send_confirm_notification(self, queue, subscription, conf,
                                   project=None, expires=None,
                                   api_version=None, is_unsubscribed=False):
@@ -145,8 +228,5 @@ class NotifierDriver(object):
             conf = data_driver.conf
         else:
             conf = conf
-        mgr = driver.DriverManager('zaqar.notification.tasks',
-                                   s_type,
-                                   invoke_on_load=True)
-        self.executor.submit(mgr.driver.execute, subscription, messages,
-                             conf=conf)
+        return self.executor.submit(get_task(s_type).execute, subscription,
+                                    messages, conf=conf)
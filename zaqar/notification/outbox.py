@@ -0,0 +1,155 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Durable outbox of the notifications to send.
+
+With the [notification] outbox option set, posting messages to a queue
+only records an entry, with the queue and the messages, in a queue of
+the message store. Workers claim the entries, notify the subscribers of
+the queue, and delete the entries once done. The entries of a worker
+that dies on the way are claimed again when their claim expires, so
+notifications are sent at least once, even across restarts.
+"""
+
+import threading
+import time
+import uuid
+
+from oslo_log import log as logging
+
+from zaqar.i18n import _LE
+from zaqar.storage import errors
+
+LOG = logging.getLogger(__name__)
+
+
+class Outbox(object):
+    """Notifications to send, kept in a queue of the message store.
+
+    :param driver: Data driver of the message store
+    :param conf: Configuration, with the [notification] options
+    """
+
+    def __init__(self, driver, conf):
+        self._driver = driver
+        self._options = conf.notification
+        self._queue = self._options.outbox_queue
+        self._project = self._options.outbox_project
+        self._client_uuid = str(uuid.uuid4())
+        self._queue_ready = False
+
+    def _ensure_queue(self):
+        if not self._queue_ready:
+            self._driver.queue_controller.create(self._queue,
+                                                 project=self._project)
+            self._queue_ready = True
+
+    def put(self, queue_name, messages, project=None):
+        """Records that messages were posted to a queue."""
+
+        self._ensure_queue()
+
+        entry = {'queue_name': queue_name,
+                 'project': project,
+                 'messages': messages}
+
+        self._driver.message_controller.post(
+            self._queue, [{'ttl': self._options.outbox_entry_ttl,
+                           'body': entry}],
+            self._client_uuid, project=self._project)
+
+    def take(self):
+        """Claims the next entries to send.
+
+        :returns: A (claim ID, entries) tuple
+        """
+
+        self._ensure_queue()
+
+        metadata = {'ttl': self._options.outbox_claim_ttl, 'grace': 0}
+        claim_id, entries = self._driver.claim_controller.create(
+            self._queue, metadata, project=self._project,
+            limit=self._options.outbox_batch_size)
+
+        return claim_id, list(entries)
+
+    def done(self, entry, claim_id):
+        """Removes an entry whose notifications were sent."""
+
+        self._driver.message_controller.delete(self._queue, entry['id'],
+                                               project=self._project,
+                                               claim=claim_id)
+
+    def start(self, notify):
+        """Starts the workers that send the notifications.
+
+        :param notify: Callable that notifies the subscribers of a
+            queue, with the name of the queue, the messages and the
+            project, and returns once done.
+        """
+
+        for __ in range(self._options.outbox_workers):
+            thread = threading.Thread(target=self._work, args=(notify,))
+            thread.daemon = True
+            thread.start()
+
+    def _work(self, notify):
+        while True:
+            try:
+                claim_id, entries = self.take()
+            except Exception as ex:
+                LOG.exception(ex)
+                entries = None
+
+            for entry in entries or ():
+                try:
+                    body = entry['body']
+                    notify(body['queue_name'], body['messages'],
+                           body['project'])
+                    self.done(entry, claim_id)
+                except Exception as ex:
+                    # NOTE: The entry is sent again once its claim
+                    # expires.
+                    LOG.exception(_LE(u'Could not send the notifications '
+                                      u'of outbox entry %(id)s: %(ex)s'),
+                                  {'id': entry['id'], 'ex': ex})
+
+            if not entries:
+                time.sleep(self._options.outbox_poll_interval)
+
+
+def stats(queue_controller, conf):
+    """Returns the depth and the lag of the notification outbox.
+
+    :param queue_controller: Queue controller of the storage pipeline,
+        which computes queue stats
+    :param conf: Configuration, with the [notification] options
+    :returns: A dict with the number of entries in the outbox (`depth`)
+        and being sent (`in_flight`), and the age of the oldest entry
+        in seconds (`lag`)
+    """
+
+    options = conf.notification
+
+    try:
+        messages = queue_controller.stats(options.outbox_queue,
+                                          project=options.outbox_project)
+    except errors.QueueDoesNotExist:
+        return {'depth': 0, 'in_flight': 0, 'lag': 0}
+
+    messages = messages['messages']
+    oldest = messages.get('oldest')
+
+    return {'depth': messages['total'],
+            'in_flight': messages['claimed'],
+            'lag': oldest['age'] if oldest else 0}
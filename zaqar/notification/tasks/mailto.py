@@ -15,18 +15,114 @@
 
 from email.mime import text
 import json
+import smtplib
+import socket
 from six.moves import urllib_parse
 import subprocess
+import threading
 
 from oslo_log import log as logging
 
-from zaqar.i18n import _, _LE
+from zaqar.i18n import _, _LE, _LW
 from zaqar.notification.notifier import MessageType
 
 LOG = logging.getLogger(__name__)
 
 
+class _SMTPPool(object):
+    """Kept-alive connections to an SMTP relay.
+
+    :param options: The [notification] options, with the relay to
+        connect to
+    """
+
+    def __init__(self, options):
+        self._options = options
+        self._lock = threading.Lock()
+        self._idle = []
+        self._limit = threading.BoundedSemaphore(
+            options.smtp_max_connections)
+
+    def send(self, emails):
+        """Sends emails in one SMTP session."""
+
+        with self._limit:
+            conn = self._get()
+            try:
+                for msg in emails:
+                    try:
+                        conn.sendmail(msg['from'] or '', [msg['to']],
+                                      msg.as_string())
+                    except (smtplib.SMTPRecipientsRefused,
+                            smtplib.SMTPSenderRefused,
+                            smtplib.SMTPDataError) as ex:
+                        # NOTE: The session can go on with the next email
+                        LOG.warning(_LW(u'The SMTP relay refused the email '
+                                        u'to %(to)s: %(ex)s'),
+                                    {'to': msg['to'], 'ex': ex})
+            except Exception:
+                conn.close()
+                raise
+
+            with self._lock:
+                self._idle.append(conn)
+
+    def _get(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+
+            # NOTE: The relay may have closed the connection since it
+            # was last used.
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except (smtplib.SMTPException, socket.error):
+                pass
+
+            conn.close()
+
+        return self._connect()
+
+    def _connect(self):
+        options = self._options
+        conn = smtplib.SMTP(options.smtp_host, options.smtp_port,
+                            timeout=options.smtp_timeout)
+        try:
+            if options.smtp_starttls:
+                conn.starttls()
+            if options.smtp_username:
+                conn.login(options.smtp_username,
+                           options.smtp_password or '')
+        except Exception:
+            conn.close()
+            raise
+
+        return conn
+
+
 class MailtoTask(object):
+    """Sends notifications by email.
+
+    Emails are sent through the SMTP relay set with the smtp_host
+    option, over a pool of kept-alive connections, with the emails of
+    a notification sent in one session. Without a relay, smtp_command
+    is run once per email.
+
+    With the smtp_digest_window option set, the notifications to a
+    subscriber are combined into one email, as a JSON array, for that
+    many seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+        # NOTE: (Subscriber, queue) -> (subscription, messages) of the
+        # digests to send.
+        self._digests = {}
 
     def _make_confirm_string(self, conf_n, message, queue_name):
         confirm_url = conf_n.external_confirmation_url
@@ -60,15 +156,24 @@ class MailtoTask(object):
                                      confirm_url)
         return text.MIMEText(email_body)
 
+    def _make_notification_email(self, subscription, body):
+        subscriber = urllib_parse.urlparse(subscription['subscriber'])
+        params = urllib_parse.parse_qsl(subscriber.query)
+        params = dict((k.lower(), v) for k, v in params)
+        msg = text.MIMEText(body)
+        msg["to"] = subscriber.path
+        msg["from"] = subscription['options'].get('from', '')
+        subject_opt = subscription['options'].get('subject', '')
+        msg["subject"] = params.get('subject', subject_opt)
+        return msg
+
     def execute(self, subscription, messages, **kwargs):
         subscriber = urllib_parse.urlparse(subscription['subscriber'])
-        params = urllib_parse.parse_qs(subscriber.query)
-        params = dict((k.lower(), v) for k, v in params.items())
         conf_n = kwargs.get('conf').notification
         try:
+            emails = []
+            notifications = []
             for message in messages:
-                p = subprocess.Popen(conf_n.smtp_command.split(' '),
-                                     stdin=subprocess.PIPE)
                 # Send confirmation email to subscriber.
                 if (message.get('Message_Type') ==
                         MessageType.SubscriptionConfirmation.name):
@@ -79,6 +184,7 @@ class MailtoTask(object):
                     msg["to"] = subscriber.path
                     msg["from"] = content['sender']
                     msg["subject"] = content['topic']
+                    emails.append(msg)
                 elif (message.get('Message_Type') ==
                         MessageType.UnsubscribeConfirmation.name):
                     content = conf_n.unsubscribe_confirmation_email_template
@@ -88,23 +194,78 @@ class MailtoTask(object):
                     msg["to"] = subscriber.path
                     msg["from"] = content['sender']
                     msg["subject"] = content['topic']
+                    emails.append(msg)
                 else:
                     # NOTE(Eva-i): Unfortunately this will add 'queue_name' key
                     # to our original messages(dicts) which will be later
                     # consumed in the storage controller. It seems safe though.
                     message['queue_name'] = subscription['source']
-                    msg = text.MIMEText(json.dumps(message))
-                    msg["to"] = subscriber.path
-                    msg["from"] = subscription['options'].get('from', '')
-                    subject_opt = subscription['options'].get('subject', '')
-                    msg["subject"] = params.get('subject', subject_opt)
-                p.communicate(msg.as_string())
-                LOG.debug("Send mail successfully: %s", msg.as_string())
+                    notifications.append(message)
+
+            if notifications and conf_n.smtp_digest_window:
+                self._add_to_digest(subscription, notifications, conf_n)
+            else:
+                emails.extend(
+                    self._make_notification_email(subscription,
+                                                  json.dumps(message))
+                    for message in notifications)
+
+            if emails:
+                self._deliver(emails, conf_n)
         except OSError as err:
             LOG.exception(_LE('Failed to create process for sendmail, '
                               'because %s.') % str(err))
         except Exception as exc:
             LOG.exception(_LE('Failed to send email because %s.') % str(exc))
 
+    def _deliver(self, emails, conf_n):
+        if conf_n.smtp_host:
+            self._pool(conf_n).send(emails)
+            return
+
+        for msg in emails:
+            p = subprocess.Popen(conf_n.smtp_command.split(' '),
+                                 stdin=subprocess.PIPE,
+                                 universal_newlines=True)
+            p.communicate(msg.as_string())
+            LOG.debug("Send mail successfully: %s", msg.as_string())
+
+    def _pool(self, conf_n):
+        key = (conf_n.smtp_host, conf_n.smtp_port)
+
+        with self._lock:
+            try:
+                return self._pools[key]
+            except KeyError:
+                pool = self._pools[key] = _SMTPPool(conf_n)
+                return pool
+
+    def _add_to_digest(self, subscription, messages, conf_n):
+        key = (subscription['subscriber'], subscription['source'])
+
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is None:
+                digest = self._digests[key] = (subscription, [])
+
+                timer = threading.Timer(conf_n.smtp_digest_window,
+                                        self._send_digest,
+                                        args=(key, conf_n))
+                timer.daemon = True
+                timer.start()
+
+            digest[1].extend(messages)
+
+    def _send_digest(self, key, conf_n):
+        with self._lock:
+            subscription, messages = self._digests.pop(key)
+
+        try:
+            msg = self._make_notification_email(subscription,
+                                                json.dumps(messages))
+            self._deliver([msg], conf_n)
+        except Exception as exc:
+            LOG.exception(_LE('Failed to send email because %s.') % str(exc))
+
     def register(self, subscriber, options, ttl, project_id, request_data):
         pass
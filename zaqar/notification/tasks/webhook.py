@@ -14,15 +14,43 @@
 # limitations under the License.
 
 import json
+import threading
+import time
+import weakref
+
 from oslo_log import log as logging
 import requests
+from requests import adapters
+from six.moves import urllib_parse
 
 from zaqar.i18n import _LE
+from zaqar.i18n import _LW
 
 LOG = logging.getLogger(__name__)
 
+_RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
 
 class WebhookTask(object):
+    """Sends notifications to HTTP subscribers.
+
+    The task is shared by every notification: it keeps one session,
+    and so a pool of kept-alive connections, per subscriber host, and
+    limits the number of notifications sent at the same time to each
+    subscriber.
+
+    Subscriptions with the `post_batch` option get all the messages of
+    a post in one request, as a JSON array, instead of one request per
+    message.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+        # NOTE: Subscriber -> semaphore, kept while notifications to the
+        # subscriber are being sent.
+        self._limits = weakref.WeakValueDictionary()
 
     def execute(self, subscription, messages, headers=None, **kwargs):
         if headers is None:
@@ -34,16 +62,85 @@ class WebhookTask(object):
                 # our original messages(dicts) which will be later consumed in
                 # the storage controller. It seems safe though.
                 msg['queue_name'] = subscription['source']
+
+            if subscription['options'].get('post_batch'):
+                payloads = [messages]
+            else:
+                payloads = messages
+
+            for payload in payloads:
                 if 'post_data' in subscription['options']:
                     data = subscription['options']['post_data']
-                    data = data.replace('"$zaqar_message$"', json.dumps(msg))
+                    data = data.replace('"$zaqar_message$"',
+                                        json.dumps(payload))
                 else:
-                    data = json.dumps(msg)
-                requests.post(subscription['subscriber'],
-                              data=data,
-                              headers=headers)
+                    data = json.dumps(payload)
+                self._send(subscription['subscriber'], data, headers,
+                           kwargs['conf'].notification)
         except Exception as e:
             LOG.exception(_LE('webhook task got exception: %s.') % str(e))
 
     def register(self, subscriber, options, ttl, project_id, request_data):
         pass
+
+    def _send(self, subscriber, data, headers, options):
+        """Posts a notification, retrying on transient failures."""
+
+        session = self._session(subscriber, options)
+        timeout = (options.webhook_connect_timeout,
+                   options.webhook_read_timeout)
+
+        with self._limit(subscriber, options):
+            for attempt in range(options.webhook_max_retries + 1):
+                if attempt:
+                    time.sleep(options.webhook_retry_backoff *
+                               2 ** (attempt - 1))
+
+                try:
+                    resp = session.post(subscriber, data=data,
+                                        headers=headers, timeout=timeout)
+                except (requests.ConnectionError, requests.Timeout) as ex:
+                    error = ex
+                    continue
+
+                if resp.status_code not in _RETRY_STATUS_CODES:
+                    return
+
+                error = resp.status_code
+
+        LOG.warning(_LW(u'Could not notify %(subscriber)s after '
+                        u'%(attempts)d attempt(s): %(error)s'),
+                    {'subscriber': subscriber,
+                     'attempts': options.webhook_max_retries + 1,
+                     'error': error})
+
+    def _session(self, subscriber, options):
+        url = urllib_parse.urlsplit(subscriber)
+        key = (url.scheme, url.netloc)
+
+        with self._lock:
+            try:
+                return self._sessions[key]
+            except KeyError:
+                pass
+
+            # NOTE: Keep a connection for each notifier worker that may
+            # be sending to the host at the same time.
+            adapter = adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=options.max_notifier_workers)
+
+            session = requests.Session()
+            session.mount(url.scheme + '://', adapter)
+            self._sessions[key] = session
+            return session
+
+    def _limit(self, subscriber, options):
+        with self._lock:
+            limit = self._limits.get(subscriber)
+            if limit is None:
+                limit = threading.BoundedSemaphore(
+                    options.webhook_max_concurrency)
+                self._limits[subscriber] = limit
+
+            return limit
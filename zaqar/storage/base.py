@@ -18,14 +18,18 @@
 
 import abc
 import functools
+import threading
 import time
 import uuid
 
 import enum
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import timeutils
 import six
 
+from zaqar.common import cache
+from zaqar.common import configs
 from zaqar.common import decorators
 from zaqar.storage import errors
 from zaqar.storage import utils
@@ -76,6 +80,37 @@ class DriverBase(object):
                 except cfg.DuplicateOptError:
                     pass
 
+    @decorators.lazy_property(write=False)
+    def queue_cache(self):
+        """In-process cache of queue existence and metadata.
+
+        The cache is shared by every queue controller of this driver,
+        and is None if it was disabled in the configuration.
+        """
+        self.conf.register_opts(configs._QUEUE_CACHE_OPTIONS,
+                                group=configs._QUEUE_CACHE_GROUP)
+        cache_conf = self.conf[configs._QUEUE_CACHE_GROUP]
+        if not cache_conf.enabled:
+            return None
+
+        return cache.LRUCache(cache_conf.max_entries, cache_conf.ttl)
+
+    @decorators.lazy_property(write=False)
+    def subscription_cache(self):
+        """In-process cache of the subscriptions of each queue.
+
+        The notifier fills the cache, and the subscription controllers
+        of this driver purge it when subscriptions change. It is None
+        if it was disabled in the configuration.
+        """
+        self.conf.register_opts(configs._SUBSCRIPTION_CACHE_OPTIONS,
+                                group=configs._SUBSCRIPTION_CACHE_GROUP)
+        cache_conf = self.conf[configs._SUBSCRIPTION_CACHE_GROUP]
+        if not cache_conf.enabled:
+            return None
+
+        return cache.LRUCache(cache_conf.max_entries, cache_conf.ttl)
+
 
 @six.add_metaclass(abc.ABCMeta)
 class DataDriverBase(DriverBase):
@@ -96,12 +131,24 @@ class DataDriverBase(DriverBase):
 
     BASE_CAPABILITIES = []
 
+    HEALTH_TIERS = ('liveness', 'kpi', 'probe')
+
     def __init__(self, conf, cache, control_driver):
         super(DataDriverBase, self).__init__(conf, cache)
         # creating ControlDriver instance for accessing QueueController's
         # data from DataDriver
         self.control_driver = control_driver
 
+        self.conf.register_opts(configs._HEALTH_OPTIONS,
+                                group=configs._HEALTH_GROUP)
+
+        # NOTE: (timestamp, result) of the last KPI refresh and the last
+        # probe run, see health().
+        self._health_lock = threading.Lock()
+        self._kpi = None
+        self._kpi_refreshing = False
+        self._probe = None
+
     @abc.abstractmethod
     def is_alive(self):
         """Check whether the storage is ready."""
@@ -112,17 +159,84 @@ class DataDriverBase(DriverBase):
         """Returns storage's capabilities."""
         return self.BASE_CAPABILITIES
 
-    def health(self):
-        """Return the health status of service."""
+    def health(self, tier='kpi'):
+        """Return the health status of service.
+
+        :param tier: How much to check. 'liveness' only checks that
+            the storage is reachable. 'kpi' (the default) also reports
+            the KPIs of the backend, which are cached for
+            [health] kpi_cache_ttl seconds and refreshed in the
+            background. 'probe' also reports the status of a synthetic
+            workload run against the storage, at most once every
+            [health] probe_interval seconds.
+        """
+        if tier not in self.HEALTH_TIERS:
+            raise ValueError(u'tier must be one of %s' %
+                             ', '.join(self.HEALTH_TIERS))
+
         overall_health = {}
-        # NOTE(flwang): KPI extracted from different storage backends,
-        # _health() will be implemented by different storage drivers.
-        backend_health = self._health()
-        if backend_health:
-            overall_health.update(backend_health)
+        if tier != 'liveness':
+            # NOTE(flwang): KPI extracted from different storage backends,
+            # _health() will be implemented by different storage drivers.
+            backend_health = self._cached_health()
+            if backend_health:
+                overall_health.update(backend_health)
 
+        if tier == 'probe':
+            overall_health['operation_status'] = self._probe_status()
+
+        overall_health['storage_reachable'] = self.is_alive()
         return overall_health
 
+    def _cached_health(self):
+        ttl = self.conf[configs._HEALTH_GROUP].kpi_cache_ttl
+        now = timeutils.utcnow_ts()
+
+        with self._health_lock:
+            kpi = self._kpi
+            refresh = (kpi is not None and now - kpi[0] >= ttl and
+                       not self._kpi_refreshing)
+            if refresh:
+                self._kpi_refreshing = True
+
+        if kpi is None or ttl == 0:
+            return self._refresh_health()
+
+        if refresh:
+            thread = threading.Thread(target=self._refresh_health)
+            thread.daemon = True
+            thread.start()
+
+        return dict(kpi[1])
+
+    def _refresh_health(self):
+        try:
+            kpi = self._health() or {}
+            with self._health_lock:
+                self._kpi = (timeutils.utcnow_ts(), kpi)
+
+            return dict(kpi)
+
+        except Exception as ex:
+            LOG.exception(ex)
+            raise
+
+        finally:
+            self._kpi_refreshing = False
+
+    def _probe_status(self):
+        interval = self.conf[configs._HEALTH_GROUP].probe_interval
+
+        # NOTE: Hold the lock while probing, so that parallel requests
+        # wait for the result instead of running probes of their own.
+        with self._health_lock:
+            probe = self._probe
+            if probe is None or timeutils.utcnow_ts() - probe[0] >= interval:
+                probe = (timeutils.utcnow_ts(), self._get_operation_status())
+                self._probe = probe
+
+        return probe[1]
+
     @abc.abstractmethod
     def _health(self):
         """Return the health status based on different backends."""
@@ -593,12 +707,23 @@ class Claim(ControllerBase):
         raise NotImplementedError
 
 
+def subscriptions_key(queue, project=None):
+    """Key of the subscriptions of a queue in the subscription cache."""
+    return 'subscriptions:%s/%s' % (project or '', queue)
+
+
 @six.add_metaclass(abc.ABCMeta)
 class Subscription(ControllerBase):
     """This class is responsible for managing subscriptions of notification.
 
     """
 
+    def _purge_cache(self, queue, project=None):
+        """Drops the cached subscriptions of a queue, if any."""
+        cache = self.driver.subscription_cache
+        if cache is not None:
+            cache.delete(subscriptions_key(queue, project))
+
     @abc.abstractmethod
     def list(self, queue, project=None, marker=None,
              limit=DEFAULT_SUBSCRIPTIONS_PER_PAGE):
@@ -927,6 +1052,52 @@ class CatalogueBase(ControllerBase):
 
         raise NotImplementedError
 
+    def get_many(self, project, queues):
+        """Returns the catalogue entries of several queues at once.
+
+        Drivers should override this method in order to look up all
+        of the queues with a single request.
+
+        :param project: Namespace to search for the given queues
+        :type project: six.text_type
+        :param queues: The names of the queues to search for
+        :type queues: [six.text_type]
+        :returns: [{'project': ..., 'queue': ..., 'pool': ...},] for
+            the queues that are mapped, in no particular order
+        :rtype: [dict]
+        """
+
+        entries = []
+        for queue in queues:
+            try:
+                entries.append(self.get(project, queue))
+            except errors.QueueNotMapped:
+                pass
+
+        return entries
+
+    def get_or_insert(self, project, queue, pool):
+        """Maps a queue to a pool, unless it is already mapped.
+
+        Drivers should override this method in order to do both
+        with a single request.
+
+        :param project: Namespace to insert the given queue into
+        :type project: six.text_type
+        :param queue: The name of the queue to insert
+        :type queue: six.text_type
+        :param pool: pool identifier to associate a new entry with
+        :type pool: six.text_type
+        :returns: The pool the queue is mapped to
+        :rtype: six.text_type
+        """
+
+        try:
+            return self.get(project, queue)['pool']
+        except errors.QueueNotMapped:
+            self.insert(project, queue, pool)
+            return pool
+
     @abc.abstractmethod
     def exists(self, project, queue):
         """Determines whether the given queue exists under project.
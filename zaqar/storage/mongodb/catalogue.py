@@ -25,6 +25,8 @@ Serves to construct an association between a project + queue -> pool.
     }
 """
 
+import pymongo
+
 from zaqar.storage import base
 from zaqar.storage import errors
 from zaqar.storage.mongodb import utils
@@ -71,6 +73,27 @@ class CatalogueController(base.CatalogueBase):
 
         return _normalize(entry)
 
+    @utils.raises_conn_error
+    def get_many(self, project, queues):
+        fields = {'_id': 0}
+        keys = [utils.scope_queue_name(queue, project) for queue in queues]
+        cursor = self._col.find({PRIMARY_KEY: {'$in': keys}},
+                                projection=fields)
+
+        return [_normalize(entry) for entry in cursor]
+
+    @utils.raises_conn_error
+    def get_or_insert(self, project, queue, pool):
+        key = utils.scope_queue_name(queue, project)
+        entry = self._col.find_one_and_update(
+            {PRIMARY_KEY: key},
+            {'$setOnInsert': {'s': pool}},
+            projection={'_id': 0, 's': 1},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER)
+
+        return entry['s']
+
     @utils.raises_conn_error
     def exists(self, project, queue):
         key = utils.scope_queue_name(queue, project)
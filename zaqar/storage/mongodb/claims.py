@@ -28,8 +28,16 @@ from oslo_utils import timeutils
 
 from zaqar import storage
 from zaqar.storage import errors
+from zaqar.storage.mongodb import messages
 from zaqar.storage.mongodb import utils
 
+# NOTE: Claiming stops after this many rounds, even if fewer messages
+# than requested were claimed because of parallel requests.
+MAX_CLAIM_ATTEMPTS = 5
+
+# Fields needed to return claimed messages
+_CLAIM_PROJECTION = {'_id': 1, 't': 1, 'e': 1, 'b': 1, 'k': 1}
+
 
 def _messages_iter(msg_iter):
     """Used to iterate through messages."""
@@ -109,20 +117,18 @@ class ClaimController(storage.Claim):
                limit=storage.DEFAULT_MESSAGES_PER_CLAIM):
         """Creates a claim.
 
-        This implementation was done in a best-effort fashion.
-        In order to create a claim we need to get a list
-        of messages that can be claimed. Once we have that
-        list we execute a query filtering by the ids returned
-        by the previous query.
-
-        Since there's a lot of space for race conditions here,
-        we'll check if the number of updated records is equal to
-        the max number of messages to claim. If the number of updated
-        messages is lower than limit we'll try to claim the remaining
-        number of messages.
-
-        This 2 queries are required because there's no way, as for the
-        time being, to execute an update on a limited number of records.
+        Claimed messages are tagged with the claim ID in a single
+        multi-update, filtered by the IDs of the active messages
+        listed just before. Since parallel requests may claim some
+        of the same messages in between, the number of updated
+        messages tells whether all of them were claimed. If they
+        were, the listed messages are returned as is; otherwise,
+        the messages that were actually tagged are fetched by ID,
+        and more active messages are claimed until `limit` is
+        reached, or no active messages are left.
+
+        This is done because there's no way, as for the time being,
+        to execute an update on a limited number of records.
         """
         msg_ctrl = self.driver.message_controller
 
@@ -144,58 +150,82 @@ class ClaimController(storage.Claim):
             'e': claim_expires,
         }
 
-        # Get a list of active, not claimed nor expired
-        # messages that could be claimed.
-        msgs = msg_ctrl._active(queue, projection={'_id': 1}, project=project,
-                                limit=limit)
-
-        messages = iter([])
-        ids = [msg['_id'] for msg in msgs]
-
-        if len(ids) == 0:
-            return None, messages
-
-        now = timeutils.utcnow_ts()
-
-        # NOTE(kgriffs): Set the claim field for
-        # the active message batch, while also
-        # filtering out any messages that happened
-        # to get claimed just now by one or more
-        # parallel requests.
-        #
-        # Filtering by just 'c.e' works because
-        # new messages have that field initialized
-        # to the current time when the message is
-        # posted. There is no need to check whether
-        # 'c' exists or 'c.id' is None.
         collection = msg_ctrl._collection(queue, project)
-        updated = collection.update({'_id': {'$in': ids},
-                                     'c.e': {'$lte': now}},
-                                    {'$set': {'c': meta}},
-                                    upsert=False,
-                                    multi=True)['n']
+        claimed = []
+
+        for attempt in range(MAX_CLAIM_ATTEMPTS):
+            # Get a list of active, not claimed nor expired
+            # messages that could be claimed.
+            msgs = list(msg_ctrl._active(queue, projection=_CLAIM_PROJECTION,
+                                         project=project,
+                                         limit=limit - len(claimed)))
+
+            if not msgs:
+                break
+
+            ids = [msg['_id'] for msg in msgs]
+            now = timeutils.utcnow_ts()
+
+            # NOTE(kgriffs): Set the claim field for
+            # the active message batch, while also
+            # filtering out any messages that happened
+            # to get claimed just now by one or more
+            # parallel requests.
+            #
+            # Filtering by just 'c.e' works because
+            # new messages have that field initialized
+            # to the current time when the message is
+            # posted. There is no need to check whether
+            # 'c' exists or 'c.id' is None.
+            updated = collection.update({'_id': {'$in': ids},
+                                         'c.e': {'$lte': now}},
+                                        {'$set': {'c': meta}},
+                                        upsert=False,
+                                        multi=True)['n']
+
+            if updated == len(ids):
+                claimed.extend(msgs)
+                break
+
+            if updated != 0:
+                # NOTE(kgriffs): This extra step is necessary because
+                # in between having gotten a list of active messages
+                # and updating them, some of them may have been
+                # claimed by a parallel request. Therefore, we need
+                # to find out which messages were actually tagged
+                # with the claim ID successfully.
+                claimed.extend(collection.find(
+                    {'_id': {'$in': ids}, 'c.id': oid},
+                    projection=_CLAIM_PROJECTION).hint(
+                        messages.ID_INDEX_FIELDS))
+
+        if not claimed:
+            return None, iter([])
+
+        msg_ctrl._inc_stats(queue, project, claimed=len(claimed))
 
         # NOTE(flaper87): Dirty hack!
         # This sets the expiration time to
         # `expires` on messages that would
         # expire before claim.
-        new_values = {'e': message_expiration, 't': message_ttl}
-        collection.update({'p_q': utils.scope_queue_name(queue, project),
-                           'e': {'$lt': claim_expires_dt},
-                           'c.id': oid},
-                          {'$set': new_values},
-                          upsert=False, multi=True)
+        expiring = [msg['_id'] for msg in claimed
+                    if msg['e'] < claim_expires_dt]
+
+        if expiring:
+            collection.update({'_id': {'$in': expiring}, 'c.id': oid},
+                              {'$set': {'e': message_expiration,
+                                        't': message_ttl}},
+                              upsert=False, multi=True)
 
-        if updated != 0:
-            # NOTE(kgriffs): This extra step is necessary because
-            # in between having gotten a list of active messages
-            # and updating them, some of them may have been
-            # claimed by a parallel request. Therefore, we need
-            # to find out which messages were actually tagged
-            # with the claim ID successfully.
-            claim, messages = self.get(queue, oid, project=project)
+        now = timeutils.utcnow_ts()
+        claimed.sort(key=lambda msg: msg['k'])
+        for msg in claimed:
+            msg['c'] = meta
+            if msg['e'] < claim_expires_dt:
+                msg['t'] = message_ttl
 
-        return str(oid), messages
+        return str(oid), iter([messages._basic_message(msg, now)
+                               for msg in claimed])
 
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
@@ -213,15 +243,6 @@ class ClaimController(storage.Claim):
         message_expires = datetime.datetime.utcfromtimestamp(
             claim_expires + grace)
 
-        msg_ctrl = self.driver.message_controller
-        claimed = msg_ctrl._claimed(queue, cid, expires=now,
-                                    limit=1, project=project)
-
-        try:
-            next(claimed)
-        except StopIteration:
-            raise errors.ClaimDoesNotExist(claim_id, queue, project)
-
         meta = {
             'id': cid,
             't': ttl,
@@ -230,11 +251,21 @@ class ClaimController(storage.Claim):
 
         # TODO(kgriffs): Create methods for these so we don't interact
         # with the messages collection directly (loose coupling)
+        msg_ctrl = self.driver.message_controller
         scope = utils.scope_queue_name(queue, project)
         collection = msg_ctrl._collection(queue, project)
-        collection.update({'p_q': scope, 'c.id': cid},
-                          {'$set': {'c': meta}},
-                          upsert=False, multi=True)
+
+        # NOTE: The claim exists if it still holds any message, which
+        # the number of renewed messages tells without reading any of
+        # them back.
+        updated = collection.update({'p_q': scope,
+                                     'c.id': cid,
+                                     'c.e': {'$gt': now}},
+                                    {'$set': {'c': meta}},
+                                    upsert=False, multi=True)['n']
+
+        if updated == 0:
+            raise errors.ClaimDoesNotExist(claim_id, queue, project)
 
         # NOTE(flaper87): Dirty hack!
         # This sets the expiration time to
@@ -17,6 +17,7 @@
 
 import ssl
 
+from oslo_utils import timeutils
 from osprofiler import profiler
 import pymongo
 import pymongo.errors
@@ -25,7 +26,10 @@ from zaqar.common import decorators
 from zaqar.i18n import _
 from zaqar import storage
 from zaqar.storage.mongodb import controllers
+from zaqar.storage.mongodb import markers
+from zaqar.storage.mongodb import messages
 from zaqar.storage.mongodb import options
+from zaqar.storage.mongodb import partitions
 
 
 def _connection(conf):
@@ -131,22 +135,35 @@ class DataDriver(storage.DataDriverBase):
     def close(self):
         self.connection.close()
 
+    def gc(self):
+        self.message_controller.gc()
+
     def _health(self):
         KPI = {}
-        KPI['storage_reachable'] = self.is_alive()
-        KPI['operation_status'] = self._get_operation_status()
         message_volume = {'free': 0, 'claimed': 0, 'total': 0}
-
-        for msg_col in [db.messages for db in self.message_databases]:
-            msg_count_claimed = msg_col.find({'c.id': {'$ne': None}}).count()
-            message_volume['claimed'] += msg_count_claimed
-
-            msg_count_total = msg_col.find().count()
-            message_volume['total'] += msg_count_total
-
-        message_volume['free'] = (message_volume['total'] -
-                                  message_volume['claimed'])
+        storage_size = {'data': 0, 'storage': 0, 'indexes': 0}
+
+        now = timeutils.utcnow_ts()
+        for db in self.message_databases:
+            # NOTE: The number of documents is taken from the collection
+            # metadata instead of being counted, so it may be slightly
+            # off after an unclean shutdown.
+            col_stats = db.command('collStats', 'messages')
+            message_volume['total'] += col_stats.get('count', 0)
+            storage_size['data'] += col_stats.get('size', 0)
+            storage_size['storage'] += col_stats.get('storageSize', 0)
+            storage_size['indexes'] += col_stats.get('totalIndexSize', 0)
+
+            # NOTE: Only the counting index is scanned, messages whose
+            # claim has expired are not counted as claimed.
+            message_volume['claimed'] += db.messages.count_documents(
+                {'c.e': {'$gt': now}},
+                hint=messages.COUNTING_INDEX_FIELDS)
+
+        message_volume['free'] = max(message_volume['total'] -
+                                     message_volume['claimed'], 0)
         KPI['message_volume'] = message_volume
+        KPI['storage_size'] = storage_size
         return KPI
 
     @decorators.lazy_property(write=False)
@@ -172,6 +189,27 @@ class DataDriver(storage.DataDriverBase):
             databases.append(self.connection.get_database(db_name, **kwargs))
         return databases
 
+    @decorators.lazy_property(write=False)
+    def partition_placement(self):
+        """Placement of queues on the message databases.
+
+        The table of queues placed explicitly on a partition lives
+        in the first message database.
+        """
+        return partitions.Placement(self.mongodb_conf,
+                                    self.message_databases[0].placements)
+
+    @decorators.lazy_property(write=False)
+    def marker_watcher(self):
+        """Latest message marker of each queue, if marker_watch is set."""
+        if not self.mongodb_conf.marker_watch:
+            return None
+
+        watcher = markers.MarkerWatcher([db.messages
+                                         for db in self.message_databases])
+        watcher.start()
+        return watcher
+
     @decorators.lazy_property(write=False)
     def subscriptions_database(self):
         """Database dedicated to the "subscription" collection."""
@@ -0,0 +1,204 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latest message marker of each queue, kept from change streams.
+
+Observers page through queues by marker, and mostly find nothing new.
+The MarkerWatcher follows a change stream on each messages collection
+to keep track of the highest marker of the messages made visible in
+each queue, so that listing past that marker can be answered without
+querying the database.
+
+The latest marker is an upper bound: deleted, claimed or expired
+messages do not lower it. A queue is only tracked once its latest
+marker has been looked up with a query, or a message has been posted
+to it, after the change streams were opened. Whenever a stream breaks,
+or a message is made visible that the watcher can not place, every
+queue is forgotten and looked up again.
+"""
+
+import threading
+import time
+
+from oslo_log import log as logging
+import pymongo.errors
+
+from zaqar.i18n import _LW
+
+LOG = logging.getLogger(__name__)
+
+# NOTE: Only the events that make messages visible, or that may
+# invalidate what is known, with just the fields needed for that.
+_PIPELINE = [
+    {'$match': {'$or': [
+        {'operationType': {'$in': ['insert', 'delete', 'drop', 'rename',
+                                   'dropDatabase', 'invalidate']}},
+        {'operationType': 'update',
+         'updateDescription.updatedFields.tx': {'$type': 'null'}},
+    ]}},
+    {'$project': {
+        'operationType': 1,
+        'documentKey': 1,
+        'fullDocument.p_q': 1,
+        'fullDocument.k': 1,
+        'fullDocument.tx': 1,
+    }},
+]
+
+
+class MarkerWatcher(object):
+    """Keeps the latest marker of each queue from change streams.
+
+    :param collections: The messages collections to watch, one per
+        partition
+    :param retry_sleep: Number of seconds to wait before reopening a
+        change stream that failed
+    """
+
+    def __init__(self, collections, retry_sleep=1):
+        self._collections = collections
+        self._retry_sleep = retry_sleep
+
+        # NOTE: Scope -> latest marker, and ID -> (scope, marker) of
+        # the messages inserted as part of a pending transaction.
+        self._latest = {}
+        self._pending = {}
+
+        self._changed = threading.Condition()
+        self._generation = 0
+        self._streams = 0
+
+    def start(self):
+        for collection in self._collections:
+            thread = threading.Thread(target=self._watch,
+                                      args=(collection,))
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def ready(self):
+        """Whether every partition is being watched."""
+        return self._streams == len(self._collections)
+
+    def latest(self, scope, find_latest):
+        """Returns the latest marker of a queue.
+
+        :param scope: Scoped name of the queue
+        :param find_latest: Callable that queries the latest marker
+            of the queue, for queues that are not tracked yet
+        :returns: The latest marker, 0 for an empty queue, or None if
+            the change streams are not all open.
+        """
+
+        with self._changed:
+            if not self.ready:
+                return None
+
+            if scope in self._latest:
+                return self._latest[scope]
+
+            generation = self._generation
+
+        marker = find_latest()
+
+        with self._changed:
+            # NOTE: Anything posted since the query was run has been
+            # accounted for by now, unless a stream broke meanwhile.
+            if self.ready and generation == self._generation:
+                self._latest[scope] = max(self._latest.get(scope, marker),
+                                          marker)
+
+        return marker
+
+    def wait(self, scope, marker, timeout):
+        """Waits for a message past a marker to be posted.
+
+        Meant for long polling: returns as soon as the latest marker of
+        the queue is past `marker`, or when it is not known.
+
+        :returns: False on timeout, True otherwise
+        """
+
+        deadline = time.time() + timeout
+
+        with self._changed:
+            while (self.ready and scope in self._latest and
+                   self._latest[scope] <= marker):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+
+                self._changed.wait(remaining)
+
+        return True
+
+    def _watch(self, collection):
+        while True:
+            try:
+                with collection.watch(_PIPELINE) as stream:
+                    with self._changed:
+                        self._streams += 1
+
+                    try:
+                        for change in stream:
+                            self._apply(change)
+                    finally:
+                        with self._changed:
+                            self._streams -= 1
+                            self._reset()
+
+            except pymongo.errors.PyMongoError as ex:
+                msgtmpl = _LW(u'Change stream on %(collection)s failed, '
+                              u'listing messages from the database until '
+                              u'it is reopened: %(ex)s')
+                LOG.warning(msgtmpl, dict(collection=collection.full_name,
+                                          ex=ex))
+
+            time.sleep(self._retry_sleep)
+
+    def _apply(self, change):
+        operation = change['operationType']
+
+        with self._changed:
+            if operation == 'insert':
+                doc = change['fullDocument']
+                if doc.get('tx') is None:
+                    self._advance(doc['p_q'], doc['k'])
+                else:
+                    self._pending[change['documentKey']['_id']] = (
+                        doc['p_q'], doc['k'])
+
+            elif operation == 'update':
+                # NOTE: The transaction of the message was finalized
+                pending = self._pending.pop(change['documentKey']['_id'],
+                                            None)
+                if pending is None:
+                    # NOTE: Inserted before the stream was opened
+                    self._reset()
+                else:
+                    self._advance(*pending)
+
+            elif operation == 'delete':
+                self._pending.pop(change['documentKey']['_id'], None)
+
+            else:
+                self._reset()
+
+    def _advance(self, scope, marker):
+        self._latest[scope] = max(self._latest.get(scope, marker), marker)
+        self._changed.notify_all()
+
+    def _reset(self):
+        self._latest.clear()
+        self._generation += 1
+        self._changed.notify_all()
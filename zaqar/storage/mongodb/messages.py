@@ -21,6 +21,7 @@ Field Mappings:
     letter of their long name.
 """
 
+import collections
 import datetime
 import time
 
@@ -44,6 +45,14 @@ LOG = logging.getLogger(__name__)
 # some fudge room.
 MAX_RETRY_POST_DURATION = 45
 
+# NOTE: Popping stops after this many rounds, even if fewer messages
+# than requested were popped because of parallel requests.
+MAX_POP_ATTEMPTS = 5
+
+# NOTE: Claim expiration time of messages being popped, so that they
+# are never claimed or popped again.
+POPPED_CLAIM_EXPIRES = 2 ** 62
+
 # NOTE(kgriffs): It is extremely unlikely that all workers would somehow hang
 # for more than 5 seconds, without a single one being able to succeed in
 # posting some messages and incrementing the counter, thus allowing the other
@@ -142,7 +151,8 @@ class MessageController(storage.Message):
         super(MessageController, self).__init__(*args, **kwargs)
 
         # Cache for convenience and performance
-        self._num_partitions = self.driver.mongodb_conf.partitions
+        self._placement = self.driver.partition_placement
+        self._marker_watcher = self.driver.marker_watcher
         self._queue_ctrl = self.driver.queue_controller
         self._retry_range = range(self.driver.mongodb_conf.max_attempts)
 
@@ -160,6 +170,28 @@ class MessageController(storage.Message):
         for collection in self._collections:
             self._ensure_indexes(collection)
 
+        # NOTE: The same collections, with the write concerns that the
+        # pool is configured to use for posting and deleting messages.
+        conf = self.driver.mongodb_conf
+        post_wc = utils.write_concern(conf.post_write_concern,
+                                      conf.post_journal)
+        delete_wc = utils.write_concern(conf.delete_write_concern,
+                                        conf.delete_journal)
+
+        self._post_collections = [
+            collection.with_options(write_concern=post_wc)
+            for collection in self._collections]
+
+        self._delete_collections = [
+            collection.with_options(write_concern=delete_wc)
+            for collection in self._collections]
+
+        self._delete_coalescers = None
+        if conf.delete_coalesce_window > 0:
+            self._delete_coalescers = [
+                utils.WriteCoalescer(collection, conf.delete_coalesce_window)
+                for collection in self._delete_collections]
+
     # ----------------------------------------------------------------------
     # Helpers
     # ----------------------------------------------------------------------
@@ -194,8 +226,37 @@ class MessageController(storage.Message):
 
     def _collection(self, queue_name, project=None):
         """Get a partitioned collection instance."""
-        return self._collections[utils.get_partition(self._num_partitions,
-                                                     queue_name, project)]
+        return self._collections[self._placement.get_partition(
+            queue_name, project)]
+
+    def _post_collection(self, queue_name, project=None):
+        """Get a partitioned collection instance to insert messages with."""
+        return self._post_collections[self._placement.get_partition(
+            queue_name, project)]
+
+    def _remove(self, queue_name, project, query, multi=True):
+        """Removes messages with the delete write concern.
+
+        When delete_coalesce_window is set, the removal is sent in a
+        bulk write along with the concurrent ones to the same
+        partition.
+
+        :param multi: Whether to remove every matching message, or
+            only the first one.
+        """
+
+        partition = self._placement.get_partition(queue_name, project)
+
+        if self._delete_coalescers is None:
+            self._delete_collections[partition].remove(query, multi=multi)
+            return
+
+        if multi:
+            request = pymongo.DeleteMany(query)
+        else:
+            request = pymongo.DeleteOne(query)
+
+        self._delete_coalescers[partition].submit(request)
 
     def _backoff_sleep(self, attempt):
         """Sleep between retries using a jitter algorithm.
@@ -229,6 +290,32 @@ class MessageController(storage.Message):
         collection = self._collection(queue_name, project)
         collection.remove({PROJ_QUEUE: scope}, w=0)
 
+        # NOTE: Drop the stats counters, if any, so that they start
+        # from a recount if the queue is created again.
+        collection.stats.update({PROJ_QUEUE: scope}, {'$unset': {'s': ''}},
+                                upsert=False, w=0)
+
+    def _latest_marker(self, queue_name, project=None):
+        """Latest marker of a queue, according to the marker watcher.
+
+        :returns: The latest marker, 0 for an empty queue, or None when
+            the watcher can not tell.
+        """
+
+        scope = utils.scope_queue_name(queue_name, project)
+        collection = self._collection(queue_name, project)
+
+        def find_latest():
+            query = {PROJ_QUEUE: scope, 'tx': None}
+            cursor = collection.find(query, projection={'k': 1, '_id': 0},
+                                     sort=[('k', -1)], limit=1)
+            for msg in cursor.hint(ACTIVE_INDEX_FIELDS):
+                return msg['k']
+
+            return 0
+
+        return self._marker_watcher.latest(scope, find_latest)
+
     def _list(self, queue_name, project=None, marker=None,
               echo=False, client_uuid=None, projection=None,
               include_claimed=False, sort=1, limit=None):
@@ -396,9 +483,81 @@ class MessageController(storage.Message):
         scope = utils.scope_queue_name(queue_name, project)
         collection = self._collection(queue_name, project)
 
-        collection.update({PROJ_QUEUE: scope, 'c.id': cid},
-                          {'$set': {'c': {'id': None, 'e': now}}},
-                          upsert=False, multi=True)
+        res = collection.update({PROJ_QUEUE: scope, 'c.id': cid},
+                                {'$set': {'c': {'id': None, 'e': now}}},
+                                upsert=False, multi=True)
+
+        self._inc_stats(queue_name, project, claimed=-res['n'])
+
+    def _maintains_stats(self):
+        return self.driver.mongodb_conf.stats_mode == 'counters'
+
+    def _inc_stats(self, queue_name, project=None, total=0, claimed=0):
+        """Updates the stats counters of a queue, if they are maintained.
+
+        The counters only exist once the queue has been recounted by
+        _reconcile_stats(); until then, this is a noop.
+
+        :param total: Change in the total number of messages
+        :param claimed: Change in the number of claimed messages
+        """
+
+        if not self._maintains_stats() or not (total or claimed):
+            return
+
+        query = _get_scoped_query(queue_name, project)
+        query['s'] = {'$exists': True}
+
+        collection = self._collection(queue_name, project).stats
+        collection.update(query, {'$inc': {'s.t': total, 's.c': claimed}},
+                          upsert=False, w=0)
+
+    def _reconcile_stats(self, queue_name, project=None):
+        """Recounts the messages of a queue, and resets its stats counters.
+
+        :returns: A (total, claimed) tuple
+        """
+
+        active = self._count(queue_name, project, include_claimed=False)
+        total = self._count(queue_name, project, include_claimed=True)
+
+        counters = {
+            't': total,
+            'c': total - active,
+            'r': timeutils.utcnow_ts(),
+        }
+
+        collection = self._collection(queue_name, project).stats
+        collection.update(_get_scoped_query(queue_name, project),
+                          {'$set': {'s': counters}}, upsert=True)
+
+        return total, total - active
+
+    def _get_stats(self, queue_name, project=None):
+        """Returns the stats counters of a queue.
+
+        The counters are recounted first if they are older than
+        stats_reconcile_interval, or do not exist yet.
+
+        :returns: A (total, claimed, exact) tuple
+        """
+
+        collection = self._collection(queue_name, project).stats
+        doc = collection.find_one(_get_scoped_query(queue_name, project),
+                                  projection={'s': 1, '_id': 0})
+
+        max_age = self.driver.mongodb_conf.stats_reconcile_interval
+        if doc is None or 's' not in doc or (
+                timeutils.utcnow_ts() - doc['s']['r'] > max_age):
+            total, claimed = self._reconcile_stats(queue_name, project)
+            return total, claimed, True
+
+        # NOTE: Expired claims and messages are only accounted for by
+        # the next recount, and concurrent updates may race with it,
+        # so make sure the numbers at least add up.
+        total = max(doc['s']['t'], 0)
+        claimed = min(max(doc['s']['c'], 0), total)
+        return total, claimed, False
 
     def _inc_counter(self, queue_name, project=None, amount=1, window=None):
         """Increments the message counter and returns the new value.
@@ -511,6 +670,56 @@ class MessageController(storage.Message):
         except pymongo.errors.AutoReconnect as ex:
             LOG.exception(ex)
 
+    def _counter_collection(self, queue_name, project=None):
+        """Returns the collection holding the queue's message counter.
+
+        :returns: A (collection, upsert) tuple, where upsert tells
+            whether the counter document may be created on the fly.
+        """
+
+        # NOTE(flaper87): See the note in _inc_counter() wrt using
+        # the counter of the mongodb queue_controller.
+        if hasattr(self._queue_ctrl, '_inc_counter'):
+            return self._queue_ctrl._collection, False
+
+        return self._collection(queue_name, project).stats, True
+
+    def _reserve_markers(self, queue_name, project=None, amount=1):
+        """Reserves a range of markers for a batch of messages.
+
+        This takes a single round trip when the counter is kept by the
+        mongodb queue_controller, since the counter update also tells
+        whether the queue exists. Otherwise, the (cached) existence of
+        the queue is checked first, and the counter is upserted.
+
+        :param queue_name: Name of the queue to which the counter is scoped
+        :param project: Queue's project name
+        :param amount: (Default 1) Number of markers to reserve
+
+        :returns: A (start, watermark) tuple, where start is the first
+            marker of the reserved range, and watermark is only used by
+            the FIFO controller.
+
+        :raises: storage.errors.QueueDoesNotExist
+        """
+
+        collection, upsert = self._counter_collection(queue_name, project)
+        if upsert and not self._queue_ctrl.exists(queue_name, project):
+            raise errors.QueueDoesNotExist(queue_name, project)
+
+        update = {'$inc': {'c.v': amount},
+                  '$set': {'c.t': timeutils.utcnow_ts()}}
+
+        doc = collection.find_one_and_update(
+            _get_scoped_query(queue_name, project), update, upsert=upsert,
+            return_document=pymongo.ReturnDocument.AFTER,
+            projection={'c.v': 1, 'c.w': 1, '_id': 0})
+
+        if doc is None:
+            raise errors.QueueDoesNotExist(queue_name, project)
+
+        return doc['c']['v'] - amount, doc['c'].get('w')
+
     # ----------------------------------------------------------------------
     # Public interface
     # ----------------------------------------------------------------------
@@ -525,6 +734,15 @@ class MessageController(storage.Message):
             except ValueError:
                 yield iter([])
 
+            # NOTE: Nothing was posted past the marker, as far as the
+            # change streams tell.
+            if self._marker_watcher is not None:
+                latest = self._latest_marker(queue_name, project)
+                if latest is not None and marker >= latest:
+                    yield iter([])
+                    yield str(marker)
+                    return
+
         messages = self._list(queue_name, project=project, marker=marker,
                               client_uuid=client_uuid, echo=echo,
                               include_claimed=include_claimed, limit=limit)
@@ -615,21 +833,17 @@ class MessageController(storage.Message):
         # The worst-case scenario is that we'll increase the counter
         # several times and we'd end up with some non-active messages.
 
-        if not self._queue_ctrl.exists(queue_name, project):
-            raise errors.QueueDoesNotExist(queue_name, project)
-
-        # NOTE(flaper87): Make sure the counter exists. This method
-        # is an upsert.
-        self._get_counter(queue_name, project)
         now = timeutils.utcnow_ts()
         now_dt = datetime.datetime.utcfromtimestamp(now)
-        collection = self._collection(queue_name, project)
+        collection = self._post_collection(queue_name, project)
 
         messages = list(messages)
         msgs_n = len(messages)
-        next_marker = self._inc_counter(queue_name,
-                                        project,
-                                        amount=msgs_n) - msgs_n
+
+        # NOTE: This also checks that the queue exists, and makes sure
+        # the counter does.
+        next_marker, __ = self._reserve_markers(queue_name, project,
+                                                amount=msgs_n)
 
         prepared_messages = [
             {
@@ -647,6 +861,7 @@ class MessageController(storage.Message):
         ]
 
         ids = collection.insert(prepared_messages, check_keys=False)
+        self._inc_stats(queue_name, project, total=len(ids))
 
         return [str(id_) for id_ in ids]
 
@@ -699,7 +914,9 @@ class MessageController(storage.Message):
 
                     raise errors.MessageNotClaimed(message_id)
 
-        collection.remove(query['_id'], w=0)
+        self._remove(queue_name, project, {'_id': mid}, multi=False)
+        self._inc_stats(queue_name, project, total=-1,
+                        claimed=-1 if _is_claimed(message, now) else 0)
 
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
@@ -710,38 +927,108 @@ class MessageController(storage.Message):
             PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
         }
 
-        collection = self._collection(queue_name, project)
-        collection.remove(query, w=0)
+        if self._maintains_stats():
+            # NOTE: Claimed messages that get deleted are accounted for
+            # by the next recount. The number of removed messages is
+            # needed for that, so this can not be coalesced.
+            collection = self._collection(queue_name, project)
+            removed = collection.remove(query)['n']
+            self._inc_stats(queue_name, project, total=-removed)
+        else:
+            self._remove(queue_name, project, query)
 
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
     def pop(self, queue_name, limit, project=None):
-        query = {
-            PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
-        }
+        # NOTE: Popped messages are claimed for good with a token in a
+        # single update, like claims do, so that parallel requests can
+        # never pop the same message, and then deleted in one go. If
+        # the request dies in between, the messages are lost, just like
+        # when it dies after deleting them.
+        collection = self._collection(queue_name, project)
+        token = objectid.ObjectId()
+        popped_claim = {'id': token, 'e': POPPED_CLAIM_EXPIRES}
+        projection = {'_id': 1, 't': 1, 'b': 1}
 
-        # Only include messages that are not part of
-        # any claim, or are part of an expired claim.
-        now = timeutils.utcnow_ts()
-        query['c.e'] = {'$lte': now}
+        popped = []
+        for attempt in range(MAX_POP_ATTEMPTS):
+            msgs = list(self._list(queue_name, project=project, echo=True,
+                                   projection=projection,
+                                   limit=limit - len(popped)))
 
-        collection = self._collection(queue_name, project)
-        projection = {'_id': 1, 't': 1, 'b': 1, 'c.id': 1}
+            if not msgs:
+                break
 
-        messages = (collection.find_and_modify(query,
-                                               projection=projection,
-                                               remove=True)
-                    for _ in range(limit))
+            ids = [msg['_id'] for msg in msgs]
 
-        final_messages = [_basic_message(message, now)
-                          for message in messages
-                          if message]
+            # Only include messages that are not part of
+            # any claim, or are part of an expired claim.
+            now = timeutils.utcnow_ts()
+            updated = collection.update({'_id': {'$in': ids},
+                                         'c.e': {'$lte': now}},
+                                        {'$set': {'c': popped_claim}},
+                                        upsert=False, multi=True)['n']
+
+            if updated == len(ids):
+                popped.extend(msgs)
+                break
+
+            if updated != 0:
+                # NOTE: Parallel requests claimed or popped some of
+                # the messages in the meantime; find out which ones
+                # were stamped with our token.
+                popped.extend(collection.find(
+                    {'_id': {'$in': ids}, 'c.id': token},
+                    projection=projection).hint(ID_INDEX_FIELDS))
+
+        if not popped:
+            return []
+
+        self._remove(queue_name, project,
+                     {'_id': {'$in': [msg['_id'] for msg in popped]},
+                      'c.id': token})
+        self._inc_stats(queue_name, project, total=-len(popped))
+
+        now = timeutils.utcnow_ts()
+        final_messages = []
+        for message in popped:
+            message['c'] = {'id': None}
+            final_messages.append(_basic_message(message, now))
 
         return final_messages
 
+    def gc(self):
+        """Recounts the stats counters that are getting old.
+
+        Only the queues whose stats have been requested at least once
+        have counters to recount.
+        """
+
+        if not self._maintains_stats():
+            return
+
+        max_age = self.driver.mongodb_conf.stats_reconcile_interval
+        threshold = timeutils.utcnow_ts() - max_age // 2
+
+        for collection in self._collections:
+            docs = collection.stats.find({'s.r': {'$lt': threshold}},
+                                         projection={PROJ_QUEUE: 1})
+
+            for doc in docs:
+                project, queue = utils.parse_scoped_project_queue(
+                    doc[PROJ_QUEUE])
+                self._reconcile_stats(queue, project or None)
+
 
 class FIFOMessageController(MessageController):
 
+    def __init__(self, *args, **kwargs):
+        super(FIFOMessageController, self).__init__(*args, **kwargs)
+
+        # NOTE: Counts how often posts had to wait for, or retry
+        # because of, concurrent producers posting to the same queue.
+        self._post_stats = collections.Counter()
+
     def _ensure_indexes(self, collection):
         """Ensures that all indexes are created."""
 
@@ -778,6 +1065,211 @@ class FIFOMessageController(MessageController):
                                 name='transaction',
                                 background=True)
 
+    def _get_watermark(self, queue_name, project=None):
+        """Returns the first marker that has not been published yet."""
+
+        collection, __ = self._counter_collection(queue_name, project)
+        doc = collection.find_one(_get_scoped_query(queue_name, project),
+                                  projection={'c.w': 1, '_id': 0})
+
+        if doc is None:
+            raise errors.QueueDoesNotExist(queue_name, project)
+
+        return doc['c'].get('w')
+
+    def _advance_watermark(self, queue_name, project, current, new):
+        """Moves the watermark from current to new.
+
+        :returns: True if the watermark was moved, False if it no
+            longer had the expected value.
+        """
+
+        collection, __ = self._counter_collection(queue_name, project)
+        query = _get_scoped_query(queue_name, project)
+        query['c.w'] = current
+
+        res = collection.update_one(query, {'$set': {'c.w': new}})
+        return res.modified_count == 1
+
+    def _reserve_markers(self, queue_name, project=None, amount=1):
+        """Reserves a range of markers for a batch of messages.
+
+        Along with the message counter, which is the next marker to
+        hand out, each queue keeps a watermark: the first marker that
+        has not been published yet. Producers publish their ranges in
+        marker order, by waiting for the watermark to reach the start
+        of their range, and then moving it to the end of their range.
+
+        :returns: A (start, watermark) tuple, where start is the first
+            marker of the reserved range.
+
+        :raises: storage.errors.QueueDoesNotExist
+        """
+
+        start, watermark = super(FIFOMessageController,
+                                 self)._reserve_markers(queue_name,
+                                                        project, amount)
+
+        if watermark is None:
+            # NOTE: The counter predates the watermark; start it at
+            # our range, unless a concurrent producer beat us to it.
+            collection, __ = self._counter_collection(queue_name, project)
+            query = _get_scoped_query(queue_name, project)
+            query['c.w'] = {'$exists': False}
+
+            res = collection.update_one(query, {'$set': {'c.w': start}})
+            if res.modified_count == 1:
+                watermark = start
+            else:
+                watermark = self._get_watermark(queue_name, project)
+
+        return start, watermark
+
+    def _wait_for_turn(self, queue_name, project, start, since):
+        """Waits until all the messages preceding a range are published.
+
+        If the watermark does not move for COUNTER_STALL_WINDOW
+        seconds, the producer that holds it is assumed to have died
+        and its range is skipped. Its messages, if any, were never
+        finalized and so are never listed.
+
+        :param start: First marker of the reserved range
+        :param since: UNIX timestamp at which the post started
+
+        :returns: True once the watermark reaches start, False if the
+            range was skipped by another producer in the meantime, or
+            if the post took too long.
+        """
+
+        observed = None
+        observed_at = None
+
+        for attempt in self._retry_range:
+            watermark = self._get_watermark(queue_name, project)
+            if watermark == start:
+                return True
+
+            if watermark > start:
+                return False
+
+            now = timeutils.utcnow_ts()
+            if now - since > MAX_RETRY_POST_DURATION:
+                return False
+
+            if watermark != observed:
+                observed = watermark
+                observed_at = now
+
+            elif now - observed_at > COUNTER_STALL_WINDOW:
+                if self._advance_watermark(queue_name, project,
+                                           watermark, start):
+                    msgtmpl = _LW(u'Detected a stalled message counter '
+                                  u'for queue "%(queue)s" under '
+                                  u'project %(project)s. Markers '
+                                  u'%(first)d to %(last)d were skipped.')
+
+                    LOG.warning(msgtmpl,
+                                dict(queue=queue_name,
+                                     project=project,
+                                     first=watermark,
+                                     last=start - 1))
+
+                    self._post_stats['skipped'] += 1
+                    return True
+
+                continue
+
+            self._post_stats['waits'] += 1
+            self._backoff_sleep(attempt)
+
+        return False
+
+    def _post_reserved(self, queue_name, messages, client_uuid, project):
+        """Posts messages using markers reserved up front.
+
+        Reserving the markers first means that inserts can not conflict
+        with concurrent producers. To keep observers from skipping
+        messages, a batch is inserted as a transaction, and only
+        finalized once every batch with lower markers has been.
+        """
+
+        now = timeutils.utcnow_ts()
+        now_dt = datetime.datetime.utcfromtimestamp(now)
+        collection = self._collection(queue_name, project)
+
+        messages = list(messages)
+        msgs_n = len(messages)
+
+        for attempt in self._retry_range:
+            start, watermark = self._reserve_markers(queue_name, project,
+                                                     amount=msgs_n)
+
+            # NOTE: If nothing precedes us, a single message can be
+            # published right away; otherwise it has to stay hidden
+            # until our turn comes.
+            ready = watermark == start
+            if ready and msgs_n == 1:
+                transaction = None
+            else:
+                transaction = objectid.ObjectId()
+
+            prepared_messages = [
+                {
+                    PROJ_QUEUE: utils.scope_queue_name(queue_name, project),
+                    't': message['ttl'],
+                    'e': now_dt + datetime.timedelta(seconds=message['ttl']),
+                    'u': client_uuid,
+                    'c': {'id': None, 'e': now},
+                    'b': message['body'] if 'body' in message else {},
+                    'k': start + index,
+                    'tx': transaction,
+                }
+
+                for index, message in enumerate(messages)
+            ]
+
+            ids = self._post_collection(queue_name, project).insert(
+                prepared_messages, check_keys=False)
+
+            if ready or self._wait_for_turn(queue_name, project,
+                                            start, now):
+                if transaction is not None:
+                    collection.update({'tx': transaction},
+                                      {'$set': {'tx': None}},
+                                      upsert=False, multi=True)
+
+                if not self._advance_watermark(queue_name, project,
+                                               start, start + msgs_n):
+                    msgtmpl = _LW(u'Markers %(first)d to %(last)d of queue '
+                                  u'"%(queue)s" under project %(project)s '
+                                  u'were skipped while being published')
+
+                    LOG.warning(msgtmpl,
+                                dict(queue=queue_name,
+                                     project=project,
+                                     first=start,
+                                     last=start + msgs_n - 1))
+
+                self._inc_stats(queue_name, project, total=len(ids))
+                return [str(id_) for id_ in ids]
+
+            # NOTE: Our range was skipped, so our messages would be
+            # listed out of order; drop them and try again with a new
+            # range.
+            collection.remove({'tx': transaction}, w=0)
+            self._post_stats['retries'] += 1
+
+            elapsed = timeutils.utcnow_ts() - now
+            if elapsed > MAX_RETRY_POST_DURATION:
+                msgtmpl = _LW(u'Exceeded maximum retry duration for queue '
+                              u'"%(queue)s" under project %(project)s')
+
+                LOG.warning(msgtmpl,
+                            dict(queue=queue_name, project=project))
+                break
+
+        raise errors.MessageConflict(queue_name, project)
+
     @utils.raises_conn_error
     @utils.retries_on_autoreconnect
     def post(self, queue_name, messages, client_uuid, project=None):
@@ -786,6 +1278,10 @@ class FIFOMessageController(MessageController):
         # The worst-case scenario is that we'll increase the counter
         # several times and we'd end up with some non-active messages.
 
+        if self.driver.mongodb_conf.marker_allocation == 'reserve':
+            return self._post_reserved(queue_name, messages,
+                                       client_uuid, project)
+
         if not self._queue_ctrl.exists(queue_name, project):
             raise errors.QueueDoesNotExist(queue_name, project)
 
@@ -839,7 +1335,8 @@ class FIFOMessageController(MessageController):
         # before the operation is abandoned is 49.95 seconds.
         for attempt in self._retry_range:
             try:
-                ids = collection.insert(prepared_messages, check_keys=False)
+                ids = self._post_collection(queue_name, project).insert(
+                    prepared_messages, check_keys=False)
 
                 # Log a message if we retried, for debugging perf issues
                 if attempt != 0:
@@ -872,12 +1369,11 @@ class FIFOMessageController(MessageController):
                                       {'$set': {'tx': None}},
                                       upsert=False, multi=True)
 
+                self._inc_stats(queue_name, project, total=len(ids))
                 return [str(id_) for id_ in ids]
 
             except pymongo.errors.DuplicateKeyError as ex:
-                # TODO(kgriffs): Record stats of how often retries happen,
-                # and how many attempts, on average, are required to insert
-                # messages.
+                self._post_stats['retries'] += 1
 
                 # NOTE(kgriffs): This can be used in conjunction with the
                 # log line, above, that is emitted after all messages have
@@ -1009,11 +1505,16 @@ class MessageQueueHandler(object):
 
         controller = self.message_controller
 
-        active = controller._count(name, project=project,
-                                   include_claimed=False)
+        if controller._maintains_stats():
+            total, claimed, exact = controller._get_stats(name, project)
+            active = total - claimed
+        else:
+            active = controller._count(name, project=project,
+                                       include_claimed=False)
 
-        total = controller._count(name, project=project,
-                                  include_claimed=True)
+            total = controller._count(name, project=project,
+                                      include_claimed=True)
+            exact = None
 
         message_stats = {
             'claimed': total - active,
@@ -1025,12 +1526,18 @@ class MessageQueueHandler(object):
             oldest = controller.first(name, project=project, sort=1)
             newest = controller.first(name, project=project, sort=-1)
         except errors.QueueIsEmpty:
-            pass
+            if exact is not None:
+                # NOTE: The counters are off, the queue is empty
+                message_stats.update(claimed=0, free=0, total=0)
+                exact = True
         else:
             now = timeutils.utcnow_ts()
             message_stats['oldest'] = utils.stat_message(oldest, now)
             message_stats['newest'] = utils.stat_message(newest, now)
 
+        if exact is not None:
+            message_stats['approximate'] = not exact
+
         return {'messages': message_stats}
 
 
@@ -126,11 +126,108 @@ MESSAGE_MONGODB_OPTIONS = _COMMON_OPTIONS + (
                help=('Number of databases across which to '
                      'partition message data, in order to '
                      'reduce writer lock %. DO NOT change '
-                     'this setting after initial deployment. '
-                     'It MUST remain static. Also, you '
+                     'this setting without moving the queues that '
+                     'it remaps. Also, you '
                      'should not need a large number of partitions '
                      'to improve performance, esp. if deploying '
-                     'MongoDB on SSD storage.')),
+                     'MongoDB on SSD storage. To add partitions to an '
+                     'existing deployment, use zaqar-partitions.')),
+
+    cfg.StrOpt('partition_placement', default='modulo',
+               choices=('modulo', 'ring'),
+               help=('How queues are placed on partitions. "modulo" '
+                     'takes the hash of the queue name modulo the number '
+                     'of partitions, so changing the number of partitions '
+                     'moves almost every queue. "ring" places queues on a '
+                     'consistent hash ring, so adding a partition only '
+                     'moves its share of the queues. Queues placed '
+                     'explicitly by zaqar-partitions take precedence. '
+                     'Switching modes moves queues too: pin them first, '
+                     'see zaqar-partitions.')),
+
+    cfg.IntOpt('partition_ring_vnodes', default=256, min=1,
+               help=('Number of points each partition gets on the hash '
+                     'ring, when partition_placement is "ring". More '
+                     'points even out the number of queues per '
+                     'partition. Changing it moves queues.')),
+
+    cfg.IntOpt('placement_cache_ttl', default=5, min=1,
+               help=('Number of seconds the explicit placements of queues '
+                     'are cached for. zaqar-partitions waits for at least '
+                     'this long for every server to pick up a new '
+                     'placement before moving the remaining messages.')),
+
+    cfg.StrOpt('marker_allocation', default='reserve',
+               choices=('reserve', 'retry'),
+               help=('How the mongodb.fifo driver allocates the markers '
+                     'of posted messages. "reserve" reserves the markers '
+                     'of a whole batch with a single counter update, and '
+                     'makes batches visible in marker order. "retry" '
+                     'inserts messages with the next free markers, and '
+                     'retries when a concurrent producer took them first. '
+                     'All the servers posting to the same message store '
+                     'should use the same mode.')),
+
+    cfg.StrOpt('stats_mode', default='exact',
+               choices=('exact', 'counters'),
+               help=('How queue stats are computed. "exact" counts the '
+                     'messages of the queue on every request. "counters" '
+                     'reports counters that are kept up to date as '
+                     'messages are posted, claimed and deleted, and that '
+                     'are recounted every stats_reconcile_interval '
+                     'seconds, since expired messages and claims are not '
+                     'tracked. Such stats are flagged as approximate.')),
+
+    cfg.IntOpt('stats_reconcile_interval', default=300, min=1,
+               help=('Maximum age, in seconds, of the stats counters of '
+                     'a queue, when stats_mode is "counters". Older '
+                     'counters are recounted when stats are requested. '
+                     'zaqar-gc recounts the counters older than half '
+                     'this interval, so that stats requests seldom have '
+                     'to.')),
+
+    cfg.StrOpt('post_write_concern',
+               help=('Write concern of message posts: a number of nodes, '
+                     '"majority" or the name of a tag set. Defaults to the '
+                     'write concern of the message databases, which is '
+                     '"majority" unless the connection URI sets one. Like '
+                     'the other storage options, it can be set for each '
+                     'pool.')),
+
+    cfg.BoolOpt('post_journal',
+                help=('Whether message posts wait for the write to be '
+                      'committed to the journal. Defaults to the journaling '
+                      'of the message databases.')),
+
+    cfg.StrOpt('delete_write_concern', default='0',
+               help=('Write concern of message deletes, including the '
+                     'removal of popped messages: a number of nodes, '
+                     '"majority" or the name of a tag set. The default, '
+                     '0, does not wait for deletes to be acknowledged.')),
+
+    cfg.BoolOpt('delete_journal',
+                help=('Whether message deletes wait for the write to be '
+                      'committed to the journal. Cannot be enabled along '
+                      'with a delete_write_concern of 0.')),
+
+    cfg.FloatOpt('delete_coalesce_window', default=0.0, min=0.0,
+                 help=('Number of seconds during which concurrent message '
+                       'deletes to the same partition are collected, and '
+                       'then sent together in one unordered bulk write. '
+                       'Deletes wait for up to this long before they are '
+                       'sent. Bulk deletes are not coalesced when '
+                       'stats_mode is "counters". Set to 0 (the default) '
+                       'to send each delete on its own.')),
+
+    cfg.BoolOpt('marker_watch', default=False,
+                help=('Follow a change stream on each partition to keep '
+                      'the latest message marker of every queue in '
+                      'memory, so that listing messages past the latest '
+                      'marker of a queue does not query the database. '
+                      'Messages may show up to listings a few '
+                      'milliseconds later than they would otherwise. '
+                      'Requires a replica set running MongoDB 3.6 or '
+                      'later.')),
 )
 
 MANAGEMENT_MONGODB_GROUP = 'drivers:management_store:mongodb'
@@ -0,0 +1,491 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Placement of queues on the partitions of the message databases.
+
+Queues are placed by hashing their scoped name, either modulo the
+number of partitions or on a consistent hash ring. A placement table
+records the queues placed explicitly on a partition, which take
+precedence, and is what makes it possible to move a queue to another
+partition while it is in use.
+
+Moving a queue goes like this:
+
+1. The queue is pinned to the partition it is on, and its messages
+   are copied to the target partition. Servers keep using the source
+   partition in the meantime.
+2. The queue is pinned to the target partition, and its counter, if
+   kept in the partition, moves along, well ahead of the markers
+   handed out so far. Servers switch over as their placement cache
+   expires.
+3. Once every server has switched, the source partition is reconciled
+   with the copy: messages posted there in the meantime are copied,
+   messages deleted there are deleted, and newer claims are carried
+   over. The source messages are then removed.
+
+Messages posted to the source partition during the switch over may be
+listed out of order, and a message whose claim was renewed on both
+sides keeps the later claim.
+"""
+
+import bisect
+import hashlib
+import struct
+import time
+
+from oslo_cache import core
+from oslo_log import log as logging
+from oslo_utils import timeutils
+import pymongo
+import pymongo.errors
+
+from zaqar.common import cache
+from zaqar.i18n import _LI
+from zaqar.i18n import _LW
+from zaqar.storage.mongodb import messages
+from zaqar.storage.mongodb import utils
+
+LOG = logging.getLogger(__name__)
+
+PROJ_QUEUE = utils.PROJ_QUEUE_KEY
+
+# NOTE: Number of placements cached by each server
+PLACEMENT_CACHE_SIZE = 10000
+
+# NOTE: Servers that have not picked up the new placement of a queue
+# yet keep handing out markers from the old counter, so the counter
+# is moved this far ahead, to keep markers unique and increasing.
+MARKER_GAP = 10 ** 7
+
+COPY_BATCH_SIZE = 1000
+
+# NOTE: Number of queues moved between two waits for the servers to
+# pick up their new placements.
+MOVE_GROUP_SIZE = 100
+
+
+def _hash(key):
+    digest = hashlib.md5(key.encode('utf-8')).digest()
+    return struct.unpack('>Q', digest[:8])[0]
+
+
+class HashRing(object):
+    """Consistent hash ring of partition numbers.
+
+    Each partition gets a number of points on the ring, and a name is
+    placed on the partition of the first point that follows its hash.
+    Adding a partition only moves the names that now hash closest to
+    one of its points.
+
+    :param num_partitions: Number of partitions
+    :param vnodes: Number of points per partition
+    """
+
+    def __init__(self, num_partitions, vnodes):
+        points = sorted((_hash('%d-%d' % (partition, vnode)), partition)
+                        for partition in range(num_partitions)
+                        for vnode in range(vnodes))
+
+        self._hashes = [point for point, __ in points]
+        self._partitions = [partition for __, partition in points]
+
+    def get_partition(self, name):
+        index = bisect.bisect(self._hashes, _hash(name))
+        return self._partitions[index % len(self._partitions)]
+
+
+class PlacementTable(object):
+    """Queues placed explicitly on a partition.
+
+    ::
+
+        Placements:
+            Name                Field
+            -------------------------
+            scope            ->   p_q
+            partition        ->     p
+            moving from/to   ->     m
+
+    Lookups are cached for `cache_ttl` seconds. As long as the table
+    is empty, which is the common case, lookups cost one query per
+    `cache_ttl` seconds, regardless of the number of queues.
+    """
+
+    def __init__(self, collection, cache_ttl):
+        self._col = collection
+        self._cache_ttl = cache_ttl
+        self._cache = cache.LRUCache(PLACEMENT_CACHE_SIZE, cache_ttl)
+
+        self._empty = False
+        self._checked_at = None
+
+        self._col.ensure_index(PROJ_QUEUE, name='queue', unique=True,
+                               background=True)
+
+    @property
+    def cache_ttl(self):
+        return self._cache_ttl
+
+    def lookup(self, scope):
+        """Returns the partition a queue is pinned to, or None."""
+
+        now = timeutils.now()
+        if self._checked_at is None or now - self._checked_at >= (
+                self._cache_ttl):
+            self._empty = self._col.find_one(projection={'_id': 1}) is None
+            self._checked_at = now
+
+        if self._empty:
+            return None
+
+        partition = self._cache.get(scope)
+        if partition is core.NO_VALUE:
+            doc = self.get(scope)
+            partition = doc['p'] if doc else None
+            self._cache.set(scope, partition)
+
+        return partition
+
+    def get(self, scope):
+        """Returns the placement of a queue, bypassing the cache."""
+        return self._col.find_one({PROJ_QUEUE: scope},
+                                  projection={'_id': 0})
+
+    def list(self):
+        return self._col.find(projection={'_id': 0})
+
+    def pin(self, scope, partition, moving=None):
+        """Places a queue on a partition.
+
+        :param moving: Partition the queue is being moved from or to
+        """
+
+        self._col.update_one({PROJ_QUEUE: scope},
+                             {'$set': {'p': partition, 'm': moving}},
+                             upsert=True)
+        self._forget(scope)
+
+    def pin_if_missing(self, scope, partition):
+        """Places a queue on a partition, unless it is placed already.
+
+        :returns: True if the queue was pinned
+        """
+
+        res = self._col.update_one({PROJ_QUEUE: scope},
+                                   {'$setOnInsert': {'p': partition,
+                                                     'm': None}},
+                                   upsert=True)
+        self._forget(scope)
+        return res.upserted_id is not None
+
+    def unpin(self, scope):
+        self._col.delete_one({PROJ_QUEUE: scope})
+        self._forget(scope)
+
+    def _forget(self, scope):
+        # NOTE: Other servers pick up changes as their cache expires,
+        # this one does right away.
+        self._cache.delete(scope)
+        self._checked_at = None
+
+
+class Placement(object):
+    """Resolves the partition of a queue.
+
+    :param conf: The mongodb message store options
+    :param collection: Collection holding the placement table
+    """
+
+    def __init__(self, conf, collection):
+        self._num_partitions = conf.partitions
+
+        self._ring = None
+        if conf.partition_placement == 'ring':
+            self._ring = HashRing(conf.partitions,
+                                  conf.partition_ring_vnodes)
+
+        self.table = PlacementTable(collection, conf.placement_cache_ttl)
+
+    def hashed_partition(self, queue, project=None):
+        """Returns the partition a queue hashes to."""
+
+        if self._ring is None:
+            return utils.get_partition(self._num_partitions, queue, project)
+
+        name = project + queue if project is not None else queue
+        return self._ring.get_partition(name)
+
+    def get_partition(self, queue, project=None):
+        partition = self.table.lookup(utils.scope_queue_name(queue, project))
+        if partition is None:
+            return self.hashed_partition(queue, project)
+
+        return partition
+
+
+def _counter_in_partition(driver):
+    # NOTE: See MessageController._counter_collection()
+    return not hasattr(driver.queue_controller, '_inc_counter')
+
+
+def _chunks(items, size=COPY_BATCH_SIZE):
+    items = list(items)
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def _insert(collection, docs):
+    try:
+        # NOTE: Bodies may have keys that are not valid field names,
+        # hence the legacy insert. Messages already there were copied
+        # by an interrupted run.
+        collection.insert(docs, check_keys=False, continue_on_error=True)
+    except pymongo.errors.DuplicateKeyError:
+        pass
+
+
+def _copy_messages(source, target, scope):
+    """Copies the messages of a queue, in marker order.
+
+    :returns: A dict of the claim expiration and transaction of the
+        copied messages, by ID.
+    """
+
+    copied = {}
+    query = {PROJ_QUEUE: scope}
+
+    while True:
+        docs = list(source.find(query).sort('k', 1).limit(COPY_BATCH_SIZE)
+                    .hint(messages.ACTIVE_INDEX_FIELDS))
+        if not docs:
+            break
+
+        _insert(target, docs)
+        for doc in docs:
+            copied[doc['_id']] = (doc['c']['e'], doc['tx'])
+
+        # NOTE: Messages posted after the last full batch are left to
+        # the reconciliation.
+        if len(docs) < COPY_BATCH_SIZE:
+            break
+
+        query['k'] = {'$gt': docs[-1]['k']}
+
+    return copied
+
+
+def _move_counter(source, target, scope, counter_in_partition):
+    """Moves the stats document of a queue, counter included."""
+
+    update = {'$unset': {'s': ''}}
+
+    if counter_in_partition:
+        doc = source.find_one({PROJ_QUEUE: scope}, projection={'c': 1})
+        if doc and 'c' in doc:
+            counter = dict(doc['c'])
+            counter['v'] += MARKER_GAP
+            if 'w' in counter:
+                counter['w'] = counter['v']
+
+            update['$set'] = {'c': counter}
+
+    target.update_one({PROJ_QUEUE: scope}, update, upsert='$set' in update)
+
+
+def _reconcile_messages(source, target, scope, copied):
+    """Brings the copy of a queue up to date with the source messages.
+
+    :returns: A (posted, deleted, updated) tuple of message counts
+    """
+
+    late = []
+    present = set()
+    updates = []
+
+    for doc in source.find({PROJ_QUEUE: scope}):
+        present.add(doc['_id'])
+
+        if doc['_id'] not in copied:
+            late.append(doc)
+            continue
+
+        claim_expires, transaction = copied[doc['_id']]
+
+        if doc['c']['e'] > claim_expires:
+            # NOTE: Claimed or renewed after the copy; the condition
+            # keeps claims taken on the target in the meantime, if
+            # they are more recent.
+            updates.append(pymongo.UpdateOne(
+                {'_id': doc['_id'], 'c.e': {'$lt': doc['c']['e']}},
+                {'$set': {'c': doc['c'], 'e': doc['e'], 't': doc['t']}}))
+
+        if transaction is not None and doc['tx'] is None:
+            updates.append(pymongo.UpdateOne({'_id': doc['_id']},
+                                             {'$set': {'tx': None}}))
+
+    for docs in _chunks(late):
+        _insert(target, docs)
+
+    for requests in _chunks(updates):
+        target.bulk_write(requests, ordered=False)
+
+    deleted = [mid for mid in copied if mid not in present]
+    for ids in _chunks(deleted):
+        target.delete_many({'_id': {'$in': ids}})
+
+    return len(late), len(deleted), len(updates)
+
+
+def move_queues(driver, moves, settle_time=None, pin=True):
+    """Moves the messages of queues to other partitions.
+
+    The queues stay available while they are moved. They are moved in
+    groups, each group waiting once for the servers to pick up the new
+    placements.
+
+    :param driver: The mongodb DataDriver
+    :param moves: Iterable of (scope, partition) tuples, where scope is
+        the scoped name of a queue (see utils.scope_queue_name), and
+        partition the partition to move it to
+    :param settle_time: Number of seconds to wait for servers to pick
+        up the new placements. Defaults to a bit more than the
+        placement cache TTL.
+    :param pin: Whether to keep the queues pinned to their partition,
+        or to leave them to hashing. A queue stays pinned anyway if it
+        does not hash to its partition.
+    :returns: The number of queues whose messages were moved
+    """
+
+    placement = driver.partition_placement
+    table = placement.table
+    databases = driver.message_databases
+    counter_in_partition = _counter_in_partition(driver)
+
+    if settle_time is None:
+        settle_time = table.cache_ttl + 5
+
+    moved = 0
+    for group in _chunks(moves, MOVE_GROUP_SIZE):
+        switched = []
+
+        for scope, partition in group:
+            project, queue = utils.parse_scoped_project_queue(scope)
+            hashed = placement.hashed_partition(queue, project or None)
+
+            doc = table.get(scope)
+            current = doc['p'] if doc else hashed
+
+            if current != partition:
+                source = databases[current].messages
+                target = databases[partition].messages
+
+                table.pin(scope, current, moving=partition)
+                copied = _copy_messages(source, target, scope)
+
+                table.pin(scope, partition, moving=current)
+                _move_counter(source.stats, target.stats, scope,
+                              counter_in_partition)
+
+                switched.append((scope, source, target, copied))
+
+        if switched:
+            time.sleep(settle_time)
+
+        for scope, source, target, copied in switched:
+            posted, deleted, updated = _reconcile_messages(source, target,
+                                                           scope, copied)
+
+            source.delete_many({PROJ_QUEUE: scope})
+            source.stats.delete_one({PROJ_QUEUE: scope})
+
+            msgtmpl = _LI(u'Moved queue %(scope)s to %(target)s: '
+                          u'%(copied)d message(s) copied, then '
+                          u'%(posted)d posted, %(deleted)d deleted and '
+                          u'%(updated)d updated during the switch over')
+            LOG.info(msgtmpl, dict(scope=scope, target=target.database.name,
+                                   copied=len(copied), posted=posted,
+                                   deleted=deleted, updated=updated))
+
+        for scope, partition in group:
+            project, queue = utils.parse_scoped_project_queue(scope)
+            if pin or partition != placement.hashed_partition(
+                    queue, project or None):
+                table.pin(scope, partition)
+            else:
+                table.unpin(scope)
+
+        moved += len(switched)
+
+    return moved
+
+
+def _find_queues(driver):
+    """Finds the partitions that hold data of each queue."""
+
+    found = {}
+    for partition, db in enumerate(driver.message_databases):
+        for collection in (db.messages, db.messages.stats):
+            groups = collection.aggregate([{'$group': {'_id': '$' +
+                                                       PROJ_QUEUE}}],
+                                          allowDiskUse=True)
+            for group in groups:
+                found.setdefault(group['_id'], set()).add(partition)
+
+    return found
+
+
+def pin_queues(driver):
+    """Pins every queue to the partition that holds its data.
+
+    Run this before changing the placement options, so that existing
+    queues stay where they are until they are moved.
+
+    :returns: The number of queues pinned
+    """
+
+    table = driver.partition_placement.table
+
+    pinned = 0
+    for scope, partitions in sorted(_find_queues(driver).items()):
+        if len(partitions) > 1:
+            msgtmpl = _LW(u'Queue %(scope)s has data in partitions '
+                          u'%(partitions)s, not pinning it')
+            LOG.warning(msgtmpl, dict(scope=scope,
+                                      partitions=sorted(partitions)))
+            continue
+
+        if table.pin_if_missing(scope, partitions.pop()):
+            pinned += 1
+
+    return pinned
+
+
+def rebalance(driver, settle_time=None):
+    """Moves the pinned queues to the partition they hash to.
+
+    Queues pinned explicitly to a partition other than the one they
+    hash to are moved as well, so only use this to finish a change of
+    the placement options.
+
+    :returns: The number of queues whose messages were moved
+    """
+
+    placement = driver.partition_placement
+
+    moves = []
+    for doc in placement.table.list():
+        project, queue = utils.parse_scoped_project_queue(doc[PROJ_QUEUE])
+        moves.append((doc[PROJ_QUEUE],
+                      placement.hashed_partition(queue, project or None)))
+
+    return move_queues(driver, moves, settle_time=settle_time, pin=False)
@@ -81,12 +81,14 @@ class QueueController(storage.Queue):
             -------------------
             value        ->   v
             modified ts  ->   t
+            watermark    ->   w
     """
 
     def __init__(self, *args, **kwargs):
         super(QueueController, self).__init__(*args, **kwargs)
 
         self._cache = self.driver.cache
+        self._local_cache = self.driver.queue_cache
         self._collection = self.driver.queues_database.queues
 
         # NOTE(flaper87): This creates a unique index for
@@ -242,8 +244,9 @@ class QueueController(storage.Queue):
         try:
             # NOTE(kgriffs): Start counting at 1, and assume the first
             # message ever posted will succeed and set t to a UNIX
-            # "modified at" timestamp.
-            counter = {'v': 1, 't': 0}
+            # "modified at" timestamp. The watermark, w, is only used
+            # by the FIFO message controller; see its post() method.
+            counter = {'v': 1, 't': 0, 'w': 1}
 
             scoped_name = utils.scope_queue_name(name, project)
             self._collection.insert({'p_q': scoped_name, 'm': metadata or {},
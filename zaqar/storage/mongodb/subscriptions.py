@@ -115,6 +115,7 @@ class SubscriptionController(base.Subscription):
                                                        'o': options,
                                                        'p': project,
                                                        'c': confirmed})
+            self._purge_cache(queue, project)
             return subscription_id
         except pymongo.errors.DuplicateKeyError:
             return None
@@ -153,11 +154,14 @@ class SubscriptionController(base.Subscription):
         if not res['updatedExisting']:
             raise errors.SubscriptionDoesNotExist(subscription_id)
 
+        self._purge_cache(queue, project)
+
     @utils.raises_conn_error
     def delete(self, queue, subscription_id, project=None):
         self._collection.remove({'_id': utils.to_oid(subscription_id),
                                  'p': project,
                                  's': queue}, w=0)
+        self._purge_cache(queue, project)
 
     @utils.raises_conn_error
     def get_with_subscriber(self, queue, subscriber, project=None):
@@ -176,6 +180,8 @@ class SubscriptionController(base.Subscription):
         if not res['updatedExisting']:
             raise errors.SubscriptionDoesNotExist(subscription_id)
 
+        self._purge_cache(queue, project)
+
 
 def _basic_subscription(record, now):
     # NOTE(Eva-i): unused here record's field 'e' (expires) has changed it's
@@ -19,6 +19,7 @@ import collections
 import datetime
 import functools
 import random
+import threading
 import time
 
 from bson import errors as berrors
@@ -27,7 +28,9 @@ from bson import tz_util
 from oslo_log import log as logging
 from oslo_utils import timeutils
 from pymongo import errors
+import pymongo.write_concern
 
+from zaqar.common import errors as common_errors
 from zaqar.i18n import _LE
 from zaqar.i18n import _LW
 from zaqar.storage import errors as storage_errors
@@ -240,6 +243,31 @@ def get_partition(num_partitions, queue, project=None):
     return binascii.crc32(name.encode('utf-8')) % num_partitions
 
 
+def write_concern(w=None, j=None):
+    """Builds a write concern from config values.
+
+    :param w: Number of nodes (as a string), 'majority' or the name of
+        a tag set. None leaves it to the server default.
+    :param j: Whether to wait for the journal commit, or None
+    :returns: A WriteConcern instance, or None if neither option is set
+    :raises: ConfigurationError if the combination is invalid
+    """
+
+    if w is None and j is None:
+        return None
+
+    kwargs = {}
+    if w is not None:
+        kwargs['w'] = int(w) if w.isdigit() else w
+    if j is not None:
+        kwargs['j'] = j
+
+    try:
+        return pymongo.write_concern.WriteConcern(**kwargs)
+    except errors.ConfigurationError as ex:
+        raise common_errors.ConfigurationError(str(ex))
+
+
 def raises_conn_error(func):
     """Handles the MongoDB ConnectionFailure error.
 
@@ -322,3 +350,72 @@ class HookedCursor(object):
 
     def __next__(self):
         return self.next()
+
+
+class WriteCoalescer(object):
+    """Groups concurrent writes to a collection into one bulk write.
+
+    The first write submitted after a flush waits for the coalescing
+    window to elapse, collecting the writes submitted by other threads
+    in the meantime, and then sends them all in one unordered
+    bulk_write. Every submitter returns once that bulk write is done,
+    and gets its result or exception.
+
+    :param collection: Collection to write to; its write concern
+        applies to the bulk writes.
+    :param window: Number of seconds to collect writes for
+    """
+
+    def __init__(self, collection, window):
+        self._collection = collection
+        self._window = window
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def submit(self, request):
+        """Adds a write to the next bulk write, and waits for it.
+
+        :param request: A pymongo write operation, e.g. DeleteOne
+        :returns: The BulkWriteResult of the batch
+        """
+
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _CoalescedBatch()
+
+            batch.requests.append(request)
+
+        if leader:
+            time.sleep(self._window)
+
+            with self._lock:
+                self._batch = None
+
+            try:
+                batch.result = self._collection.bulk_write(batch.requests,
+                                                           ordered=False)
+            except Exception as ex:
+                batch.error = ex
+            finally:
+                batch.done.set()
+
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+        return batch.result
+
+
+class _CoalescedBatch(object):
+
+    __slots__ = ('requests', 'done', 'result', 'error')
+
+    def __init__(self):
+        self.requests = []
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -21,6 +21,7 @@ from stevedore import extension
 from zaqar import common
 from zaqar.common import decorators
 from zaqar.i18n import _
+from zaqar.notification import outbox
 from zaqar.storage import base
 
 LOG = logging.getLogger(__name__)
@@ -136,7 +137,12 @@ class DataDriver(base.DataDriverBase):
         return self._storage.is_alive()
 
     def _health(self):
-        return self._storage._health()
+        kpi = self._storage._health()
+        if self.conf.notification.outbox:
+            kpi = dict(kpi or {})
+            kpi['notification_outbox'] = outbox.stats(self.queue_controller,
+                                                      self.conf)
+        return kpi
 
     @decorators.lazy_property(write=False)
     def queue_controller(self):
@@ -16,10 +16,12 @@
 import heapq
 import itertools
 
+from oslo_cache import core
 from oslo_config import cfg
 from oslo_log import log
 from osprofiler import profiler
 
+from zaqar.common import cache as common_cache
 from zaqar.common import decorators
 from zaqar.common import errors as cerrors
 from zaqar.common.storage import select
@@ -34,6 +36,22 @@ _CATALOG_OPTIONS = (
     cfg.BoolOpt('enable_virtual_pool', default=False,
                 help=('If enabled, the message_store will be used '
                       'as the storage for the virtual pool.')),
+    cfg.IntOpt('local_cache_ttl', default=0, min=0,
+               help=('Number of seconds to keep queue to pool mappings '
+                     'in an in-process cache, in front of the oslo.cache '
+                     'backend. Should be lower than the backend TTL of '
+                     '10 seconds. Set to 0 to disable the in-process '
+                     'cache.')),
+    cfg.IntOpt('local_cache_max_entries', default=10000, min=1,
+               help=('Maximum number of queue to pool mappings to keep '
+                     'in the in-process cache.')),
+    cfg.IntOpt('negative_cache_ttl', default=0, min=0,
+               help=('Number of seconds to remember, in-process, that a '
+                     'queue is not mapped to any pool, so that requests '
+                     'for missing queues do not all go to the catalogue '
+                     'store. A queue created through another process may '
+                     'be reported missing for that long. Set to 0 to '
+                     'disable negative caching.')),
 )
 
 _CATALOG_GROUP = 'pooling:catalog'
@@ -110,6 +128,10 @@ class DataDriver(storage.DataDriverBase):
         # reachable or not
         KPI['catalog_reachable'] = self.is_alive()
 
+        # NOTE: Hit, miss and latency counters of the cached lookups,
+        # including the queue to pool mappings.
+        KPI['cache_stats'] = common_cache.STATS.snapshot()
+
         cursor = self._pool_catalog._pools_ctrl.list(limit=0)
         # Messages of each pool
         for pool in next(cursor):
@@ -118,6 +140,17 @@ class DataDriver(storage.DataDriverBase):
 
         return KPI
 
+    def _get_operation_status(self):
+        # NOTE: Probe each pool, rather than whichever pool the probe
+        # queue happens to be placed in.
+        status = {}
+        cursor = self._pool_catalog._pools_ctrl.list(limit=0)
+        for pool in next(cursor):
+            driver = self._pool_catalog.get_driver(pool['name'])
+            status[pool['name']] = driver._get_operation_status()
+
+        return status
+
     def gc(self):
         cursor = self._pool_catalog._pools_ctrl.list(limit=0)
         for pool in next(cursor):
@@ -190,10 +223,16 @@ class QueueController(storage.Queue):
         marker_name = {}
 
         # limit the iterator and strip out the comparison wrapper
+        queues = [queue_cmp.obj for queue_cmp in itertools.islice(ls, limit)]
+
+        # NOTE: Clients tend to go on and use the queues they listed,
+        # so warm up their pool mappings with a single request.
+        self._pool_catalog.prefetch([q['name'] for q in queues], project)
+
         def it():
-            for queue_cmp in itertools.islice(ls, limit):
-                marker_name['next'] = queue_cmp.obj['name']
-                yield queue_cmp.obj
+            for queue in queues:
+                marker_name['next'] = queue['name']
+                yield queue
 
         yield it()
         yield marker_name and marker_name['next']
@@ -441,6 +480,22 @@ class Catalog(object):
         self._conf.register_opts(_CATALOG_OPTIONS, group=_CATALOG_GROUP)
         self._catalog_conf = self._conf[_CATALOG_GROUP]
 
+        self._local_cache = None
+        if self._catalog_conf.local_cache_ttl:
+            self._local_cache = common_cache.LRUCache(
+                self._catalog_conf.local_cache_max_entries,
+                self._catalog_conf.local_cache_ttl)
+
+        self._unmapped_cache = None
+        if self._catalog_conf.negative_cache_ttl:
+            self._unmapped_cache = common_cache.LRUCache(
+                self._catalog_conf.local_cache_max_entries,
+                self._catalog_conf.negative_cache_ttl)
+
+        # NOTE: Set to a function taking a cache key in order to
+        # tell other processes about purged entries.
+        self._cache_purge_hook = None
+
         self._pools_ctrl = control.pools_controller
         self._flavor_ctrl = control.flavors_controller
         self._catalogue_ctrl = control.catalogue_controller
@@ -478,6 +533,49 @@ class Catalog(object):
         """
         return self._catalogue_ctrl.get(project, queue)['pool']
 
+    def _is_unmapped(self, queue, project):
+        if self._unmapped_cache is None:
+            return False
+
+        key = _pool_cache_key(queue, project)
+        return self._unmapped_cache.get(key) is not core.NO_VALUE
+
+    def _set_unmapped(self, queue, project, unmapped):
+        if self._unmapped_cache is None:
+            return
+
+        key = _pool_cache_key(queue, project)
+        if unmapped:
+            self._unmapped_cache.set(key, True)
+        else:
+            self._unmapped_cache.delete(key)
+
+    def prefetch(self, queues, project=None):
+        """Load the pool mappings of several queues at once.
+
+        The mappings are stored in the cache, so that looking up
+        any of the queues afterwards does not hit the catalogue.
+
+        :param queues: Names of the queues to look up
+        :type queues: [six.text_type]
+        :param project: Project to which the queues belong, or
+            None for the "global" or "generic" project.
+        :type project: six.text_type
+        """
+
+        queues = list(queues)
+        if not queues:
+            return
+
+        entries = self._catalogue_ctrl.get_many(project, queues)
+        self._pool_id.prime(self, dict(((entry['queue'], project),
+                                        entry['pool'])
+                                       for entry in entries))
+
+        unmapped = set(queues) - set(entry['queue'] for entry in entries)
+        for queue in unmapped:
+            self._set_unmapped(queue, project, True)
+
     def register(self, queue, project=None, flavor=None):
         """Register a new queue in the pool catalog.
 
@@ -502,37 +600,37 @@ class Catalog(object):
 
         """
 
+        if flavor is not None:
+            flavor = self._flavor_ctrl.get(flavor, project=project)
+            pools = self._pools_ctrl.get_pools_by_group(
+                group=flavor['pool_group'],
+                detailed=True)
+            pool = select.weighted(pools)
+            pool = pool and pool['name'] or None
+        else:
+            # NOTE(flaper87): Get pools assigned to the default
+            # group `None`. We should consider adding a `default_group`
+            # option in the future.
+            pools = self._pools_ctrl.get_pools_by_group(detailed=True)
+            pool = select.weighted(pools)
+            pool = pool and pool['name'] or None
+
+            if not pool:
+                # NOTE(flaper87): We used to raise NoPoolFound in this
+                # case but we've decided to support automatic pool
+                # creation. Note that we're now returning and the queue
+                # is not being registered in the catalogue. This is done
+                # on purpose since no pool exists and the "dummy" pool
+                # doesn't exist in the storage
+                if self.lookup(queue, project) is not None:
+                    return
+                raise errors.NoPoolFound()
+
         # NOTE(cpp-cabrera): only register a queue if the entry
-        # doesn't exist
-        if not self._catalogue_ctrl.exists(project, queue):
-
-            if flavor is not None:
-                flavor = self._flavor_ctrl.get(flavor, project=project)
-                pools = self._pools_ctrl.get_pools_by_group(
-                    group=flavor['pool_group'],
-                    detailed=True)
-                pool = select.weighted(pools)
-                pool = pool and pool['name'] or None
-            else:
-                # NOTE(flaper87): Get pools assigned to the default
-                # group `None`. We should consider adding a `default_group`
-                # option in the future.
-                pools = self._pools_ctrl.get_pools_by_group(detailed=True)
-                pool = select.weighted(pools)
-                pool = pool and pool['name'] or None
-
-                if not pool:
-                    # NOTE(flaper87): We used to raise NoPoolFound in this
-                    # case but we've decided to support automatic pool
-                    # creation. Note that we're now returning and the queue
-                    # is not being registered in the catalogue. This is done
-                    # on purpose since no pool exists and the "dummy" pool
-                    # doesn't exist in the storage
-                    if self.lookup(queue, project) is not None:
-                        return
-                    raise errors.NoPoolFound()
-
-            self._catalogue_ctrl.insert(project, queue, pool)
+        # doesn't exist. The catalogue checks for that and inserts
+        # the entry in a single request.
+        self._catalogue_ctrl.get_or_insert(project, queue, pool)
+        self._set_unmapped(queue, project, False)
 
     @_pool_id.purges
     def deregister(self, queue, project=None):
@@ -660,10 +758,14 @@ class Catalog(object):
         :rtype: Maybe DataDriver
         """
 
+        if self._is_unmapped(queue, project):
+            return self.get_default_pool(use_listing=False)
+
         try:
             pool_id = self._pool_id(queue, project)
         except errors.QueueNotMapped as ex:
             LOG.debug(ex)
+            self._set_unmapped(queue, project, True)
 
             return self.get_default_pool(use_listing=False)
 
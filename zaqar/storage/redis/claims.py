@@ -38,6 +38,16 @@ RETRY_CLAIM_TIMEOUT = 10
 # Intel Core i7 (not including network latency).
 COUNTING_BATCH_SIZE = 100
 
+# Number of message IDs to check per script call when reconciling
+# the available/claimed indexes during garbage collection.
+RECONCILE_BATCH_SIZE = 100
+
+# Number of message IDs to add to the available/claimed indexes per
+# script call when migrating a queue that predates them, and the
+# number of such calls a single claim or stats request may make.
+MIGRATION_BATCH_SIZE = 100
+MIGRATION_BATCHES_PER_REQUEST = 10
+
 
 class ClaimController(storage.Claim, scripting.Mixin):
     """Implements claim resource operations using Redis.
@@ -76,12 +86,22 @@ class ClaimController(storage.Claim, scripting.Mixin):
         +----------------+---------+
     """
 
-    script_names = ['claim_messages']
+    script_names = ['claim_messages', 'reindex_messages', 'renew_claim',
+                    'release_claim']
 
     def __init__(self, *args, **kwargs):
         super(ClaimController, self).__init__(*args, **kwargs)
         self._client = self.driver.connection
 
+        # NOTE: Key of a claim's message list, less the claim ID, for
+        # scripts that need to build it.
+        self._claim_msgs_key_prefix = utils.scope_claim_messages(
+            '', CLAIM_MESSAGES_SUFFIX)
+
+        # NOTE: Message ID lists known to be fully indexed. Once a
+        # queue is indexed it stays that way, so this only ever grows.
+        self._indexed_msgsets = set()
+
         self._packer = msgpack.Packer(encoding='utf-8',
                                       use_bin_type=True).pack
         self._unpacker = functools.partial(msgpack.unpackb, encoding='utf-8')
@@ -103,7 +123,7 @@ class ClaimController(storage.Claim, scripting.Mixin):
         else:
             return [transform(v) for v in values] if transform else values
 
-    def _claim_messages(self, msgset_key, now, limit,
+    def _claim_messages(self, queue, project, now, limit,
                         claim_id, claim_expires, msg_ttl, msg_expires):
 
         # NOTE(kgriffs): A watch on a pipe could also be used, but that
@@ -111,8 +131,98 @@ class ClaimController(storage.Claim, scripting.Mixin):
         # having to do something similar in the MongoDB driver.
         func = self._scripts['claim_messages']
 
+        keys = [
+            utils.msgset_key(queue, project),
+            utils.available_msgset_key(queue, project),
+            utils.claimed_msgset_key(queue, project),
+            utils.expires_msgset_key(queue, project),
+        ]
+
         args = [now, limit, claim_id, claim_expires, msg_ttl, msg_expires]
-        return func(keys=[msgset_key], args=args)
+        return func(keys=keys, args=args)
+
+    def _reindex(self, queue, project, message_ids):
+        """Make sure the given messages are in the right index.
+
+        :returns: Number of index entries that were fixed
+        """
+
+        if not message_ids:
+            return 0
+
+        func = self._scripts['reindex_messages']
+
+        keys = [
+            utils.msgset_key(queue, project),
+            utils.available_msgset_key(queue, project),
+            utils.claimed_msgset_key(queue, project),
+            utils.expires_msgset_key(queue, project),
+        ]
+
+        now = timeutils.utcnow_ts()
+        num_removed, num_fixed = func(keys=keys,
+                                      args=[now] + list(message_ids))
+        return num_removed + num_fixed
+
+    def _index_legacy_messages(self, queue, project,
+                               max_batches=MIGRATION_BATCHES_PER_REQUEST):
+        """Build the available/claimed indexes for an older queue.
+
+        Queues created before the indexes were introduced only have
+        the msgset. This migrates them in batches, in FIFO order, and
+        saves how far it got so that the next call resumes from there.
+        Each batch is a separate script call, so Redis is never
+        blocked for long.
+
+        :param max_batches: Give up after this many batches, or run
+            until the queue is done if None.
+        :returns: True if the queue is fully indexed, otherwise False
+        """
+
+        msgset_key = utils.msgset_key(queue, project)
+        if msgset_key in self._indexed_msgsets:
+            return True
+
+        client = self._client
+
+        with client.pipeline() as pipe:
+            pipe.sismember(messages.CLAIM_INDEXED_MSGSETS_KEY, msgset_key)
+            pipe.hget(messages.CLAIM_INDEX_CURSORS_KEY, msgset_key)
+            indexed, last_rank = pipe.execute()
+
+        last_rank = int(last_rank or 0)
+        num_batches = 0
+
+        while not indexed:
+            if max_batches is not None and num_batches == max_batches:
+                client.hset(messages.CLAIM_INDEX_CURSORS_KEY, msgset_key,
+                            last_rank)
+                return False
+
+            # NOTE: Ranks only ever increase, so paging by rank is not
+            # thrown off by messages being added or removed meanwhile.
+            ranked_ids = client.zrangebyscore(msgset_key,
+                                              '(%d' % last_rank, '+inf',
+                                              start=0,
+                                              num=MIGRATION_BATCH_SIZE,
+                                              withscores=True)
+            num_batches += 1
+
+            if ranked_ids:
+                self._reindex(queue, project,
+                              [mid for mid, rank in ranked_ids])
+                last_rank = int(ranked_ids[-1][1])
+
+            if len(ranked_ids) < MIGRATION_BATCH_SIZE:
+                with client.pipeline() as pipe:
+                    pipe.sadd(messages.CLAIM_INDEXED_MSGSETS_KEY, msgset_key)
+                    pipe.hdel(messages.CLAIM_INDEX_CURSORS_KEY, msgset_key)
+                    pipe.execute()
+
+                indexed = True
+
+        self._indexed_msgsets.add(msgset_key)
+        return True
 
     def _exists(self, queue, claim_id, project):
         client = self._client
@@ -148,7 +258,23 @@ class ClaimController(storage.Claim, scripting.Mixin):
         return self._client.lrange(claim_msgs_key, 0, -1)
 
     def _count_messages(self, queue, project):
-        """Count and return the total number of claimed messages."""
+        """Count and return the total number of claimed messages.
+
+        The claimed index is scored by claim expiry, so the count is a
+        single ZCOUNT. Queues that have not been migrated to the index
+        are migrated a few batches at a time; until they are done, this
+        falls back to adding up the size of each claim.
+        """
+
+        if not self._index_legacy_messages(queue, project):
+            return self._count_messages_by_claim(queue, project)
+
+        claimed_key = utils.claimed_msgset_key(queue, project)
+        now = timeutils.utcnow_ts()
+        return self._client.zcount(claimed_key, '(%d' % now, '+inf')
+
+    def _count_messages_by_claim(self, queue, project):
+        """Count claimed messages by walking the queue's claims."""
 
         # NOTE(kgriffs): Iterate through all claims, adding up the
         # number of messages per claim. This is obviously slower
@@ -187,24 +313,6 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
         return num_claimed
 
-    def _del_message(self, queue, project, claim_id, message_id, pipe):
-        """Called by MessageController when messages are being deleted.
-
-        This method removes the message from claim data structures.
-        """
-
-        claim_msgs_key = utils.scope_claim_messages(claim_id,
-                                                    CLAIM_MESSAGES_SUFFIX)
-
-        # NOTE(kgriffs): In practice, scanning will be quite fast,
-        # since the usual pattern is to delete messages from oldest
-        # to newest, and the list is sorted in that order. Also,
-        # the length of the list will usually be ~10 messages.
-        pipe.lrem(claim_msgs_key, 1, message_id)
-
-        # NOTE(kgriffs): Decrement the message counter used for stats
-        pipe.hincrby(claim_id, 'n', -1)
-
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def _gc(self, queue, project):
@@ -222,6 +330,63 @@ class ClaimController(storage.Claim, scripting.Mixin):
         num_removed = self._client.zremrangebyscore(claims_set_key, 0, now)
         return num_removed
 
+    @utils.raises_conn_error
+    @utils.retries_on_connection_error
+    def _reconcile(self, queue, project):
+        """Fix drift between the claim indexes and the messages.
+
+        The claimed index drives the claimed message count reported by
+        queue stats, and the available index drives claiming. Both are
+        checked against the claim fields of each message, in small
+        batches so as not to block Redis for long.
+
+        :returns: Number of index entries that were fixed
+        """
+
+        client = self._client
+        claimed_key = utils.claimed_msgset_key(queue, project)
+        available_key = utils.available_msgset_key(queue, project)
+
+        num_fixed = 0
+
+        # NOTE: Fixing a claimed entry changes its score, and with it
+        # the entry's position in the index. Read the whole index
+        # before fixing anything so that paging is not thrown off.
+        claimed_ids = []
+        offset = 0
+
+        while True:
+            mids = client.zrange(claimed_key, offset,
+                                 offset + RECONCILE_BATCH_SIZE - 1)
+            if not mids:
+                break
+
+            claimed_ids.extend(mids)
+            offset += len(mids)
+
+        for i in range(0, len(claimed_ids), RECONCILE_BATCH_SIZE):
+            num_fixed += self._reindex(
+                queue, project, claimed_ids[i:i + RECONCILE_BATCH_SIZE])
+
+        # NOTE: The available index is scored by message rank, which
+        # never changes, so it can simply be paged by score.
+        last_rank = None
+
+        while True:
+            min_score = '-inf' if last_rank is None else '(%d' % last_rank
+            ranked_ids = client.zrangebyscore(available_key, min_score,
+                                              '+inf', start=0,
+                                              num=RECONCILE_BATCH_SIZE,
+                                              withscores=True)
+            if not ranked_ids:
+                break
+
+            num_fixed += self._reindex(queue, project,
+                                       [mid for mid, rank in ranked_ids])
+            last_rank = int(ranked_ids[-1][1])
+
+        return num_fixed
+
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def get(self, queue, claim_id, project=None):
@@ -269,9 +434,12 @@ class ClaimController(storage.Claim, scripting.Mixin):
         claim_id = uuidutils.generate_uuid()
         claimed_msgs = []
 
+        # NOTE: Messages of an older queue can only be claimed once
+        # they have been indexed, so help the migration along.
+        self._index_legacy_messages(queue, project)
+
         # NOTE(kgriffs): Claim some messages
-        msgset_key = utils.msgset_key(queue, project)
-        claimed_ids = self._claim_messages(msgset_key, now, limit,
+        claimed_ids = self._claim_messages(queue, project, now, limit,
                                            claim_id, claim_expires,
                                            msg_ttl, msg_expires)
 
@@ -330,48 +498,20 @@ class ClaimController(storage.Claim, scripting.Mixin):
         msg_ttl = claim_ttl + grace
         msg_expires = claim_expires + grace
 
-        claim_msgs_key = utils.scope_claim_messages(claim_id,
-                                                    CLAIM_MESSAGES_SUFFIX)
-
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
-        claimed_msgs = messages.MessageEnvelope.from_redis_bulk(msg_keys,
-                                                                self._client)
-        claim_info = {
-            't': claim_ttl,
-            'e': claim_expires,
-        }
-
-        with self._client.pipeline() as pipe:
-            for msg in claimed_msgs:
-                if msg:
-                    msg.claim_id = claim_id
-                    msg.claim_expires = claim_expires
-
-                    if _msg_would_expire(msg, claim_expires):
-                        msg.ttl = msg_ttl
-                        msg.expires = msg_expires
-
-                    # TODO(kgriffs): Rather than writing back the
-                    # entire message, only set the fields that
-                    # have changed.
-                    #
-                    # When this change is made, don't forget to
-                    # also call pipe.expire with the new TTL value.
-                    msg.to_redis(pipe)
+        # NOTE: Only the claim fields of each message are written, and
+        # only for messages still owned by this claim.
+        func = self._scripts['renew_claim']
 
-            # Update the claim id and claim expiration info
-            # for all the messages.
-            pipe.hmset(claim_id, claim_info)
-            pipe.expire(claim_id, claim_ttl)
+        keys = [
+            utils.claimed_msgset_key(queue, project),
+            utils.scope_claim_messages(claim_id, CLAIM_MESSAGES_SUFFIX),
+            utils.scope_claims_set(queue, project, QUEUE_CLAIMS_SUFFIX),
+            claim_id,
+            utils.expires_msgset_key(queue, project),
+        ]
 
-            pipe.expire(claim_msgs_key, claim_ttl)
-
-            claims_set_key = utils.scope_claims_set(queue, project,
-                                                    QUEUE_CLAIMS_SUFFIX)
-
-            pipe.zadd(claims_set_key, claim_expires, claim_id)
-
-            pipe.execute()
+        args = [claim_id, claim_ttl, claim_expires, msg_ttl, msg_expires]
+        func(keys=keys, args=args)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
@@ -381,35 +521,14 @@ class ClaimController(storage.Claim, scripting.Mixin):
         if not self._exists(queue, claim_id, project):
             return
 
-        now = timeutils.utcnow_ts()
-        claim_msgs_key = utils.scope_claim_messages(claim_id,
-                                                    CLAIM_MESSAGES_SUFFIX)
-
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
-        claimed_msgs = messages.MessageEnvelope.from_redis_bulk(msg_keys,
-                                                                self._client)
-        # Update the claim id and claim expiration info
-        # for all the messages.
-        claims_set_key = utils.scope_claims_set(queue, project,
-                                                QUEUE_CLAIMS_SUFFIX)
-
-        with self._client.pipeline() as pipe:
-            pipe.zrem(claims_set_key, claim_id)
-            pipe.delete(claim_id)
-            pipe.delete(claim_msgs_key)
-
-            for msg in claimed_msgs:
-                if msg:
-                    msg.claim_id = None
-                    msg.claim_expires = now
-
-                    # TODO(kgriffs): Rather than writing back the
-                    # entire message, only set the fields that
-                    # have changed.
-                    msg.to_redis(pipe)
+        func = self._scripts['release_claim']
 
-            pipe.execute()
+        keys = [
+            utils.claimed_msgset_key(queue, project),
+            utils.scope_claim_messages(claim_id, CLAIM_MESSAGES_SUFFIX),
+            utils.scope_claims_set(queue, project, QUEUE_CLAIMS_SUFFIX),
+            claim_id,
+        ]
 
-
-def _msg_would_expire(message, now):
-    return message.expires <= now
+        now = timeutils.utcnow_ts()
+        func(keys=keys, args=[claim_id, now])
@@ -178,17 +178,14 @@ class DataDriver(storage.DataDriverBase):
 
     def _health(self):
         KPI = {}
-        KPI['storage_reachable'] = self.is_alive()
-        KPI['operation_status'] = self._get_operation_status()
 
         # TODO(kgriffs): Add metrics re message volume
         return KPI
 
     def gc(self):
-        # TODO(kgriffs): Check time since last run, and if
-        # it hasn't been very long, skip. This allows for
-        # running the GC script on multiple boxes for HA,
-        # without having them all attempting to GC at the
+        # NOTE: The message controller takes a lease on a shard of the
+        # queues, so the GC script can run on multiple boxes for HA
+        # without them all attempting to GC the same queues at the
         # same moment.
         self.message_controller.gc()
 
@@ -12,11 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import functools
+import collections
+import random
+import time
 import uuid
+import zlib
 
+from oslo_log import log as logging
 from oslo_utils import encodeutils
 from oslo_utils import timeutils
+from oslo_utils import uuidutils
 import redis
 
 from zaqar.common import decorators
@@ -29,9 +34,21 @@ from zaqar.storage.redis import utils
 Message = models.Message
 MessageEnvelope = models.MessageEnvelope
 
+LOG = logging.getLogger(__name__)
+
 
 MSGSET_INDEX_KEY = 'msgset_index'
 
+# Set of message ID lists that have already been split into the
+# available/claimed indexes. Queues created before those indexes
+# existed are migrated a batch at a time, by garbage collection and
+# by claims and stats on the queue.
+CLAIM_INDEXED_MSGSETS_KEY = 'claim_indexed_msgsets'
+
+# Hash of the rank each unfinished migration has reached, keyed by
+# message ID list, so that it can pick up where it left off.
+CLAIM_INDEX_CURSORS_KEY = 'claim_index_cursors'
+
 # The rank counter is an atomic index to rank messages
 # in a FIFO manner.
 MESSAGE_RANK_COUNTER_SUFFIX = 'rank_counter'
@@ -45,6 +62,26 @@ RETRY_POST_TIMEOUT = 10
 # 1-2 milliseconds.
 GC_BATCH_SIZE = 100
 
+# Garbage collection bookkeeping. Each shard has a lease, so that only
+# one run collects it at a time, and a cursor (queue offset plus message
+# rank) recording where the last run on it stopped. Running totals of
+# what was reclaimed are kept in a hash for monitoring.
+GC_LEASE_KEY_PREFIX = 'gc_lease.'
+GC_CURSOR_KEY_PREFIX = 'gc_cursor.'
+GC_STATS_KEY = 'gc_stats'
+
+# Outcomes reported by the delete_messages script for each message
+DELETE_NOT_FOUND = 0
+DELETE_DELETED = 1
+DELETE_IS_CLAIMED = 2
+DELETE_NOT_CLAIMED = 3
+DELETE_NOT_CLAIMED_BY = 4
+
+# Maximum number of message IDs the listing script may look at in one
+# call while searching for messages to return, so that a long run of
+# claimed or expired messages cannot block Redis.
+LIST_SCAN_LIMIT = 10000
+
 
 class MessageController(storage.Message, scripting.Mixin):
     """Implements message resource operations using Redis.
@@ -98,9 +135,26 @@ class MessageController(storage.Message, scripting.Mixin):
     4. Messages rank counter (Redis Hash):
 
         Key: <project_id>.<queue_name>.rank_counter
+
+    5. Available message id's list (Redis sorted set)
+
+        Subset of the message id's list containing only the messages
+        that are not currently claimed, scored by the same rank. The
+        claim script takes messages from the head of this set, so it
+        never has to step over messages that are already claimed.
+
+        Key: <project_id>.<queue_name>.available
+
+    6. Claimed message id's list (Redis sorted set)
+
+        The remaining messages, scored by the time at which their
+        claim expires. Expired or released claims are moved back to
+        the available set by the claim script.
+
+        Key: <project_id>.<queue_name>.claimed
     """
 
-    script_names = ['index_messages']
+    script_names = ['index_messages', 'list_messages', 'delete_messages']
 
     def __init__(self, *args, **kwargs):
         super(MessageController, self).__init__(*args, **kwargs)
@@ -114,28 +168,77 @@ class MessageController(storage.Message, scripting.Mixin):
     def _claim_ctrl(self):
         return self.driver.claim_controller
 
-    def _index_messages(self, msgset_key, counter_key, message_ids):
+    def _index_messages(self, msgset_key, counter_key, available_key,
+                        expires_key, message_ids, message_expires):
         # NOTE(kgriffs): A watch on a pipe could also be used to ensure
         # messages are inserted in order, but that would be less efficient.
         func = self._scripts['index_messages']
 
-        arguments = [len(message_ids)] + message_ids
-        func(keys=[msgset_key, counter_key], args=arguments)
+        keys = [msgset_key, counter_key, available_key,
+                CLAIM_INDEXED_MSGSETS_KEY, expires_key]
+        arguments = [len(message_ids)] + message_ids + message_expires
+        func(keys=keys, args=arguments)
+
+    def _delete_messages(self, queue, project, message_ids,
+                         check_claim=False, claim=None):
+        """Delete a batch of messages and their claim records atomically.
+
+        :param check_claim: If True, only delete messages that the
+            given claim (or no claim, if None) is allowed to delete.
+        :returns: List of DELETE_* outcomes, one per message ID
+        """
+
+        func = self._scripts['delete_messages']
+
+        keys = [
+            utils.msgset_key(queue, project),
+            utils.available_msgset_key(queue, project),
+            utils.claimed_msgset_key(queue, project),
+            utils.expires_msgset_key(queue, project),
+        ]
+
+        args = [
+            timeutils.utcnow_ts(),
+            int(check_claim),
+            claim or '',
+            self._claim_ctrl._claim_msgs_key_prefix,
+        ] + list(message_ids)
+
+        return func(keys=keys, args=args)
 
     def _count(self, queue, project):
         """Return total number of messages in a queue.
 
-        Note: Some expired messages may be included in the count if
-            they haven't been GC'd yet. This is done for performance.
+        Messages that have expired, but have not been GC'd yet, are
+        subtracted using the expiry index, so no scan is needed.
         """
 
-        return self._client.zcard(utils.msgset_key(queue, project))
+        now = timeutils.utcnow_ts()
+
+        with self._client.pipeline() as pipe:
+            pipe.zcard(utils.msgset_key(queue, project))
+            pipe.zcount(utils.expires_msgset_key(queue, project),
+                        '-inf', now)
+            num_messages, num_expired = pipe.execute()
+
+        return max(num_messages - num_expired, 0)
 
     def _create_msgset(self, queue, project, pipe):
         pipe.zadd(MSGSET_INDEX_KEY, 1, utils.msgset_key(queue, project))
 
     def _delete_msgset(self, queue, project, pipe):
-        pipe.zrem(MSGSET_INDEX_KEY, utils.msgset_key(queue, project))
+        msgset_key = utils.msgset_key(queue, project)
+        pipe.zrem(MSGSET_INDEX_KEY, msgset_key)
+        pipe.srem(CLAIM_INDEXED_MSGSETS_KEY, msgset_key)
+        pipe.hdel(CLAIM_INDEX_CURSORS_KEY, msgset_key)
+
+    def _unindex_message(self, queue, project, message_id, pipe):
+        """Remove a message ID from all of the queue's ID lists."""
+
+        pipe.zrem(utils.msgset_key(queue, project), message_id)
+        pipe.zrem(utils.available_msgset_key(queue, project), message_id)
+        pipe.zrem(utils.claimed_msgset_key(queue, project), message_id)
+        pipe.zrem(utils.expires_msgset_key(queue, project), message_id)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
@@ -151,38 +254,12 @@ class MessageController(storage.Message, scripting.Mixin):
         message_ids = client.zrange(msgset_key, 0, -1)
 
         pipe.delete(msgset_key)
+        pipe.delete(utils.available_msgset_key(queue, project))
+        pipe.delete(utils.claimed_msgset_key(queue, project))
+        pipe.delete(utils.expires_msgset_key(queue, project))
         for msg_id in message_ids:
             pipe.delete(msg_id)
 
-    # TODO(prashanthr_): Look for better ways to solve the issue.
-    def _find_first_unclaimed(self, queue, project, limit):
-        """Find the first unclaimed message in the queue."""
-
-        msgset_key = utils.msgset_key(queue, project)
-        now = timeutils.utcnow_ts()
-
-        # TODO(kgriffs): Generalize this paging pattern (DRY)
-        offset = 0
-
-        while True:
-            msg_keys = self._client.zrange(msgset_key, offset,
-                                           offset + limit - 1)
-            if not msg_keys:
-                return None
-
-            offset += len(msg_keys)
-
-            messages = [MessageEnvelope.from_redis(msg_key, self._client)
-                        for msg_key in msg_keys]
-
-            for msg in messages:
-                if msg and not utils.msg_claimed_filter(msg, now):
-                    return msg.id
-
-    def _exists(self, message_id):
-        """Check if message exists in the Queue."""
-        return self._client.exists(message_id)
-
     def _get_first_message_id(self, queue, project, sort):
         """Fetch head/tail of the Queue.
 
@@ -195,33 +272,6 @@ class MessageController(storage.Message, scripting.Mixin):
         message_ids = zrange(msgset_key, 0, 0)
         return message_ids[0] if message_ids else None
 
-    def _get_claim(self, message_id):
-        """Gets minimal claim doc for a message.
-
-        :returns: {'id': cid, 'expires': ts} IFF the message is claimed,
-            and that claim has not expired.
-        """
-
-        claim = self._client.hmget(message_id, 'c', 'c.e')
-
-        if claim == [None, None]:
-            # NOTE(kgriffs): message_id was not found
-            return None
-
-        info = {
-            # NOTE(kgriffs): A "None" claim is serialized as an empty str
-            'id': encodeutils.safe_decode(claim[0]) or None,
-            'expires': int(claim[1]),
-        }
-
-        # Is the message claimed?
-        now = timeutils.utcnow_ts()
-        if info['id'] and (now < info['expires']):
-            return info
-
-        # Not claimed
-        return None
-
     def _list(self, queue, project=None, marker=None,
               limit=storage.DEFAULT_MESSAGES_PER_PAGE,
               echo=False, client_uuid=None,
@@ -232,113 +282,272 @@ class MessageController(storage.Message, scripting.Mixin):
             raise errors.QueueDoesNotExist(queue,
                                            project)
 
-        msgset_key = utils.msgset_key(queue, project)
-        client = self._client
+        # NOTE: The script walks the msgset and applies the expiry,
+        # claim and echo filters inside Redis, so a page is always full
+        # unless the end of the queue is reached.
+        func = self._scripts['list_messages']
 
-        if not marker and not include_claimed:
-            # NOTE(kgriffs): Skip claimed messages at the head
-            # of the queue; otherwise we would just filter them all
-            # out and likely end up with an empty list to return.
-            marker = self._find_first_unclaimed(queue, project, limit)
-            start = client.zrank(msgset_key, marker) or 0
-        else:
-            rank = client.zrank(msgset_key, marker)
-            start = rank + 1 if rank else 0
+        now = timeutils.utcnow_ts()
+        args = [
+            now,
+            limit,
+            marker or '',
+            int(include_claimed),
+            int(echo),
+            client_uuid or '',
+            LIST_SCAN_LIMIT,
+        ]
 
-        message_ids = client.zrange(msgset_key, start,
-                                    start + (limit - 1))
+        next_marker, msg_hmaps = func(keys=[utils.msgset_key(queue, project)],
+                                      args=args)
 
-        messages = Message.from_redis_bulk(message_ids, client)
+        messages = [Message.from_hmap(dict(zip(hmap[::2], hmap[1::2])))
+                    for hmap in msg_hmaps]
 
-        # NOTE(prashanthr_): Build a list of filters for checking
-        # the following:
-        #
-        #     1. Message is expired
-        #     2. Message is claimed
-        #     3. Message should not be echoed
-        #
-        now = timeutils.utcnow_ts()
-        filters = [functools.partial(utils.msg_expired_filter, now=now)]
+        if to_basic:
+            messages = [msg.to_basic(now) for msg in messages]
 
-        if not include_claimed:
-            filters.append(functools.partial(utils.msg_claimed_filter,
-                                             now=now))
+        yield iter(messages)
+        yield next_marker and encodeutils.safe_decode(next_marker)
 
-        if not echo:
-            filters.append(functools.partial(utils.msg_echo_filter,
-                                             client_uuid=client_uuid))
+    def _acquire_gc_lease(self, num_shards, lease_ttl):
+        """Take the lease on one of the garbage collection shards.
 
-        marker = {}
+        :returns: A (shard, token) tuple, or (None, None) if every
+            shard is already being collected by another run.
+        """
 
-        yield _filter_messages(messages, filters, to_basic, marker)
-        yield marker['next']
+        token = uuidutils.generate_uuid()
+        shards = list(range(num_shards))
+        random.shuffle(shards)
 
-    @utils.raises_conn_error
-    @utils.retries_on_connection_error
-    def gc(self):
-        """Garbage-collect expired message data.
+        for shard in shards:
+            lease_key = GC_LEASE_KEY_PREFIX + str(shard)
+            if self._client.set(lease_key, token, nx=True, ex=lease_ttl):
+                return shard, token
 
-        Not all message data can be automatically expired. This method
-        cleans up the remainder.
+        return None, None
 
-        :returns: Number of messages removed
+    def _release_gc_lease(self, shard, token):
+        lease_key = GC_LEASE_KEY_PREFIX + str(shard)
+
+        with self._client.pipeline() as pipe:
+            try:
+                # NOTE: Only give the lease up if it is still ours; it
+                # may have lapsed and been taken by another run.
+                pipe.watch(lease_key)
+                if encodeutils.safe_decode(pipe.get(lease_key) or '') == token:
+                    pipe.multi()
+                    pipe.delete(lease_key)
+                    pipe.execute()
+            except redis.exceptions.WatchError:
+                pass
+
+    def _remove_expired(self, queue, project):
+        """Drop expired messages from the queue's ID lists by range.
+
+        :returns: Number of message IDs removed
         """
-        client = self._client
 
+        client = self._client
+        expires_key = utils.expires_msgset_key(queue, project)
+        now = timeutils.utcnow_ts()
         num_removed = 0
-        offset_msgsets = 0
 
         while True:
-            # NOTE(kgriffs): Iterate across all message sets; there will
-            # be one set of message IDs per queue.
-            msgset_keys = client.zrange(MSGSET_INDEX_KEY,
-                                        offset_msgsets,
-                                        offset_msgsets + GC_BATCH_SIZE - 1)
-            if not msgset_keys:
+            mids = client.zrangebyscore(expires_key, '-inf', now,
+                                        start=0, num=GC_BATCH_SIZE)
+            if not mids:
                 break
 
-            offset_msgsets += len(msgset_keys)
+            with client.pipeline() as pipe:
+                for mid in mids:
+                    self._unindex_message(queue, project, mid, pipe)
+
+                pipe.execute()
+
+            num_removed += len(mids)
+
+        return num_removed
+
+    def _is_fully_indexed(self, queue, project):
+        """Check whether every ID in the msgset is in the indexes.
+
+        If so, expired messages have already been dropped by range and
+        there is no need to look at each message in turn.
+        """
+
+        with self._client.pipeline() as pipe:
+            pipe.zcard(utils.msgset_key(queue, project))
+            pipe.zcard(utils.available_msgset_key(queue, project))
+            pipe.zcard(utils.claimed_msgset_key(queue, project))
+            pipe.zcard(utils.expires_msgset_key(queue, project))
+            num_ids, num_available, num_claimed, num_expires = pipe.execute()
+
+        return num_ids == num_available + num_claimed == num_expires
+
+    def _gc_queue(self, msgset_key, last_rank, deadline, counts):
+        """Garbage-collect the messages of a single queue.
+
+        Expired message IDs are dropped by range using the expiry index.
+        Only if the indexes do not cover the whole msgset, e.g. because
+        older nodes posted to the queue, are the message IDs visited one
+        by one. That is done in rank order, starting after last_rank.
+        Ranks never change, so paging by rank is not thrown off by IDs
+        being removed along the way.
+
+        :returns: The last rank visited if the deadline was reached
+            before the queue was done, otherwise None
+        """
+
+        client = self._client
+        queue, project = utils.descope_message_ids_set(msgset_key)
+
+        if not last_rank:
+            # NOTE(kgriffs): Drive the claim controller GC from
+            # here, because we already know the queue and project
+            # scope.
+            counts['claims'] += self._claim_ctrl._gc(queue, project)
+            counts['messages'] += self._remove_expired(queue, project)
+            self._claim_ctrl._index_legacy_messages(queue, project,
+                                                    max_batches=None)
+            counts['index_fixes'] += self._claim_ctrl._reconcile(queue,
+                                                                 project)
+
+            if self._is_fully_indexed(queue, project):
+                return None
+
+        while True:
+            ranked_ids = client.zrangebyscore(msgset_key,
+                                              '(%d' % last_rank, '+inf',
+                                              start=0, num=GC_BATCH_SIZE,
+                                              withscores=True)
+            if not ranked_ids:
+                return None
 
-            for msgset_key in msgset_keys:
-                msgset_key = encodeutils.safe_decode(msgset_key)
+            mids = [mid for mid, rank in ranked_ids]
+            last_rank = int(ranked_ids[-1][1])
 
-                # NOTE(kgriffs): Drive the claim controller GC from
-                # here, because we already know the queue and project
-                # scope.
-                queue, project = utils.descope_message_ids_set(msgset_key)
-                self._claim_ctrl._gc(queue, project)
+            # NOTE: Messages posted by nodes that predate the
+            # available/claimed indexes only make it into the
+            # msgset. Index them here so they can be claimed.
+            counts['index_fixes'] += self._claim_ctrl._reindex(queue,
+                                                               project, mids)
 
-                offset_mids = 0
+            # NOTE(kgriffs): If redis expired the message, it will
+            # not exist, so all we have to do is remove mid from
+            # the msgset collection.
+            with client.pipeline() as pipe:
+                for mid in mids:
+                    pipe.exists(mid)
+
+                mid_exists_flags = pipe.execute()
+
+            with client.pipeline() as pipe:
+                for mid, exists in zip(mids, mid_exists_flags):
+                    if not exists:
+                        self._unindex_message(queue, project, mid, pipe)
+                        counts['messages'] += 1
+
+                pipe.execute()
 
-                while True:
-                    # NOTE(kgriffs): Look up each message in the message set,
-                    # see if it has expired, and if so, remove it from msgset.
-                    mids = client.zrange(msgset_key, offset_mids,
-                                         offset_mids + GC_BATCH_SIZE - 1)
+            if deadline is not None and time.time() >= deadline:
+                return last_rank
+
+    @utils.raises_conn_error
+    @utils.retries_on_connection_error
+    def gc(self):
+        """Garbage-collect expired message data.
+
+        Not all message data can be automatically expired. This method
+        cleans up the remainder.
 
-                    if not mids:
+        Queues are split into gc_shards shards by hash, and each run
+        takes a lease on one of them, so that several runs do not
+        duplicate work. A run stops once it has used up gc_time_budget,
+        saving its position so that the next run on the same shard can
+        pick up where it left off.
+
+        :returns: Number of messages removed
+        """
+
+        client = self._client
+        conf = self.driver.redis_conf
+
+        shard, token = self._acquire_gc_lease(conf.gc_shards,
+                                              conf.gc_lease_ttl)
+        if shard is None:
+            LOG.info(u'Skipping garbage collection; all %d shards are '
+                     u'already being collected', conf.gc_shards)
+            return 0
+
+        deadline = None
+        if conf.gc_time_budget:
+            deadline = time.time() + conf.gc_time_budget
+
+        cursor_key = GC_CURSOR_KEY_PREFIX + str(shard)
+        counts = collections.Counter(messages=0, claims=0, index_fixes=0,
+                                     queues=0)
+        finished = False
+        paused = False
+
+        try:
+            offset_msgsets, last_rank = [
+                int(v or 0) for v in client.hmget(cursor_key, 'q', 'r')]
+
+            while not paused:
+                # NOTE(kgriffs): Iterate across all message sets; there
+                # will be one set of message IDs per queue.
+                msgset_keys = client.zrange(
+                    MSGSET_INDEX_KEY, offset_msgsets,
+                    offset_msgsets + GC_BATCH_SIZE - 1)
+                if not msgset_keys:
+                    finished = True
+                    break
+
+                for msgset_key in msgset_keys:
+                    if _gc_shard(msgset_key, conf.gc_shards) == shard:
+                        last_rank = self._gc_queue(
+                            encodeutils.safe_decode(msgset_key),
+                            last_rank, deadline, counts)
+                        if last_rank is not None:
+                            paused = True
+                            break
+
+                        counts['queues'] += 1
+
+                    offset_msgsets += 1
+                    last_rank = 0
+
+                    if deadline is not None and time.time() >= deadline:
+                        paused = True
                         break
 
-                    offset_mids += len(mids)
+            with client.pipeline() as pipe:
+                if finished:
+                    pipe.delete(cursor_key)
+                else:
+                    pipe.hmset(cursor_key, {'q': offset_msgsets,
+                                            'r': last_rank or 0})
 
-                    # NOTE(kgriffs): If redis expired the message, it will
-                    # not exist, so all we have to do is remove mid from
-                    # the msgset collection.
-                    with client.pipeline() as pipe:
-                        for mid in mids:
-                            pipe.exists(mid)
+                for name, value in counts.items():
+                    pipe.hincrby(GC_STATS_KEY, name, value)
 
-                        mid_exists_flags = pipe.execute()
+                pipe.hincrby(GC_STATS_KEY, 'runs', 1)
+                pipe.hset(GC_STATS_KEY, 'last_run', timeutils.utcnow_ts())
+                pipe.execute()
 
-                    with client.pipeline() as pipe:
-                        for mid, exists in zip(mids, mid_exists_flags):
-                            if not exists:
-                                pipe.zrem(msgset_key, mid)
-                                num_removed += 1
+        finally:
+            self._release_gc_lease(shard, token)
 
-                        pipe.execute()
+        LOG.info(u'Garbage collection of shard %(shard)d %(status)s: '
+                 u'%(messages)d messages and %(claims)d claims removed, '
+                 u'%(index_fixes)d index entries fixed across %(queues)d '
+                 u'queues',
+                 dict(counts, shard=shard,
+                      status='finished' if finished else 'paused'))
 
-        return num_removed
+        return counts['messages']
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
@@ -407,8 +616,11 @@ class MessageController(storage.Message, scripting.Mixin):
         msgset_key = utils.msgset_key(queue, project)
         counter_key = utils.scope_queue_index(queue, project,
                                               MESSAGE_RANK_COUNTER_SUFFIX)
+        available_key = utils.available_msgset_key(queue, project)
+        expires_key = utils.expires_msgset_key(queue, project)
 
         message_ids = []
+        message_expires = []
         now = timeutils.utcnow_ts()
 
         with self._client.pipeline() as pipe:
@@ -424,6 +636,7 @@ class MessageController(storage.Message, scripting.Mixin):
 
                 prepared_msg.to_redis(pipe)
                 message_ids.append(prepared_msg.id)
+                message_expires.append(prepared_msg.expires)
 
             pipe.execute()
 
@@ -432,7 +645,8 @@ class MessageController(storage.Message, scripting.Mixin):
         # orphaned, but Redis will remove them when they
         # expire, so we will just pretend they don't exist
         # in that case.
-        self._index_messages(msgset_key, counter_key, message_ids)
+        self._index_messages(msgset_key, counter_key, available_key,
+                             expires_key, message_ids, message_expires)
 
         return message_ids
 
@@ -442,11 +656,6 @@ class MessageController(storage.Message, scripting.Mixin):
         if not self._queue_ctrl.exists(queue, project):
             return
 
-        # NOTE(kgriffs): The message does not exist, so
-        # it is essentially "already" deleted.
-        if not self._exists(message_id):
-            return
-
         # TODO(kgriffs): Create decorator for validating claim and message
         # IDs, since those are not checked at the transport layer. This
         # decorator should be applied to all relevant methods.
@@ -456,105 +665,67 @@ class MessageController(storage.Message, scripting.Mixin):
             except ValueError:
                 raise errors.ClaimDoesNotExist(claim, queue, project)
 
-        msg_claim = self._get_claim(message_id)
-        is_claimed = (msg_claim is not None)
+        # NOTE: The script checks the claim and deletes the message
+        # in one step, so there is no window in which the message can
+        # be claimed by someone else in between.
+        outcome, = self._delete_messages(queue, project, [message_id],
+                                         check_claim=True, claim=claim)
 
-        # Authorize the request based on having the correct claim ID
-        if claim is None:
-            if is_claimed:
-                raise errors.MessageIsClaimed(message_id)
+        # NOTE(kgriffs): If the message does not exist, it is
+        # essentially "already" deleted.
+        if outcome == DELETE_IS_CLAIMED:
+            raise errors.MessageIsClaimed(message_id)
 
-        elif not is_claimed:
+        elif outcome == DELETE_NOT_CLAIMED:
             raise errors.MessageNotClaimed(message_id)
 
-        elif msg_claim['id'] != claim:
+        elif outcome == DELETE_NOT_CLAIMED_BY:
             if not self._claim_ctrl._exists(queue, claim, project):
                 raise errors.ClaimDoesNotExist(claim, queue, project)
 
             raise errors.MessageNotClaimedBy(message_id, claim)
 
-        msgset_key = utils.msgset_key(queue, project)
-
-        with self._client.pipeline() as pipe:
-            pipe.delete(message_id)
-            pipe.zrem(msgset_key, message_id)
-
-            if is_claimed:
-                self._claim_ctrl._del_message(queue, project,
-                                              msg_claim['id'], message_id,
-                                              pipe)
-
-            pipe.execute()
-
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def bulk_delete(self, queue, message_ids, project=None):
         if not self._queue_ctrl.exists(queue, project):
             return
 
-        msgset_key = utils.msgset_key(queue, project)
-
-        with self._client.pipeline() as pipe:
-            for mid in message_ids:
-                if not self._exists(mid):
-                    continue
-
-                pipe.delete(mid)
-                pipe.zrem(msgset_key, mid)
-
-                msg_claim = self._get_claim(mid)
-                if msg_claim is not None:
-                    self._claim_ctrl._del_message(queue, project,
-                                                  msg_claim['id'], mid,
-                                                  pipe)
-            pipe.execute()
+        if message_ids:
+            self._delete_messages(queue, project, message_ids)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def pop(self, queue, limit, project=None):
         # Pop is implemented as a chain of the following operations:
-        # 1. Create a claim.
-        # 2. Delete the messages claimed.
-        # 3. Delete the claim.
-
-        claim_id, messages = self._claim_ctrl.create(
-            queue, dict(ttl=1, grace=0), project, limit=limit)
-
-        message_ids = [message['id'] for message in messages]
-        self.bulk_delete(queue, message_ids, project)
-        # NOTE(prashanthr_): Creating a claim controller reference
-        # causes a recursive reference. Hence, using the reference
-        # from the driver.
-        self._claim_ctrl.delete(queue, claim_id, project)
+        # 1. Claim some messages.
+        # 2. Read the messages claimed.
+        # 3. Delete them.
+        #
+        # NOTE: The claim never outlives this call, so there is no need
+        # to persist a claim record for it.
+        now = timeutils.utcnow_ts()
+        claim_id = uuidutils.generate_uuid()
+
+        self._claim_ctrl._index_legacy_messages(queue, project)
+        message_ids = self._claim_ctrl._claim_messages(
+            queue, project, now, limit, claim_id, now + 1, 1, now + 1)
+
+        if not message_ids:
+            return []
+
+        messages = Message.from_redis_bulk(message_ids, self._client)
+        messages = [msg.to_basic(now) for msg in messages if msg]
+
+        self._delete_messages(queue, project, message_ids)
         return messages
 
 
-def _filter_messages(messages, filters, to_basic, marker):
-    """Create a filtering iterator over a list of messages.
+def _gc_shard(msgset_key, num_shards):
+    """Return the garbage collection shard that a queue belongs to."""
 
-    The function accepts a list of filters to be filtered
-    before the the message can be included as a part of the reply.
-    """
-    now = timeutils.utcnow_ts()
-
-    for msg in messages:
-        # NOTE(kgriffs): Message may have been deleted, so
-        # check each value to ensure we got a message back
-        if msg is None:
-            continue
-
-        # NOTE(kgriffs): Check to see if any of the filters
-        # indiciate that this message should be skipped.
-        for should_skip in filters:
-            if should_skip(msg):
-                break
-        else:
-            marker['next'] = msg.id
+    return (zlib.crc32(msgset_key) & 0xffffffff) % num_shards
 
-            if to_basic:
-                yield msg.to_basic(now)
-            else:
-                yield msg
 
 QUEUES_SET_STORE_NAME = 'queues_set'
 
@@ -60,7 +60,27 @@ _COMMON_REDIS_OPTIONS = (
 )
 
 MANAGEMENT_REDIS_OPTIONS = _COMMON_REDIS_OPTIONS
-MESSAGE_REDIS_OPTIONS = _COMMON_REDIS_OPTIONS
+MESSAGE_REDIS_OPTIONS = _COMMON_REDIS_OPTIONS + (
+    cfg.FloatOpt('gc_time_budget', default=0.0,
+                 help=('Maximum number of seconds a single garbage '
+                       'collection run may spend on this message store. '
+                       'When the budget runs out, the run saves its '
+                       'position in Redis and the next run resumes from '
+                       'there. 0 means no limit.')),
+
+    cfg.IntOpt('gc_shards', default=1, min=1,
+               help=('Number of shards the queues are split into, by hash '
+                     'of their name, for garbage collection. Each '
+                     'zaqar-gc run takes a lease on one free shard, so up '
+                     'to this many runs can work side by side without '
+                     'duplicating work.')),
+
+    cfg.IntOpt('gc_lease_ttl', default=600, min=1,
+               help=('Number of seconds for which a zaqar-gc run holds the '
+                     'lease on its shard. Should be longer than '
+                     'gc_time_budget, so that the lease does not lapse '
+                     'while the run is still going.')),
+)
 
 MANAGEMENT_REDIS_GROUP = 'drivers:management_store:redis'
 MESSAGE_REDIS_GROUP = 'drivers:message_store:redis'
@@ -27,6 +27,17 @@ QUEUES_SET_STORE_NAME = 'queues_set'
 MESSAGE_IDS_SUFFIX = 'messages'
 
 
+def _queue_exists_key(name, project=None):
+    # NOTE: Use string concatenation for performance, and put the
+    # project first since it is guaranteed to be unique. None and ''
+    # both stand for the default project.
+    return 'exists:' + (project or '') + '/' + name
+
+
+def _queue_metadata_key(name, project=None):
+    return 'metadata:' + (project or '') + '/' + name
+
+
 class QueueController(storage.Queue):
     """Implements queue resource operations using Redis.
 
@@ -63,6 +74,7 @@ class QueueController(storage.Queue):
     def __init__(self, *args, **kwargs):
         super(QueueController, self).__init__(*args, **kwargs)
         self._client = self.driver.connection
+        self._local_cache = self.driver.queue_cache
         self._packer = msgpack.Packer(encoding='utf-8',
                                       use_bin_type=True).pack
         self._unpacker = functools.partial(msgpack.unpackb, encoding='utf-8')
@@ -75,6 +87,11 @@ class QueueController(storage.Queue):
     def _subscription_ctrl(self):
         return self.driver.subscription_controller
 
+    def _purge_cache(self, name, project):
+        if self._local_cache is not None:
+            self._local_cache.delete(_queue_exists_key(name, project))
+            self._local_cache.delete(_queue_metadata_key(name, project))
+
     def _get_queue_info(self, queue_key, fields, transform=str):
         """Get one or more fields from Queue Info."""
 
@@ -113,6 +130,27 @@ class QueueController(storage.Queue):
         except errors.QueueDoesNotExist:
             return {}
 
+    @utils.raises_conn_error
+    @utils.retries_on_connection_error
+    @decorators.caches_locally(_queue_exists_key, lambda v: v)
+    def _exists(self, name, project=None):
+        queue_key = utils.scope_queue_name(name, project)
+        qset_key = utils.scope_queue_name(QUEUES_SET_STORE_NAME, project)
+
+        return self._client.zrank(qset_key, queue_key) is not None
+
+    @utils.raises_conn_error
+    @utils.retries_on_connection_error
+    @decorators.caches_locally(_queue_metadata_key)
+    def get_metadata(self, name, project=None):
+        if not self.exists(name, project):
+            raise errors.QueueDoesNotExist(name, project)
+
+        queue_key = utils.scope_queue_name(name, project)
+        metadata = self._get_queue_info(queue_key, b'm', None)[0]
+
+        return self._unpacker(metadata)
+
     @utils.raises_conn_error
     def _create(self, name, metadata=None, project=None):
         # TODO(prashanthr_): Implement as a lua script.
@@ -138,18 +176,11 @@ class QueueController(storage.Queue):
                 pipe.execute()
             except redis.exceptions.ResponseError:
                 return False
+            finally:
+                self._purge_cache(name, project)
 
         return True
 
-    @utils.raises_conn_error
-    @utils.retries_on_connection_error
-    def _exists(self, name, project=None):
-        # TODO(prashanthr_): Cache this lookup
-        queue_key = utils.scope_queue_name(name, project)
-        qset_key = utils.scope_queue_name(QUEUES_SET_STORE_NAME, project)
-
-        return self._client.zrank(qset_key, queue_key) is not None
-
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def set_metadata(self, name, metadata, project=None):
@@ -160,17 +191,7 @@ class QueueController(storage.Queue):
         fields = {'m': self._packer(metadata)}
 
         self._client.hmset(key, fields)
-
-    @utils.raises_conn_error
-    @utils.retries_on_connection_error
-    def get_metadata(self, name, project=None):
-        if not self.exists(name, project):
-            raise errors.QueueDoesNotExist(name, project)
-
-        queue_key = utils.scope_queue_name(name, project)
-        metadata = self._get_queue_info(queue_key, b'm', None)[0]
-
-        return self._unpacker(metadata)
+        self._purge_cache(name, project)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
@@ -184,6 +205,8 @@ class QueueController(storage.Queue):
             pipe.delete(queue_key)
             pipe.execute()
 
+        self._purge_cache(name, project)
+
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def _stats(self, name, project=None):
@@ -19,6 +19,9 @@ limitations under the License.
 
 -- Read params
 local msgset_key = KEYS[1]
+local available_key = KEYS[2]
+local claimed_key = KEYS[3]
+local expires_key = KEYS[4]
 
 local now = tonumber(ARGV[1])
 local limit = tonumber(ARGV[2])
@@ -27,75 +30,104 @@ local claim_expires = tonumber(ARGV[4])
 local msg_ttl = tonumber(ARGV[5])
 local msg_expires = tonumber(ARGV[6])
 
--- Scan for up to 'limit' unclaimed messages
 local BATCH_SIZE = 100
 
-local start = 0
 local claimed_msgs = {}
 local msg_ids_to_cleanup = {}
 
-local found_unclaimed = false
+local function is_claimed(claim, claim_expires_prev)
+    return claim ~= '' and tonumber(claim_expires_prev) > now
+end
+
+-- Drop messages that have expired from all of the queue's indexes,
+-- so that the loops below do not have to step over them.
+local expired_msg_ids = redis.call('ZRANGEBYSCORE', expires_key, '-inf', now,
+                                   'LIMIT', 0, BATCH_SIZE)
+for i, mid in ipairs(expired_msg_ids) do
+    redis.call('ZREM', available_key, mid)
+    redis.call('ZREM', claimed_key, mid)
+    redis.call('ZREM', expires_key, mid)
+    msg_ids_to_cleanup[#msg_ids_to_cleanup + 1] = mid
+end
+
+-- Move messages whose claims have expired or been released back
+-- to the available set, in their original FIFO position. This is
+-- bounded so that a backlog of expired claims is worked off a batch
+-- at a time instead of in one long call.
+local expired_ids = redis.call('ZRANGEBYSCORE', claimed_key, '-inf', now,
+                               'LIMIT', 0, BATCH_SIZE)
+for i, mid in ipairs(expired_ids) do
+    redis.call('ZREM', claimed_key, mid)
+
+    local msg = redis.call('HMGET', mid, 'c', 'c.e')
+    if msg[1] == false and msg[2] == false then
+        msg_ids_to_cleanup[#msg_ids_to_cleanup + 1] = mid
+    elseif is_claimed(msg[1], msg[2]) then
+        -- NOTE: The claim was renewed, or the message was
+        -- claimed again, without the index being updated. Fix up
+        -- the score rather than handing the message out twice.
+        redis.call('ZADD', claimed_key, msg[2], mid)
+    else
+        local rank = redis.call('ZSCORE', msgset_key, mid)
+        if rank then
+            redis.call('ZADD', available_key, rank, mid)
+        end
+    end
+end
 
+-- Claim up to 'limit' messages from the head of the available set.
+-- Every ID is removed from the set as it is visited, so each batch
+-- starts again at rank 0 and never revisits claimed messages.
 while (#claimed_msgs < limit) do
-    local stop = (start + BATCH_SIZE - 1)
-    local msg_ids = redis.call('ZRANGE', msgset_key, start, stop)
+    local msg_ids = redis.call('ZRANGE', available_key, 0, BATCH_SIZE - 1)
 
     if (#msg_ids == 0) then
         break
     end
 
-    start = start + BATCH_SIZE
-
-    -- TODO(kgriffs): Try moving claimed IDs to a different set
-    -- to avoid scanning through already-claimed messages.
     for i, mid in ipairs(msg_ids) do
-        -- NOTE(kgriffs): Since execution of this script can not
-        -- happen in parallel, once we find the first unclaimed
-        -- message, the remaining messages will always be
-        -- unclaimed as well.
-
-        if not found_unclaimed then
-            local msg = redis.call('HMGET', mid, 'c', 'c.e')
-            if msg[1] == false and msg[2] == false then
-                -- NOTE(Eva-i): It means the message expired and does not
-                -- actually exist anymore, we must later garbage collect it's
-                -- ID from the set and move on.
-                msg_ids_to_cleanup[#msg_ids_to_cleanup + 1] = mid
-            elseif msg[1] == '' or tonumber(msg[2]) <= now then
-                found_unclaimed = true
-            end
-        end
-
-        if found_unclaimed then
-            -- Found an unclaimed message, so claim it.
-            local msg_expires_prev = redis.call('HGET', mid, 'e')
-            if msg_expires_prev ~= false then
-                -- NOTE(Eva-i): Condition above means the message is not
-                -- expired and we really can claim it.
+        redis.call('ZREM', available_key, mid)
+
+        local msg = redis.call('HMGET', mid, 'c', 'c.e', 'e')
+        if msg[3] == false then
+            -- NOTE(Eva-i): It means the message expired and does not
+            -- actually exist anymore, we must later garbage collect it's
+            -- ID from the set and move on.
+            msg_ids_to_cleanup[#msg_ids_to_cleanup + 1] = mid
+        elseif is_claimed(msg[1], msg[2]) then
+            redis.call('ZADD', claimed_key, msg[2], mid)
+        else
+            redis.call('HMSET', mid,
+                       'c', claim_id,
+                       'c.e', claim_expires)
+
+            -- Will the message expire early?
+            if tonumber(msg[3]) < claim_expires then
                 redis.call('HMSET', mid,
-                           'c', claim_id,
-                           'c.e', claim_expires)
-
-                -- Will the message expire early?
-                if tonumber(msg_expires_prev) < claim_expires then
-                    redis.call('HMSET', mid,
-                               't', msg_ttl,
-                               'e', msg_expires)
-                end
+                           't', msg_ttl,
+                           'e', msg_expires)
+
+                -- NOTE: Extend the key TTL along with the 'e' field.
+                -- Otherwise Redis would evict the message at its old
+                -- expiry, while it is still claimed, and the index
+                -- would be left pointing at a message that is gone.
+                redis.call('EXPIRE', mid, msg_ttl)
+                redis.call('ZADD', expires_key, msg_expires, mid)
+            end
 
-                claimed_msgs[#claimed_msgs + 1] = mid
+            redis.call('ZADD', claimed_key, claim_expires, mid)
+            claimed_msgs[#claimed_msgs + 1] = mid
 
-                if (#claimed_msgs == limit) then
-                    break
-                end
+            if (#claimed_msgs == limit) then
+                break
             end
         end
     end
 end
 
-if (#msg_ids_to_cleanup ~= 0) then
-    -- Garbage collect expired message IDs stored in msgset_key.
-    redis.call('ZREM', msgset_key, unpack(msg_ids_to_cleanup))
+-- Garbage collect expired message IDs stored in msgset_key.
+for i, mid in ipairs(msg_ids_to_cleanup) do
+    redis.call('ZREM', msgset_key, mid)
 end
 
 return claimed_msgs
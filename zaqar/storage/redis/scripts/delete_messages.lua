@@ -0,0 +1,85 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local msgset_key = KEYS[1]
+local available_key = KEYS[2]
+local claimed_key = KEYS[3]
+local expires_key = KEYS[4]
+
+local now = tonumber(ARGV[1])
+local check_claim = (ARGV[2] == '1')
+local claim_id = ARGV[3]
+local claim_msgs_prefix = ARGV[4]
+
+-- Outcomes, in the same order as the message IDs passed in
+local NOT_FOUND = 0
+local DELETED = 1
+local IS_CLAIMED = 2
+local NOT_CLAIMED = 3
+local NOT_CLAIMED_BY = 4
+
+local outcomes = {}
+
+for i = 5, #ARGV do
+    local mid = ARGV[i]
+    local outcome = DELETED
+
+    local msg = redis.call('HMGET', mid, 'c', 'c.e')
+    local is_claimed = (msg[1] and msg[1] ~= '' and
+                        tonumber(msg[2]) > now)
+
+    if msg[1] == false and msg[2] == false then
+        outcome = NOT_FOUND
+    elseif check_claim then
+        -- Authorize the request based on having the correct claim ID
+        if claim_id == '' then
+            if is_claimed then
+                outcome = IS_CLAIMED
+            end
+        elseif not is_claimed then
+            outcome = NOT_CLAIMED
+        elseif msg[1] ~= claim_id then
+            outcome = NOT_CLAIMED_BY
+        end
+    end
+
+    if outcome == DELETED then
+        redis.call('DEL', mid)
+        redis.call('ZREM', msgset_key, mid)
+        redis.call('ZREM', available_key, mid)
+        redis.call('ZREM', claimed_key, mid)
+        redis.call('ZREM', expires_key, mid)
+
+        -- Take the message out of its claim, unless the claim itself
+        -- has already expired.
+        if is_claimed and redis.call('EXISTS', msg[1]) == 1 then
+            redis.call('LREM', claim_msgs_prefix .. msg[1], 1, mid)
+            redis.call('HINCRBY', msg[1], 'n', -1)
+        end
+    elseif outcome == NOT_FOUND then
+        -- NOTE: The message expired; make sure its ID does not linger.
+        redis.call('ZREM', msgset_key, mid)
+        redis.call('ZREM', available_key, mid)
+        redis.call('ZREM', claimed_key, mid)
+        redis.call('ZREM', expires_key, mid)
+    end
+
+    outcomes[#outcomes + 1] = outcome
+end
+
+return outcomes
@@ -20,20 +20,44 @@ limitations under the License.
 -- Read params
 local msgset_key = KEYS[1]
 local counter_key = KEYS[2]
+local available_key = KEYS[3]
+local indexed_key = KEYS[4]
+local expires_key = KEYS[5]
 
 local num_message_ids = tonumber(ARGV[1])
 
 -- Get next rank value
-local rank_counter = tonumber(redis.call('GET', counter_key) or 1)
+local rank_counter = redis.call('GET', counter_key)
 
--- Add ranked message IDs
-local zadd_args = {'ZADD', msgset_key}
+-- The first post to a queue creates its rank counter. Every message
+-- in such a queue goes through this script, so its indexes never need
+-- to be built from the msgset.
+if not rank_counter then
+    redis.call('SADD', indexed_key, msgset_key)
+end
+
+rank_counter = tonumber(rank_counter or 1)
+
+-- Add ranked message IDs. New messages are unclaimed, so they
+-- also go straight into the set of available messages.
+local zadd_args = {}
 for i = 0, (num_message_ids - 1) do
     zadd_args[#zadd_args+1] = rank_counter + i
     zadd_args[#zadd_args+1] = ARGV[2 + i]
 end
 
-redis.call(unpack(zadd_args))
+redis.call('ZADD', msgset_key, unpack(zadd_args))
+redis.call('ZADD', available_key, unpack(zadd_args))
+
+-- Also index the IDs by expiry time, which follows the IDs in ARGV,
+-- so that expired messages can be dropped by range.
+local expires_args = {}
+for i = 0, (num_message_ids - 1) do
+    expires_args[#expires_args+1] = ARGV[2 + num_message_ids + i]
+    expires_args[#expires_args+1] = ARGV[2 + i]
+end
+
+redis.call('ZADD', expires_key, unpack(expires_args))
 
 -- Set next rank value
 return redis.call('SET', counter_key, rank_counter + num_message_ids)
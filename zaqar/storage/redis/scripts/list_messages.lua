@@ -0,0 +1,87 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local msgset_key = KEYS[1]
+
+local now = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local marker = ARGV[3]
+local include_claimed = (ARGV[4] == '1')
+local echo = (ARGV[5] == '1')
+local client_uuid = ARGV[6]
+local max_scanned = tonumber(ARGV[7])
+
+local BATCH_SIZE = 100
+
+-- Start right after the marker, or at the head of the queue if there
+-- is no marker or the marker message is gone.
+local start = 0
+if marker ~= '' then
+    local rank = redis.call('ZRANK', msgset_key, marker)
+    if rank then
+        start = rank + 1
+    end
+end
+
+local found_msgs = {}
+local next_marker = false
+local num_scanned = 0
+
+-- Walk the msgset a batch at a time, skipping messages that have
+-- expired, are claimed, or were posted by the client itself, until
+-- 'limit' messages have been found. The scan is bounded so that a long
+-- run of ineligible messages cannot block Redis; the marker then
+-- points at the last message that was scanned.
+while (#found_msgs < limit) and (num_scanned < max_scanned) do
+    local msg_ids = redis.call('ZRANGE', msgset_key, start,
+                               start + BATCH_SIZE - 1)
+
+    if (#msg_ids == 0) then
+        break
+    end
+
+    start = start + #msg_ids
+
+    for i, mid in ipairs(msg_ids) do
+        num_scanned = num_scanned + 1
+        next_marker = mid
+
+        local msg = redis.call('HMGET', mid, 'e', 'c', 'c.e', 'u')
+        local eligible = (msg[1] ~= false) and (tonumber(msg[1]) > now)
+
+        if eligible and not include_claimed then
+            eligible = (msg[2] == '') or (tonumber(msg[3]) <= now)
+        end
+
+        if eligible and not echo then
+            eligible = (msg[4] ~= client_uuid)
+        end
+
+        if eligible then
+            found_msgs[#found_msgs + 1] = redis.call('HGETALL', mid)
+
+            if (#found_msgs == limit) or (num_scanned == max_scanned) then
+                break
+            end
+        elseif num_scanned == max_scanned then
+            break
+        end
+    end
+end
+
+return {next_marker, found_msgs}
@@ -0,0 +1,82 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local msgset_key = KEYS[1]
+local available_key = KEYS[2]
+local claimed_key = KEYS[3]
+local expires_key = KEYS[4]
+
+local now = tonumber(ARGV[1])
+
+local num_removed = 0
+local num_fixed = 0
+
+-- Check each of the given message IDs against its message hash,
+-- which is authoritative, and make sure the ID is in the right indexes.
+for i = 2, #ARGV do
+    local mid = ARGV[i]
+
+    local msg = redis.call('HMGET', mid, 'c', 'c.e', 'e')
+    local available_score = redis.call('ZSCORE', available_key, mid)
+    local claimed_score = redis.call('ZSCORE', claimed_key, mid)
+
+    if msg[1] == false and msg[2] == false then
+        -- The message expired or was deleted
+        if available_score or claimed_score then
+            redis.call('ZREM', available_key, mid)
+            redis.call('ZREM', claimed_key, mid)
+            num_removed = num_removed + 1
+        end
+
+        redis.call('ZREM', expires_key, mid)
+    elseif msg[1] ~= '' and tonumber(msg[2]) > now then
+        -- Claimed; the ID belongs in the claimed index, scored by
+        -- the claim expiry.
+        if available_score or
+                tonumber(claimed_score or 0) ~= tonumber(msg[2]) then
+            redis.call('ZREM', available_key, mid)
+            redis.call('ZADD', claimed_key, msg[2], mid)
+            num_fixed = num_fixed + 1
+        end
+    elseif claimed_score then
+        if tonumber(claimed_score) > now then
+            -- Released without the index being updated. Expire the
+            -- entry so that the claim script makes it available again.
+            redis.call('ZADD', claimed_key, now, mid)
+            num_fixed = num_fixed + 1
+        end
+    elseif not available_score then
+        -- Not in either index, e.g. the message was posted by a node
+        -- that predates them. Make it available in its FIFO position.
+        local rank = redis.call('ZSCORE', msgset_key, mid)
+        if rank then
+            redis.call('ZADD', available_key, rank, mid)
+            num_fixed = num_fixed + 1
+        end
+    end
+
+    -- Every message must also be in the expiry index, scored by the
+    -- time at which it expires.
+    if msg[3] and tonumber(redis.call('ZSCORE', expires_key, mid) or -1) ~=
+            tonumber(msg[3]) then
+        redis.call('ZADD', expires_key, msg[3], mid)
+        num_fixed = num_fixed + 1
+    end
+end
+
+return {num_removed, num_fixed}
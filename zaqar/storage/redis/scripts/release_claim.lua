@@ -0,0 +1,50 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local claimed_key = KEYS[1]
+local claim_msgs_key = KEYS[2]
+local claims_set_key = KEYS[3]
+local claim_key = KEYS[4]
+
+local claim_id = ARGV[1]
+local now = tonumber(ARGV[2])
+
+local num_released = 0
+
+-- Only release messages that are still owned by this claim
+local msg_ids = redis.call('LRANGE', claim_msgs_key, 0, -1)
+for i, mid in ipairs(msg_ids) do
+    if redis.call('HGET', mid, 'c') == claim_id then
+        redis.call('HMSET', mid,
+                   'c', '',
+                   'c.e', now)
+
+        -- NOTE: Mark the message as expired in the claimed index; the
+        -- claim script will move it back to the available set the
+        -- next time it runs.
+        redis.call('ZADD', claimed_key, now, mid)
+        num_released = num_released + 1
+    end
+end
+
+-- Remove the claim itself
+redis.call('ZREM', claims_set_key, claim_id)
+redis.call('DEL', claim_key)
+redis.call('DEL', claim_msgs_key)
+
+return num_released
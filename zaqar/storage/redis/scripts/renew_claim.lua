@@ -0,0 +1,64 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local claimed_key = KEYS[1]
+local claim_msgs_key = KEYS[2]
+local claims_set_key = KEYS[3]
+local claim_key = KEYS[4]
+local expires_key = KEYS[5]
+
+local claim_id = ARGV[1]
+local claim_ttl = tonumber(ARGV[2])
+local claim_expires = tonumber(ARGV[3])
+local msg_ttl = tonumber(ARGV[4])
+local msg_expires = tonumber(ARGV[5])
+
+local num_renewed = 0
+
+-- Only touch the claim fields of messages that are still owned by
+-- this claim; a message may have been claimed by someone else since.
+local msg_ids = redis.call('LRANGE', claim_msgs_key, 0, -1)
+for i, mid in ipairs(msg_ids) do
+    local msg = redis.call('HMGET', mid, 'c', 'e')
+
+    if msg[1] == claim_id then
+        redis.call('HSET', mid, 'c.e', claim_expires)
+
+        -- Will the message expire early?
+        if tonumber(msg[2]) <= claim_expires then
+            redis.call('HMSET', mid,
+                       't', msg_ttl,
+                       'e', msg_expires)
+            redis.call('EXPIRE', mid, msg_ttl)
+            redis.call('ZADD', expires_key, msg_expires, mid)
+        end
+
+        redis.call('ZADD', claimed_key, claim_expires, mid)
+        num_renewed = num_renewed + 1
+    end
+end
+
+-- Update the claim itself
+redis.call('HMSET', claim_key,
+           't', claim_ttl,
+           'e', claim_expires)
+redis.call('EXPIRE', claim_key, claim_ttl)
+redis.call('EXPIRE', claim_msgs_key, claim_ttl)
+redis.call('ZADD', claims_set_key, claim_expires, claim_id)
+
+return num_renewed
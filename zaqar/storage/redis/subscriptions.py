@@ -138,6 +138,7 @@ class SubscriptionController(base.Subscription):
                     pipe.execute()
                 else:
                     return None
+            self._purge_cache(queue, project)
             return subscription_id
         except redis.exceptions.ResponseError:
             return None
@@ -227,6 +228,8 @@ class SubscriptionController(base.Subscription):
                 pipe.expire(subscription_id, new_ttl)
             pipe.execute()
 
+        self._purge_cache(queue, project)
+
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def delete(self, queue, subscription_id, project=None):
@@ -240,6 +243,8 @@ class SubscriptionController(base.Subscription):
                 pipe.delete(subscription_id)
                 pipe.execute()
 
+            self._purge_cache(queue, project)
+
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def get_with_subscriber(self, queue, subscriber, project=None):
@@ -267,3 +272,5 @@ class SubscriptionController(base.Subscription):
         with self._client.pipeline() as pipe:
             pipe.hmset(subscription_id, fields)
             pipe.execute()
+
+        self._purge_cache(queue, project)
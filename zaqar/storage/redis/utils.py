@@ -29,6 +29,9 @@ from zaqar.storage import errors
 
 LOG = logging.getLogger(__name__)
 MESSAGE_IDS_SUFFIX = 'messages'
+AVAILABLE_MESSAGE_IDS_SUFFIX = 'available'
+CLAIMED_MESSAGE_IDS_SUFFIX = 'claimed'
+EXPIRES_MESSAGE_IDS_SUFFIX = 'expires'
 SUBSCRIPTION_IDS_SUFFIX = 'subscriptions'
 
 
@@ -133,6 +136,19 @@ def msgset_key(queue, project=None):
     return scope_message_ids_set(queue, project, MESSAGE_IDS_SUFFIX)
 
 
+def available_msgset_key(queue, project=None):
+    return scope_message_ids_set(queue, project,
+                                 AVAILABLE_MESSAGE_IDS_SUFFIX)
+
+
+def claimed_msgset_key(queue, project=None):
+    return scope_message_ids_set(queue, project, CLAIMED_MESSAGE_IDS_SUFFIX)
+
+
+def expires_msgset_key(queue, project=None):
+    return scope_message_ids_set(queue, project, EXPIRES_MESSAGE_IDS_SUFFIX)
+
+
 def subset_key(queue, project=None):
     return scope_subscription_ids_set(queue, project, SUBSCRIPTION_IDS_SUFFIX)
 
@@ -57,6 +57,37 @@ class CatalogueController(base.CatalogueBase):
 
         return _normalize(entry)
 
+    def get_many(self, project, queues):
+        if not queues:
+            return []
+
+        stmt = sa.sql.select([tables.Catalogue]).where(sa.sql.and_(
+            tables.Catalogue.c.project == project,
+            tables.Catalogue.c.queue.in_(queues)
+        ))
+        return [_normalize(v) for v in self.driver.run(stmt)]
+
+    def get_or_insert(self, project, queue, pool):
+        # NOTE: The unique constraint does not cover NULL projects, so
+        # only insert when there is no entry yet, rather than relying on
+        # an IntegrityError.
+        values = sa.sql.select([
+            sa.sql.literal(pool, tables.Catalogue.c.pool.type),
+            sa.sql.literal(project, tables.Catalogue.c.project.type),
+            sa.sql.literal(queue, tables.Catalogue.c.queue.type),
+        ]).where(~sa.sql.exists().where(_match(project, queue)))
+
+        stmt = sa.sql.insert(tables.Catalogue).from_select(
+            ['pool', 'project', 'queue'], values)
+
+        try:
+            if self.driver.run(stmt).rowcount == 1:
+                return pool
+        except sa.exc.IntegrityError:
+            pass
+
+        return self.get(project, queue)['pool']
+
     def exists(self, project, queue):
         try:
             return self.get(project, queue) is not None
@@ -14,14 +14,35 @@
 
 import sqlalchemy as sa
 
+from zaqar.common import decorators
 from zaqar import storage
 from zaqar.storage import errors
 from zaqar.storage.sqlalchemy import tables
 from zaqar.storage.sqlalchemy import utils
 
 
+def _queue_exists_key(name, project=None):
+    # NOTE: Use string concatenation for performance, and put the
+    # project first since it is guaranteed to be unique. None and ''
+    # both stand for the default project.
+    return 'exists:' + (project or '') + '/' + name
+
+
+def _queue_metadata_key(name, project=None):
+    return 'metadata:' + (project or '') + '/' + name
+
+
 class QueueController(storage.Queue):
 
+    def __init__(self, *args, **kwargs):
+        super(QueueController, self).__init__(*args, **kwargs)
+        self._local_cache = self.driver.queue_cache
+
+    def _purge_cache(self, name, project):
+        if self._local_cache is not None:
+            self._local_cache.delete(_queue_exists_key(name, project))
+            self._local_cache.delete(_queue_metadata_key(name, project))
+
     def _list(self, project, marker=None,
               limit=storage.DEFAULT_QUEUES_PER_PAGE, detailed=False):
 
@@ -54,6 +75,7 @@ class QueueController(storage.Queue):
         yield it()
         yield marker_name and marker_name['next']
 
+    @decorators.caches_locally(_queue_metadata_key)
     def get_metadata(self, name, project):
         if project is None:
             project = ''
@@ -75,6 +97,22 @@ class QueueController(storage.Queue):
         except errors.QueueDoesNotExist:
             return {}
 
+    # NOTE: Only cache when it exists, so that a queue created by
+    # another process is visible right away.
+    @decorators.caches_locally(_queue_exists_key, lambda v: v)
+    def _exists(self, name, project):
+        if project is None:
+            project = ''
+
+        sel = sa.sql.select([tables.Queues.c.id], sa.and_(
+                            tables.Queues.c.project == project,
+                            tables.Queues.c.name == name
+                            ))
+        res = self.driver.run(sel)
+        r = res.fetchone()
+        res.close()
+        return r is not None
+
     def _create(self, name, metadata=None, project=None):
         if project is None:
             project = ''
@@ -87,22 +125,11 @@ class QueueController(storage.Queue):
             res = self.driver.run(ins)
         except sa.exc.IntegrityError:
             return False
+        finally:
+            self._purge_cache(name, project)
 
         return res.rowcount == 1
 
-    def _exists(self, name, project):
-        if project is None:
-            project = ''
-
-        sel = sa.sql.select([tables.Queues.c.id], sa.and_(
-                            tables.Queues.c.project == project,
-                            tables.Queues.c.name == name
-                            ))
-        res = self.driver.run(sel)
-        r = res.fetchone()
-        res.close()
-        return r is not None
-
     def set_metadata(self, name, metadata, project):
         if project is None:
             project = ''
@@ -114,6 +141,7 @@ class QueueController(storage.Queue):
                   values(metadata=utils.json_encode(metadata)))
 
         res = self.driver.run(update)
+        self._purge_cache(name, project)
 
         try:
             if res.rowcount != 1:
@@ -129,6 +157,7 @@ class QueueController(storage.Queue):
             tables.Queues.c.project == project,
             tables.Queues.c.name == name))
         self.driver.run(dlt)
+        self._purge_cache(name, project)
 
     def _stats(self, name, project):
         pass
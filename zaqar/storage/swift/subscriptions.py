@@ -99,6 +99,7 @@ class SubscriptionController(storage.Subscription):
         utils._put_or_create_container(
             self._client, container, slug, contents=jsonutils.dumps(data),
             content_type='application/json', headers={'x-delete-after': ttl})
+        self._purge_cache(queue, project)
         return slug
 
     def update(self, queue, subscription_id, project=None, **kwargs):
@@ -126,6 +127,7 @@ class SubscriptionController(storage.Subscription):
                                 contents=jsonutils.dumps(data),
                                 content_type='application/json',
                                 headers={'x-delete-after': ttl})
+        self._purge_cache(queue, project)
 
     def exists(self, queue, subscription_id, project=None):
         container = utils._subscription_container(queue, project)
@@ -149,6 +151,7 @@ class SubscriptionController(storage.Subscription):
         except swiftclient.ClientException as exc:
             if exc.http_status != 404:
                 raise
+        self._purge_cache(queue, project)
 
     def get_with_subscriber(self, queue, subscriber, project=None):
         sub_container = utils._subscriber_container(queue, project)
@@ -0,0 +1,65 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+from oslo_cache import core
+from oslo_utils import timeutils
+
+from zaqar.common import cache
+from zaqar.tests import base
+
+
+class TestLRUCache(base.TestBase):
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(2, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+
+        # Touch 'a' so that 'b' is the one to go
+        self.assertEqual(1, lru.get('a'))
+        lru.set('c', 3)
+
+        self.assertEqual(2, len(lru))
+        self.assertEqual(core.NO_VALUE, lru.get('b'))
+        self.assertEqual(1, lru.get('a'))
+        self.assertEqual(3, lru.get('c'))
+
+        self.assertEqual({'hits': 3, 'misses': 1, 'entries': 2},
+                         lru.stats())
+
+    def test_entries_expire(self):
+        lru = cache.LRUCache(10, 5)
+
+        with mock.patch.object(timeutils, 'now', return_value=100):
+            lru.set('a', 1)
+
+        with mock.patch.object(timeutils, 'now', return_value=104):
+            self.assertEqual(1, lru.get('a'))
+
+        with mock.patch.object(timeutils, 'now', return_value=105):
+            self.assertEqual(core.NO_VALUE, lru.get('a'))
+
+        self.assertEqual(0, len(lru))
+
+    def test_delete_and_clear(self):
+        lru = cache.LRUCache(10, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+
+        lru.delete('a')
+        lru.delete('missing')
+        self.assertEqual(core.NO_VALUE, lru.get('a'))
+
+        lru.clear()
+        self.assertEqual(core.NO_VALUE, lru.get('b'))
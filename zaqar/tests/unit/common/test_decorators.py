@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mock
 import msgpack
 from oslo_cache import core
 from oslo_config import cfg
@@ -147,6 +148,102 @@ class TestDecorators(base.TestBase):
             self.assertEqual(name, user)
             self.assertEqual(2 + i, instance.user_gets)
 
+    def test_cached_with_local_cache(self):
+        conf = cfg.ConfigOpts()
+        oslo_cache.register_config(conf)
+        conf.cache.backend = 'dogpile.cache.memory'
+        conf.cache.enabled = True
+        cache = oslo_cache.get_cache(conf)
+        oslo_cache.STATS.reset()
+
+        class TestClass(object):
+
+            def __init__(self, cache):
+                self._cache = cache
+                self._local_cache = oslo_cache.LRUCache(10, 60)
+                self._cache_purge_hook = mock.Mock()
+                self.user_gets = 0
+
+            @decorators.caches(lambda name: 'user:' + name, 60)
+            def get_user(self, name):
+                self.user_gets += 1
+                return {'name': name}
+
+            @get_user.purges
+            def del_user(self, name):
+                pass
+
+        instance = TestClass(cache)
+        other = TestClass(cache)
+
+        with mock.patch.object(cache, 'get', wraps=cache.get) as cache_get:
+            for i in range(3):
+                self.assertEqual({'name': 'malini'},
+                                 instance.get_user('malini'))
+
+            # Only the first lookup goes to the backend
+            self.assertEqual(1, cache_get.call_count)
+
+            # Another instance finds the value in the backend
+            other.get_user('malini')
+            self.assertEqual(2, cache_get.call_count)
+
+        self.assertEqual(1, instance.user_gets)
+        self.assertEqual(0, other.user_gets)
+
+        instance.del_user('malini')
+        instance._cache_purge_hook.assert_called_once_with('user:malini')
+        self.assertEqual(core.NO_VALUE, cache.get('user:malini'))
+        self.assertEqual(0, len(instance._local_cache))
+
+        instance.get_user('malini')
+        self.assertEqual(2, instance.user_gets)
+
+        stats = oslo_cache.STATS.snapshot()['user:']
+        self.assertEqual(2, stats['local_hits'])
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+
+    def test_cached_locally(self):
+
+        class TestClass(object):
+
+            def __init__(self, local_cache):
+                self._local_cache = local_cache
+                self.queue_gets = 0
+
+            @decorators.caches_locally(lambda name: name,
+                                       lambda v: v is not None)
+            def get_queue(self, name):
+                self.queue_gets += 1
+                return {'name': name} if name != 'missing' else None
+
+            @get_queue.purges
+            def del_queue(self, name):
+                pass
+
+        instance = TestClass(oslo_cache.LRUCache(10, 60))
+
+        queue = instance.get_queue('fizbit')
+        queue['name'] = 'changed'
+        self.assertEqual({'name': 'fizbit'}, instance.get_queue('fizbit'))
+        self.assertEqual(1, instance.queue_gets)
+
+        instance.del_queue('fizbit')
+        instance.get_queue('fizbit')
+        self.assertEqual(2, instance.queue_gets)
+
+        # Won't go into the cache because of cond
+        for i in range(3):
+            self.assertIsNone(instance.get_queue('missing'))
+        self.assertEqual(5, instance.queue_gets)
+
+        # Caching is disabled without a cache instance
+        instance = TestClass(None)
+        for i in range(3):
+            instance.get_queue('fizbit')
+        self.assertEqual(3, instance.queue_gets)
+
     def test_api_version_manager(self):
         self.config(enable_deprecated_api_versions=[])
         # 1. Test accessing current API version
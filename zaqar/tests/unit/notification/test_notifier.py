@@ -14,13 +14,19 @@
 # limitations under the License.
 
 import json
+import smtplib
 import uuid
 
 import ddt
 import mock
+import requests
 
+from zaqar.common import cache
 from zaqar.common import urls
 from zaqar.notification import notifier
+from zaqar.notification.tasks import mailto
+from zaqar.notification.tasks import webhook
+from zaqar.storage import base as storage_base
 from zaqar import tests as testing
 
 
@@ -57,6 +63,7 @@ class NotifierTest(testing.TestBase):
                                }
                               ]
         self.api_version = 'v2'
+        self.timeout = (5.0, 10.0)
 
     def test_webhook(self):
         subscription = [{'subscriber': 'http://trigger_me',
@@ -69,10 +76,12 @@ class NotifierTest(testing.TestBase):
                          'source': 'fake_queue',
                          'options': {}}]
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
         driver = notifier.NotifierDriver(subscription_controller=ctlr)
         headers = {'Content-Type': 'application/json'}
-        with mock.patch('requests.post') as mock_post:
+        with mock.patch('requests.Session.post') as mock_post:
             driver.post('fake_queue', self.messages, self.client_id,
                         self.project)
             driver.executor.shutdown()
@@ -88,24 +97,51 @@ class NotifierTest(testing.TestBase):
             mock_post.assert_has_calls([
                 mock.call(subscription[0]['subscriber'],
                           data=self.notifications[0],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 mock.call(subscription[1]['subscriber'],
                           data=self.notifications[0],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 mock.call(subscription[2]['subscriber'],
                           data=self.notifications[0],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 mock.call(subscription[0]['subscriber'],
                           data=self.notifications[1],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 mock.call(subscription[1]['subscriber'],
                           data=self.notifications[1],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 mock.call(subscription[2]['subscriber'],
                           data=self.notifications[1],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 ], any_order=True)
-            self.assertEqual(6, len(mock_post.mock_calls))
+            self.assertEqual(6, mock_post.call_count)
+
+    @mock.patch('stevedore.driver.DriverManager')
+    def test_tasks_are_loaded_once(self, manager):
+        self.addCleanup(notifier._TASKS.clear)
+        notifier._TASKS.clear()
+
+        subscription = [{'subscriber': 'http://trigger_me',
+                         'source': 'fake_queue',
+                         'options': {}},
+                        {'subscriber': 'http://call_me',
+                         'source': 'fake_queue',
+                         'options': {}}]
+        ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
+        ctlr.list = mock.Mock(side_effect=lambda *args, **kwargs:
+                              iter([subscription, {}]))
+        driver = notifier.NotifierDriver(subscription_controller=ctlr)
+
+        for __ in range(3):
+            driver.post('fake_queue', self.messages, self.client_id,
+                        self.project)
+        driver.executor.shutdown()
+
+        manager.assert_called_once_with('zaqar.notification.tasks', 'http',
+                                        invoke_on_load=True)
+        self.assertEqual(6, manager.return_value.driver.execute.call_count)
 
     def test_webhook_post_data(self):
         post_data = {'foo': 'bar', 'egg': '$zaqar_message$'}
@@ -113,10 +149,12 @@ class NotifierTest(testing.TestBase):
                          'source': 'fake_queue',
                          'options': {'post_data': json.dumps(post_data)}}]
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
         driver = notifier.NotifierDriver(subscription_controller=ctlr)
         headers = {'Content-Type': 'application/json'}
-        with mock.patch('requests.post') as mock_post:
+        with mock.patch('requests.Session.post') as mock_post:
             driver.post('fake_queue', self.messages, self.client_id,
                         self.project)
             driver.executor.shutdown()
@@ -132,12 +170,74 @@ class NotifierTest(testing.TestBase):
             mock_post.assert_has_calls([
                 mock.call(subscription[0]['subscriber'],
                           data={'foo': 'bar', 'egg': self.notifications[0]},
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 mock.call(subscription[0]['subscriber'],
                           data={'foo': 'bar', 'egg': self.notifications[1]},
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 ], any_order=True)
-            self.assertEqual(2, len(mock_post.mock_calls))
+            self.assertEqual(2, mock_post.call_count)
+
+    def test_webhook_post_batch(self):
+        subscription = [{'subscriber': 'http://trigger_me',
+                         'source': 'fake_queue',
+                         'options': {'post_batch': True}}]
+        ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
+        ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
+        driver = notifier.NotifierDriver(subscription_controller=ctlr)
+        headers = {'Content-Type': 'application/json'}
+        with mock.patch('requests.Session.post') as mock_post:
+            driver.post('fake_queue', self.messages, self.client_id,
+                        self.project)
+            driver.executor.shutdown()
+
+            self.assertEqual(1, mock_post.call_count)
+            mock_post.call_args[1]['data'] = json.loads(
+                mock_post.call_args[1]['data'])
+            mock_post.assert_called_once_with(
+                subscription[0]['subscriber'], data=self.notifications,
+                headers=headers, timeout=self.timeout)
+
+    @mock.patch('time.sleep')
+    def test_webhook_retries_with_backoff(self, mock_sleep):
+        subscription = {'subscriber': 'http://trigger_me',
+                        'source': 'fake_queue',
+                        'options': {}}
+        task = webhook.WebhookTask()
+        unavailable = mock.Mock(status_code=503)
+        not_found = mock.Mock(status_code=404)
+
+        with mock.patch('requests.Session.post') as mock_post:
+            mock_post.side_effect = [requests.ConnectionError(),
+                                     unavailable, mock.Mock(status_code=204)]
+            task.execute(subscription, self.messages[:1], conf=self.conf)
+            self.assertEqual(3, mock_post.call_count)
+            mock_sleep.assert_has_calls([mock.call(1.0), mock.call(2.0)])
+
+        # NOTE: Client errors are not retried, and the retries stop
+        # after webhook_max_retries.
+        self.conf.set_override('webhook_max_retries', 1,
+                               group='notification')
+        with mock.patch('requests.Session.post') as mock_post:
+            mock_post.return_value = not_found
+            task.execute(subscription, self.messages[:1], conf=self.conf)
+            self.assertEqual(1, mock_post.call_count)
+
+            mock_post.return_value = unavailable
+            mock_post.reset_mock()
+            task.execute(subscription, self.messages[:1], conf=self.conf)
+            self.assertEqual(2, mock_post.call_count)
+
+    def test_webhook_sessions_are_shared_per_host(self):
+        task = webhook.WebhookTask()
+        options = self.conf.notification
+
+        session = task._session('http://example.com/a', options)
+        self.assertIs(session, task._session('http://example.com/b',
+                                             options))
+        self.assertIsNot(session, task._session('https://example.com/a',
+                                                options))
 
     def test_marker(self):
         subscription1 = [{'subscriber': 'http://trigger_me1',
@@ -147,6 +247,8 @@ class NotifierTest(testing.TestBase):
                           'source': 'fake_queue',
                           'options': {}}]
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
 
         def mock_list(queue, project, marker):
             if not marker:
@@ -157,7 +259,7 @@ class NotifierTest(testing.TestBase):
         ctlr.list = mock_list
         driver = notifier.NotifierDriver(subscription_controller=ctlr)
         headers = {'Content-Type': 'application/json'}
-        with mock.patch('requests.post') as mock_post:
+        with mock.patch('requests.Session.post') as mock_post:
             driver.post('fake_queue', self.messages, self.client_id,
                         self.project)
             driver.executor.shutdown()
@@ -173,12 +275,40 @@ class NotifierTest(testing.TestBase):
             mock_post.assert_has_calls([
                 mock.call(subscription1[0]['subscriber'],
                           data=self.notifications[0],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 mock.call(subscription2[0]['subscriber'],
                           data=self.notifications[0],
-                          headers=headers),
+                          headers=headers, timeout=self.timeout),
                 ], any_order=True)
-            self.assertEqual(4, len(mock_post.mock_calls))
+            self.assertEqual(4, mock_post.call_count)
+
+    def test_subscriptions_are_cached(self):
+        subscription = [{'subscriber': 'http://trigger_me',
+                         'source': 'fake_queue',
+                         'options': {}}]
+        ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = cache.LRUCache(10, 5)
+        ctlr.list = mock.Mock(
+            side_effect=lambda *args, **kwargs: iter([subscription, {}]))
+        driver = notifier.NotifierDriver(subscription_controller=ctlr)
+
+        with mock.patch('requests.Session.post') as mock_post:
+            driver.post('fake_queue', self.messages, self.client_id,
+                        self.project)
+            driver.post('fake_queue', self.messages, self.client_id,
+                        self.project)
+            self.assertEqual(1, ctlr.list.call_count)
+
+            # NOTE: What the controllers do when subscriptions change
+            ctlr.driver.subscription_cache.delete(
+                storage_base.subscriptions_key('fake_queue', self.project))
+            driver.post('fake_queue', self.messages, self.client_id,
+                        self.project)
+            driver.executor.shutdown()
+
+            self.assertEqual(2, ctlr.list.call_count)
+            self.assertEqual(6, mock_post.call_count)
 
     @mock.patch('subprocess.Popen')
     def test_mailto(self, mock_popen):
@@ -191,6 +321,8 @@ class NotifierTest(testing.TestBase):
                          'options': {'subject': 'Hello',
                                      'from': 'zaqar@example.com'}}]
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
         driver = notifier.NotifierDriver(subscription_controller=ctlr)
         called = set()
@@ -239,11 +371,67 @@ class NotifierTest(testing.TestBase):
         self.assertEqual(sorted(mail_options), sorted(called_options))
         self.assertEqual(sorted(mail_bodies), sorted(called_bodies))
 
+    @mock.patch('smtplib.SMTP')
+    def test_mailto_smtp_relay(self, mock_smtp):
+        self.conf.set_override('smtp_host', 'relay.example.com',
+                               group='notification')
+        subscription = {'subscriber': 'mailto:aaa@example.com?subject=Hi',
+                        'source': 'fake_queue',
+                        'options': {'from': 'zaqar@example.com'}}
+        conn = mock_smtp.return_value
+        conn.noop.return_value = (250, b'OK')
+        task = mailto.MailtoTask()
+
+        task.execute(subscription, self.messages, conf=self.conf)
+        task.execute(subscription, self.messages, conf=self.conf)
+
+        # NOTE: One connection, kept alive between the notifications
+        mock_smtp.assert_called_once_with('relay.example.com', 25,
+                                          timeout=10.0)
+        self.assertEqual(1, conn.noop.call_count)
+        self.assertEqual(4, conn.sendmail.call_count)
+        sender, recipients, mail = conn.sendmail.call_args[0]
+        self.assertEqual('zaqar@example.com', sender)
+        self.assertEqual(['aaa@example.com'], recipients)
+        self.assertIn('subject: Hi', mail)
+
+        # NOTE: Connections closed by the relay are replaced
+        conn.noop.side_effect = smtplib.SMTPServerDisconnected()
+        task.execute(subscription, self.messages, conf=self.conf)
+        self.assertEqual(2, mock_smtp.call_count)
+        self.assertEqual(6, conn.sendmail.call_count)
+
+    @mock.patch('threading.Timer')
+    @mock.patch('subprocess.Popen')
+    def test_mailto_digest(self, mock_popen, mock_timer):
+        self.conf.set_override('smtp_digest_window', 30,
+                               group='notification')
+        subscription = {'subscriber': 'mailto:aaa@example.com',
+                        'source': 'fake_queue',
+                        'options': {}}
+        task = mailto.MailtoTask()
+
+        task.execute(subscription, self.messages[:1], conf=self.conf)
+        task.execute(subscription, self.messages[1:], conf=self.conf)
+        self.assertFalse(mock_popen.called)
+
+        mock_timer.assert_called_once_with(30, mock.ANY, args=mock.ANY)
+        send_digest = mock_timer.call_args[0][1]
+        send_digest(*mock_timer.call_args[1]['args'])
+
+        self.assertEqual(1, mock_popen.call_count)
+        mail = mock_popen.return_value.communicate.call_args[0][0]
+        body = json.loads(mail.split('\n\n', 1)[1])
+        self.assertEqual(['BackupStarted', 'BackupProgress'],
+                         [message['body']['event'] for message in body])
+
     def test_post_no_subscriber(self):
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         ctlr.list = mock.Mock(return_value=iter([[], {}]))
         driver = notifier.NotifierDriver(subscription_controller=ctlr)
-        with mock.patch('requests.post') as mock_post:
+        with mock.patch('requests.Session.post') as mock_post:
             driver.post('fake_queue', self.messages, self.client_id,
                         self.project)
             driver.executor.shutdown()
@@ -254,9 +442,11 @@ class NotifierTest(testing.TestBase):
                          'source': 'fake_queue',
                          'options': {}}]
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
         driver = notifier.NotifierDriver(subscription_controller=ctlr)
-        with mock.patch('requests.post') as mock_post:
+        with mock.patch('requests.Session.post') as mock_post:
             driver.post('fake_queue', self.messages, self.client_id,
                         self.project)
             driver.executor.shutdown()
@@ -264,7 +454,7 @@ class NotifierTest(testing.TestBase):
             self.assertEqual(self.notifications[1],
                              json.loads(mock_post.call_args[1]['data']))
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_send_confirm_notification(self, mock_request):
         self.conf.notification.require_confirmation = True
         subscription = {'id': '5760c9fb3990b42e8b7c20bd',
@@ -272,6 +462,8 @@ class NotifierTest(testing.TestBase):
                         'source': 'fake_queue',
                         'options': {}}
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         ctlr.list = mock.Mock(return_value=subscription)
         driver = notifier.NotifierDriver(subscription_controller=ctlr,
                                          require_confirmation=True)
@@ -290,11 +482,13 @@ class NotifierTest(testing.TestBase):
         self.assertEqual(expect_args.sort(),
                          list(actual_args).sort())
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_send_confirm_notification_without_signed_url(self, mock_request):
         subscription = [{'subscriber': 'http://trigger_me',
                          'source': 'fake_queue', 'options': {}}]
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
         driver = notifier.NotifierDriver(subscription_controller=ctlr)
 
@@ -309,6 +503,8 @@ class NotifierTest(testing.TestBase):
         subscription = [{'subscriber': 'http://trigger_me',
                          'source': 'fake_queue', 'options': {}}]
         ctlr = mock.MagicMock()
+        ctlr.driver.conf = self.conf
+        ctlr.driver.subscription_cache = None
         driver = notifier.NotifierDriver(subscription_controller=ctlr,
                                          require_confirmation=False)
 
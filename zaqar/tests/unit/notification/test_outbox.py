@@ -0,0 +1,137 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from zaqar.notification import notifier
+from zaqar.notification import outbox
+from zaqar.storage import errors
+from zaqar import tests as testing
+
+
+class _Stop(Exception):
+    pass
+
+
+class OutboxTest(testing.TestBase):
+
+    def setUp(self):
+        super(OutboxTest, self).setUp()
+        self.conf.set_override('outbox', True, group='notification')
+        self.conf.set_override('outbox_workers', 0, group='notification')
+        self.driver = mock.MagicMock()
+        self.driver.conf = self.conf
+        self.driver.subscription_cache = None
+        self.outbox = outbox.Outbox(self.driver, self.conf)
+        self.messages = [{'ttl': 300, 'body': {'event': 'BackupStarted'}}]
+
+    def test_put(self):
+        self.outbox.put('fake_queue', self.messages, 'fake_project')
+        self.outbox.put('fake_queue', self.messages, 'fake_project')
+
+        self.driver.queue_controller.create.assert_called_once_with(
+            'notification-outbox', project='zaqar-internal')
+
+        entry = {'queue_name': 'fake_queue',
+                 'project': 'fake_project',
+                 'messages': self.messages}
+        self.driver.message_controller.post.assert_called_with(
+            'notification-outbox', [{'ttl': 86400, 'body': entry}],
+            mock.ANY, project='zaqar-internal')
+
+    @mock.patch('time.sleep', side_effect=_Stop)
+    def test_work(self, mock_sleep):
+        entries = [{'id': 'e1', 'body': {'queue_name': 'q1',
+                                         'project': 'p',
+                                         'messages': self.messages}},
+                   {'id': 'e2', 'body': {'queue_name': 'q2',
+                                         'project': 'p',
+                                         'messages': self.messages}}]
+        self.driver.claim_controller.create.side_effect = [
+            ('c1', iter(entries)), (None, iter([]))]
+
+        # NOTE: An entry whose notifications fail is left for its claim
+        # to expire.
+        notify = mock.Mock(side_effect=[None, Exception('boom')])
+
+        self.assertRaises(_Stop, self.outbox._work, notify)
+
+        notify.assert_has_calls([mock.call('q1', self.messages, 'p'),
+                                 mock.call('q2', self.messages, 'p')])
+        self.driver.message_controller.delete.assert_called_once_with(
+            'notification-outbox', 'e1', project='zaqar-internal',
+            claim='c1')
+        self.driver.claim_controller.create.assert_called_with(
+            'notification-outbox', {'ttl': 60, 'grace': 0},
+            project='zaqar-internal', limit=10)
+        mock_sleep.assert_called_once_with(1.0)
+
+    def test_stats(self):
+        queue_controller = mock.Mock()
+        queue_controller.stats.return_value = {
+            'messages': {'total': 5, 'claimed': 2, 'free': 3,
+                         'oldest': {'age': 12}}}
+
+        self.assertEqual({'depth': 5, 'in_flight': 2, 'lag': 12},
+                         outbox.stats(queue_controller, self.conf))
+        queue_controller.stats.assert_called_once_with(
+            'notification-outbox', project='zaqar-internal')
+
+        queue_controller.stats.side_effect = errors.QueueDoesNotExist(
+            'notification-outbox', 'zaqar-internal')
+        self.assertEqual({'depth': 0, 'in_flight': 0, 'lag': 0},
+                         outbox.stats(queue_controller, self.conf))
+
+    def test_notifier_records_in_outbox(self):
+        subscription = [{'subscriber': 'http://trigger_me',
+                         'source': 'fake_queue',
+                         'options': {}}]
+        ctlr = mock.MagicMock()
+        ctlr.driver = self.driver
+        ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
+        driver = notifier.NotifierDriver(subscription_controller=ctlr)
+
+        with mock.patch('requests.Session.post') as mock_post:
+            driver.post('fake_queue', self.messages, 'client', 'project')
+            driver.executor.shutdown()
+            self.assertFalse(mock_post.called)
+
+        ctlr.list.assert_called_once_with('fake_queue', 'project',
+                                          marker=None)
+        self.assertEqual(1, self.driver.message_controller.post.call_count)
+
+    def test_notifier_skips_queues_without_subscribers(self):
+        ctlr = mock.MagicMock()
+        ctlr.driver = self.driver
+        ctlr.list = mock.Mock(return_value=iter([[], {}]))
+        driver = notifier.NotifierDriver(subscription_controller=ctlr)
+
+        driver.post('fake_queue', self.messages, 'client', 'project')
+        driver.executor.shutdown()
+
+        self.assertFalse(self.driver.message_controller.post.called)
+
+    def test_notifier_sends_outbox_entries(self):
+        subscription = [{'subscriber': 'http://trigger_me',
+                         'source': 'fake_queue',
+                         'options': {}}]
+        ctlr = mock.MagicMock()
+        ctlr.driver = self.driver
+        ctlr.list = mock.Mock(return_value=iter([subscription, {}]))
+        driver = notifier.NotifierDriver(subscription_controller=ctlr)
+
+        with mock.patch('requests.Session.post') as mock_post:
+            driver._notify_and_wait('fake_queue', self.messages, 'project')
+            self.assertEqual(1, mock_post.call_count)
+
+        driver.executor.shutdown()
@@ -23,6 +23,7 @@ import uuid
 
 import ddt
 import mock
+from oslo_cache import core
 from oslo_utils import timeutils
 import six
 from testtools import matchers
@@ -1291,6 +1292,29 @@ class SubscriptionControllerTest(ControllerBaseTest):
 
         self.assertEqual(True, subscription['confirmed'])
 
+    def test_changes_purge_subscription_cache(self):
+        cache = self.driver.subscription_cache
+        key = storage.base.subscriptions_key(self.source, self.project)
+
+        def assertPurged(func, *args, **kwargs):
+            cache.set(key, [])
+            result = func(*args, **kwargs)
+            self.assertIs(core.NO_VALUE, cache.get(key))
+            return result
+
+        s_id = assertPurged(self.subscription_controller.create,
+                            self.source, self.subscriber, self.ttl,
+                            self.options, project=self.project)
+        self.addCleanup(self.subscription_controller.delete, self.source,
+                        s_id, self.project)
+
+        assertPurged(self.subscription_controller.update, self.source, s_id,
+                     project=self.project, options={'uri': 'http://x.com'})
+        assertPurged(self.subscription_controller.confirm, self.source,
+                     s_id, project=self.project, confirmed=True)
+        assertPurged(self.subscription_controller.delete, self.source, s_id,
+                     project=self.project)
+
     def test_confirm_with_nonexist_subscription(self):
         s_id = 'fake-id'
         self.assertRaises(errors.SubscriptionDoesNotExist,
@@ -1595,6 +1619,40 @@ class CatalogueControllerTest(ControllerBaseTest):
         self.controller.insert(self.project, q1, u'a')
         self.controller.insert(self.project, q2, u'a')
 
+    def test_get_many(self):
+        q1 = six.text_type(uuid.uuid1())
+        q2 = six.text_type(uuid.uuid1())
+        self.controller.insert(self.project, q1, self.pool)
+        self.controller.insert(self.project, q2, self.pool)
+        self.controller.insert(u'other', q2, self.pool)
+
+        entries = self.controller.get_many(self.project,
+                                           [q1, q2, u'non_existing'])
+        self.assertEqual(2, len(entries))
+        for entry in entries:
+            self._check_structure(entry)
+            self.assertIn(entry['queue'], (q1, q2))
+            self.assertEqual(self.project, entry['project'])
+
+        self.assertEqual([], self.controller.get_many(self.project, []))
+
+    def test_get_or_insert(self):
+        p2 = u'b'
+        self.pool_ctrl.create(p2, 100, '127.0.0.1',
+                              group=self.pool_group,
+                              options={})
+        self.addCleanup(self.pool_ctrl.delete, p2)
+
+        self.assertEqual(self.pool, self.controller.get_or_insert(
+            self.project, self.queue, self.pool))
+
+        # NOTE: An existing entry is left alone
+        self.assertEqual(self.pool, self.controller.get_or_insert(
+            self.project, self.queue, p2))
+        entry = self.controller.get(self.project, self.queue)
+        self._check_value(entry, xqueue=self.queue, xproject=self.project,
+                          xpool=self.pool)
+
 
 class FlavorsControllerTest(ControllerBaseTest):
     """Flavors Controller base tests.
@@ -15,11 +15,14 @@
 
 import collections
 import datetime
+import threading
 import time
 import uuid
 
+from bson import objectid
 import mock
 from oslo_utils import timeutils
+import pymongo
 from pymongo import cursor
 import pymongo.errors
 import six
@@ -27,11 +30,14 @@ from testtools import matchers
 
 from zaqar.common import cache as oslo_cache
 from zaqar.common import configs
+from zaqar.common import errors as common_errors
 from zaqar import storage
 from zaqar.storage import errors
 from zaqar.storage import mongodb
 from zaqar.storage.mongodb import controllers
+from zaqar.storage.mongodb import markers
 from zaqar.storage.mongodb import options
+from zaqar.storage.mongodb import partitions
 from zaqar.storage.mongodb import utils
 from zaqar.storage import pooling
 from zaqar import tests as testing
@@ -143,6 +149,178 @@ class MongodbUtilsTest(MongodbSetupMixin, testing.TestBase):
 
         self.assertEqual([self.mongodb_conf.max_reconnect_attempts], num_calls)
 
+    def test_write_concern(self):
+        self.assertIsNone(utils.write_concern())
+        self.assertEqual({'w': 0}, utils.write_concern('0').document)
+        self.assertEqual({'w': 'majority', 'j': True},
+                         utils.write_concern('majority', True).document)
+        self.assertEqual({'j': False},
+                         utils.write_concern(j=False).document)
+
+        self.assertRaises(common_errors.ConfigurationError,
+                          utils.write_concern, '0', True)
+
+    def test_write_coalescer(self):
+        collection = mock.Mock()
+        collection.bulk_write.return_value = 'result'
+        coalescer = utils.WriteCoalescer(collection, 0.05)
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda op: results.append(coalescer.submit(op)),
+            args=(pymongo.DeleteOne({'_id': i}),)) for i in range(5)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['result'] * 5, results)
+        self.assertEqual(1, collection.bulk_write.call_count)
+
+        requests = collection.bulk_write.call_args[0][0]
+        self.assertEqual(5, len(requests))
+        for i in range(5):
+            self.assertIn(pymongo.DeleteOne({'_id': i}), requests)
+        self.assertFalse(collection.bulk_write.call_args[1]['ordered'])
+
+        # NOTE: The next write goes in a batch of its own
+        coalescer.submit(pymongo.DeleteOne({'_id': 5}))
+        self.assertEqual(2, collection.bulk_write.call_count)
+
+    def test_write_coalescer_raises_for_every_write(self):
+        collection = mock.Mock()
+        collection.bulk_write.side_effect = pymongo.errors.AutoReconnect()
+        coalescer = utils.WriteCoalescer(collection, 0)
+
+        self.assertRaises(pymongo.errors.AutoReconnect, coalescer.submit,
+                          pymongo.DeleteOne({'_id': 1}))
+
+
+class MongodbPartitionsTest(testing.TestBase):
+
+    def test_hash_ring(self):
+        names = ['queue-%d' % i for i in range(2000)]
+        ring = partitions.HashRing(4, 64)
+
+        placed = [ring.get_partition(name) for name in names]
+        self.assertEqual(set(range(4)), set(placed))
+        self.assertEqual(placed, [partitions.HashRing(4, 64).get_partition(
+                                  name) for name in names])
+
+        grown = partitions.HashRing(5, 64)
+        moved = 0
+        for name, partition in zip(names, placed):
+            new_partition = grown.get_partition(name)
+            if new_partition != partition:
+                # NOTE: Queues only move to the new partition
+                self.assertEqual(4, new_partition)
+                moved += 1
+
+        self.assertThat(moved, matchers.GreaterThan(0))
+        self.assertThat(moved, matchers.LessThan(len(names) * 0.35))
+
+    @mock.patch('oslo_utils.timeutils.now')
+    def test_placement_table_lookups(self, now):
+        now.return_value = 100.0
+        collection = mock.Mock()
+        collection.find_one.return_value = None
+        table = partitions.PlacementTable(collection, 5)
+
+        # NOTE: An empty table is only checked once per TTL
+        self.assertIsNone(table.lookup('p/q1'))
+        self.assertIsNone(table.lookup('p/q2'))
+        self.assertEqual(1, collection.find_one.call_count)
+
+        collection.find_one.return_value = {'p': 1}
+        now.return_value = 105.0
+        self.assertEqual(1, table.lookup('p/q1'))
+        self.assertEqual(1, table.lookup('p/q1'))
+        self.assertEqual(3, collection.find_one.call_count)
+
+        # NOTE: Changes made by this server are seen right away
+        table.unpin('p/q1')
+        collection.find_one.return_value = None
+        self.assertIsNone(table.lookup('p/q1'))
+
+
+class MongodbMarkersTest(testing.TestBase):
+
+    def _watcher(self):
+        watcher = markers.MarkerWatcher([mock.Mock()])
+
+        # NOTE: As if the change stream had been opened
+        watcher._streams = 1
+        return watcher
+
+    def test_latest_markers(self):
+        watcher = self._watcher()
+        find_latest = mock.Mock(return_value=5)
+
+        self.assertEqual(5, watcher.latest('p/q', find_latest))
+        self.assertEqual(5, watcher.latest('p/q', find_latest))
+        self.assertEqual(1, find_latest.call_count)
+
+        watcher._apply({'operationType': 'insert',
+                        'documentKey': {'_id': 1},
+                        'fullDocument': {'p_q': 'p/q', 'k': 7, 'tx': None}})
+        self.assertEqual(7, watcher.latest('p/q', find_latest))
+
+        # NOTE: Not visible until the transaction is finalized
+        watcher._apply({'operationType': 'insert',
+                        'documentKey': {'_id': 2},
+                        'fullDocument': {'p_q': 'p/q', 'k': 8, 'tx': 'x'}})
+        self.assertEqual(7, watcher.latest('p/q', find_latest))
+
+        watcher._apply({'operationType': 'update',
+                        'documentKey': {'_id': 2}})
+        self.assertEqual(8, watcher.latest('p/q', find_latest))
+        self.assertEqual(1, find_latest.call_count)
+
+        # NOTE: A transaction that started before the stream was
+        # opened can not be placed, so the queue is looked up again.
+        watcher._apply({'operationType': 'update',
+                        'documentKey': {'_id': 3}})
+        find_latest.return_value = 9
+        self.assertEqual(9, watcher.latest('p/q', find_latest))
+        self.assertEqual(2, find_latest.call_count)
+
+    def test_latest_marker_unknown_while_stream_is_closed(self):
+        watcher = self._watcher()
+        watcher._streams = 0
+        find_latest = mock.Mock(return_value=5)
+
+        self.assertIsNone(watcher.latest('p/q', find_latest))
+        self.assertFalse(find_latest.called)
+
+    def test_latest_marker_is_not_recorded_across_a_reset(self):
+        watcher = self._watcher()
+
+        # NOTE: As if the stream broke while the query was running
+        def find_latest():
+            with watcher._changed:
+                watcher._reset()
+            return 5
+
+        self.assertEqual(5, watcher.latest('p/q', find_latest))
+        self.assertNotIn('p/q', watcher._latest)
+
+    def test_wait(self):
+        watcher = self._watcher()
+        watcher.latest('p/q', lambda: 5)
+
+        self.assertFalse(watcher.wait('p/q', 5, 0.01))
+        self.assertTrue(watcher.wait('p/q', 4, 0.01))
+
+        timer = threading.Timer(0.05, watcher._apply, [{
+            'operationType': 'insert',
+            'documentKey': {'_id': 1},
+            'fullDocument': {'p_q': 'p/q', 'k': 6}}])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertTrue(watcher.wait('p/q', 5, 10))
+
 
 @testing.requires_mongodb
 class MongodbDriverTest(MongodbSetupMixin, testing.TestBase):
@@ -301,6 +479,237 @@ class MongodbMessageTests(MongodbSetupMixin, base.MessageControllerTest):
             self.assertIn('queue_marker', indexes)
             self.assertIn('counting', indexes)
 
+    def test_list_past_latest_marker_skips_query(self):
+        base._insert_fixtures(self.controller, self.queue_name,
+                              project=self.project, num=3)
+
+        watcher = markers.MarkerWatcher(self.controller._collections)
+        watcher._streams = len(self.controller._collections)
+        self.controller._marker_watcher = watcher
+
+        interaction = self.controller.list(self.queue_name,
+                                           project=self.project)
+        msgs = list(next(interaction))
+        marker = next(interaction)
+        self.assertEqual(3, len(msgs))
+
+        with mock.patch.object(pymongo.collection.Collection, 'find',
+                               autospec=True) as find:
+            # NOTE: The first listing looks the latest marker up
+            interaction = self.controller.list(self.queue_name,
+                                               project=self.project,
+                                               marker=marker)
+            self.assertEqual([], list(next(interaction)))
+            self.assertEqual(marker, next(interaction))
+            self.assertEqual(1, find.call_count)
+
+        with mock.patch.object(pymongo.collection.Collection, 'find',
+                               autospec=True) as find:
+            interaction = self.controller.list(self.queue_name,
+                                               project=self.project,
+                                               marker=marker)
+            self.assertEqual([], list(next(interaction)))
+            self.assertFalse(find.called)
+
+    def test_pop_never_returns_messages_popped_in_parallel(self):
+        base._insert_fixtures(self.controller, self.queue_name,
+                              project=self.project, num=10)
+
+        collection = self.controller._collection(self.queue_name,
+                                                 self.project)
+        list_ = self.controller._list
+        stolen = []
+
+        # NOTE: Pop two of the listed messages behind the back of the
+        # first listing, as a parallel request would.
+        def racing_list(*args, **kwargs):
+            msgs = list(list_(*args, **kwargs))
+            if not stolen:
+                stolen.extend(msg['_id'] for msg in msgs[:2])
+                collection.update({'_id': {'$in': stolen}},
+                                  {'$set': {'c': {'id': objectid.ObjectId(),
+                                                  'e': 2 ** 62}}},
+                                  multi=True)
+
+            return iter(msgs)
+
+        with mock.patch.object(self.controller, '_list',
+                               side_effect=racing_list):
+            popped = self.controller.pop(self.queue_name, 5,
+                                         project=self.project)
+
+        self.assertEqual(5, len(popped))
+        for msg in popped:
+            self.assertNotIn(msg['id'], [str(oid) for oid in stolen])
+
+        remaining = self.controller.pop(self.queue_name, 10,
+                                        project=self.project)
+        self.assertEqual(3, len(remaining))
+
+    def test_stats_counters(self):
+        self.config(options.MESSAGE_MONGODB_GROUP, stats_mode='counters',
+                    stats_reconcile_interval=60)
+        handler = mongodb.messages.MessageQueueHandler(self.driver,
+                                                       self.control)
+
+        def stats():
+            return handler.stats(self.queue_name,
+                                 project=self.project)['messages']
+
+        ids = base._insert_fixtures(self.controller, self.queue_name,
+                                    project=self.project, num=5)
+
+        # NOTE: The first request counts the messages
+        self.assertEqual({'total': 5, 'claimed': 0, 'free': 5,
+                          'approximate': False},
+                         {k: v for k, v in stats().items()
+                          if k not in ('oldest', 'newest')})
+
+        with mock.patch.object(handler.message_controller,
+                               '_count') as count:
+            base._insert_fixtures(self.controller, self.queue_name,
+                                  project=self.project, num=3)
+            message_stats = stats()
+            self.assertTrue(message_stats['approximate'])
+            self.assertEqual(8, message_stats['total'])
+
+            claim_id, __ = self.driver.claim_controller.create(
+                self.queue_name, {'ttl': 60, 'grace': 30},
+                project=self.project, limit=2)
+            self.assertEqual(2, stats()['claimed'])
+
+            claimed = list(self.driver.claim_controller.get(
+                self.queue_name, claim_id, project=self.project)[1])
+            self.controller.delete(self.queue_name, claimed[0]['id'],
+                                   project=self.project, claim=claim_id)
+            message_stats = stats()
+            self.assertEqual(7, message_stats['total'])
+            self.assertEqual(1, message_stats['claimed'])
+            self.assertEqual(6, message_stats['free'])
+
+            self.controller.pop(self.queue_name, 2, project=self.project)
+            self.controller.bulk_delete(self.queue_name, ids[-1:],
+                                        project=self.project)
+            self.assertEqual(4, stats()['total'])
+
+            self.assertFalse(count.called)
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        timeutils.advance_time_seconds(61)
+        self.assertFalse(stats()['approximate'])
+
+        # NOTE: zaqar-gc recounts old counters ahead of stats requests
+        timeutils.advance_time_seconds(31)
+        with mock.patch.object(self.controller, '_reconcile_stats') as rs:
+            self.controller.gc()
+            rs.assert_called_once_with(self.queue_name, self.project)
+
+    def test_write_concern_options(self):
+        self.config(options.MESSAGE_MONGODB_GROUP, post_write_concern='1',
+                    post_journal=True, delete_write_concern='majority')
+        controller = mongodb.messages.MessageController(self.driver)
+
+        for collection in controller._post_collections:
+            self.assertEqual({'w': 1, 'j': True},
+                             collection.write_concern.document)
+
+        for collection in controller._delete_collections:
+            self.assertEqual({'w': 'majority'},
+                             collection.write_concern.document)
+
+        self.assertIsNone(controller._delete_coalescers)
+
+    def test_coalesced_deletes(self):
+        self.config(options.MESSAGE_MONGODB_GROUP, delete_write_concern='1',
+                    delete_coalesce_window=0.05)
+        controller = mongodb.messages.MessageController(self.driver)
+
+        ids = base._insert_fixtures(controller, self.queue_name,
+                                    project=self.project, num=10)
+
+        with mock.patch.object(pymongo.collection.Collection, 'bulk_write',
+                               autospec=True,
+                               side_effect=pymongo.collection.Collection.
+                               bulk_write) as bulk_write:
+            threads = [threading.Thread(target=controller.bulk_delete,
+                                        args=(self.queue_name, ids[i:i + 2],
+                                              self.project))
+                       for i in range(0, 10, 2)]
+
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(1, bulk_write.call_count)
+
+        self.assertEqual(0, controller._count(self.queue_name,
+                                              self.project))
+
+    def test_move_queue(self):
+        ids = base._insert_fixtures(self.controller, self.queue_name,
+                                    project=self.project, num=5)
+        claim_ctrl = self.driver.claim_controller
+        claim_id, __ = claim_ctrl.create(self.queue_name,
+                                         {'ttl': 60, 'grace': 30},
+                                         project=self.project, limit=1)
+
+        placement = self.driver.partition_placement
+        source = placement.get_partition(self.queue_name, self.project)
+        target = (source + 1) % len(self.driver.message_databases)
+        scope = utils.scope_queue_name(self.queue_name, self.project)
+
+        copy_messages = partitions._copy_messages
+        posted = []
+
+        # NOTE: Post and delete messages once they have been copied,
+        # as other servers would during the switch over.
+        def copy(*args):
+            copied = copy_messages(*args)
+            posted.extend(base._insert_fixtures(self.controller,
+                                                self.queue_name,
+                                                project=self.project,
+                                                num=1))
+            self.controller.bulk_delete(self.queue_name, ids[-1:],
+                                        project=self.project)
+            return copied
+
+        with mock.patch.object(partitions, '_copy_messages',
+                               side_effect=copy):
+            moved = partitions.move_queues(self.driver, [(scope, target)],
+                                           settle_time=0)
+
+        self.assertEqual(1, moved)
+        self.assertEqual(target, placement.get_partition(self.queue_name,
+                                                         self.project))
+        self.assertEqual(target, placement.table.get(scope)['p'])
+
+        source_col = self.driver.message_databases[source].messages
+        self.assertEqual(0, source_col.count_documents({'p_q': scope}))
+
+        msgs = list(next(self.controller.list(self.queue_name,
+                                              project=self.project,
+                                              include_claimed=True)))
+        self.assertEqual(sorted(ids[:-1] + posted),
+                         sorted(msg['id'] for msg in msgs))
+
+        __, claimed = claim_ctrl.get(self.queue_name, claim_id,
+                                     project=self.project)
+        self.assertEqual(1, len(list(claimed)))
+
+    def test_post_checks_queue_with_counter(self):
+        queue_ctrl = self.controller._queue_ctrl
+        with mock.patch.object(queue_ctrl, 'exists') as exists:
+            self.controller.post(self.queue_name, [{'ttl': 60}],
+                                 'uuid', project=self.project)
+            self.assertFalse(exists.called)
+
+            self.assertRaises(errors.QueueDoesNotExist,
+                              self.controller.post, 'not_there',
+                              [{'ttl': 60}], 'uuid', project=self.project)
+            self.assertFalse(exists.called)
+
     def test_message_counter(self):
         queue_name = self.queue_name
         iterations = 10
@@ -381,6 +790,8 @@ class MongodbFIFOMessageTests(MongodbSetupMixin, base.MessageControllerTest):
     gc_interval = 60
 
     def test_race_condition_on_post(self):
+        self.config(options.MESSAGE_MONGODB_GROUP,
+                    marker_allocation='retry')
         queue_name = self.queue_name
 
         expected_messages = [
@@ -447,6 +858,73 @@ class MongodbFIFOMessageTests(MongodbSetupMixin, base.MessageControllerTest):
         actual_ids = [m['body']['backupId'] for m in actual_messages]
 
         self.assertEqual(expected_ids, actual_ids)
+        self.assertEqual(1, self.controller._post_stats['retries'])
+
+    def test_post_reserves_markers(self):
+        queue_name = self.queue_name
+        client_uuid = uuid.uuid4()
+        messages = [{'ttl': 60, 'body': i} for i in range(3)]
+
+        self.controller.post(queue_name, messages[:1], client_uuid,
+                             project=self.project)
+        self.controller.post(queue_name, messages[1:], client_uuid,
+                             project=self.project)
+
+        counter = self.controller._get_counter(queue_name, self.project)
+        watermark = self.controller._get_watermark(queue_name, self.project)
+        self.assertEqual(counter, watermark)
+
+        interaction = self.controller.list(queue_name, echo=True,
+                                           client_uuid=client_uuid,
+                                           project=self.project)
+        self.assertEqual([0, 1, 2],
+                         [m['body'] for m in next(interaction)])
+        self.assertEqual(0, self.controller._post_stats['retries'])
+        self.assertEqual(0, self.controller._post_stats['waits'])
+
+    def test_post_skips_stalled_range(self):
+        queue_name = self.queue_name
+        client_uuid = uuid.uuid4()
+
+        # NOTE: Simulate a producer that died after reserving markers
+        # and inserting its (non-finalized) messages.
+        start, __ = self.controller._reserve_markers(queue_name,
+                                                     self.project, 2)
+        tx = objectid.ObjectId()
+        collection = self.controller._collection(queue_name, self.project)
+        collection.insert([{
+            'p_q': utils.scope_queue_name(queue_name, self.project),
+            't': 60,
+            'e': timeutils.utcnow() + datetime.timedelta(seconds=60),
+            'u': client_uuid,
+            'c': {'id': None, 'e': 0},
+            'b': 'lost',
+            'k': start,
+            'tx': tx,
+        }])
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+        def sleep(controller, attempt):
+            timeutils.advance_time_seconds(
+                mongodb.messages.COUNTER_STALL_WINDOW + 1)
+
+        with mock.patch.object(mongodb.messages.MessageController,
+                               '_backoff_sleep', autospec=True) as bs:
+            bs.side_effect = sleep
+            self.controller.post(queue_name, [{'ttl': 60, 'body': 'ok'}],
+                                 client_uuid, project=self.project)
+
+        self.assertEqual(1, self.controller._post_stats['skipped'])
+        self.assertEqual(start + 3,
+                         self.controller._get_watermark(queue_name,
+                                                        self.project))
+
+        interaction = self.controller.list(queue_name, echo=True,
+                                           client_uuid=client_uuid,
+                                           project=self.project)
+        self.assertEqual(['ok'], [m['body'] for m in next(interaction)])
 
 
 @testing.requires_mongodb
@@ -484,6 +962,85 @@ class MongodbClaimTests(MongodbSetupMixin, base.ClaimControllerTest):
                           claim_id, {'ttl': 1, 'grace': 0},
                           project=self.project)
 
+    def test_claim_update_reads_no_messages(self):
+        base._insert_fixtures(self.message_controller, self.queue_name,
+                              project=self.project, num=3)
+        claim_id, __ = self.controller.create(self.queue_name,
+                                              {'ttl': 60, 'grace': 0},
+                                              project=self.project)
+
+        msg_ctrl = self.driver.message_controller
+        collection = msg_ctrl._collection(self.queue_name, self.project)
+
+        with mock.patch.object(pymongo.collection.Collection, 'find',
+                               autospec=True) as find:
+            self.controller.update(self.queue_name, claim_id,
+                                   {'ttl': 300, 'grace': 30},
+                                   project=self.project)
+            self.assertFalse(find.called)
+
+        msgs = list(collection.find({'c.id': utils.to_oid(claim_id)}))
+        self.assertEqual(3, len(msgs))
+        for msg in msgs:
+            self.assertEqual(300, msg['c']['t'])
+            self.assertEqual(330, msg['t'])
+
+    def test_claim_tops_up_after_losing_race(self):
+        base._insert_fixtures(self.message_controller, self.queue_name,
+                              project=self.project, num=10)
+
+        msg_ctrl = self.driver.message_controller
+        collection = msg_ctrl._collection(self.queue_name, self.project)
+        active = msg_ctrl._active
+        stolen = []
+
+        # NOTE: Claim two of the listed messages behind the back of the
+        # first listing, as a parallel request would.
+        def racing_active(*args, **kwargs):
+            msgs = list(active(*args, **kwargs))
+            if not stolen:
+                stolen.extend(msg['_id'] for msg in msgs[:2])
+                meta = {'id': objectid.ObjectId(), 't': 60,
+                        'e': timeutils.utcnow_ts() + 60}
+                collection.update({'_id': {'$in': stolen}},
+                                  {'$set': {'c': meta}}, multi=True)
+
+            return iter(msgs)
+
+        with mock.patch.object(msg_ctrl, '_active',
+                               side_effect=racing_active) as act:
+            claim_id, messages = self.controller.create(
+                self.queue_name, {'ttl': 60, 'grace': 30},
+                project=self.project, limit=5)
+
+            self.assertEqual(2, act.call_count)
+
+        messages = list(messages)
+        self.assertEqual(5, len(messages))
+        for msg in messages:
+            self.assertEqual(claim_id, msg['claim_id'])
+            self.assertNotIn(msg['id'], [str(oid) for oid in stolen])
+
+        __, claimed = self.controller.get(self.queue_name, claim_id,
+                                          project=self.project)
+        self.assertEqual([msg['id'] for msg in messages],
+                         [msg['id'] for msg in claimed])
+
+    def test_claim_extends_expiring_messages(self):
+        base._insert_fixtures(self.message_controller, self.queue_name,
+                              project=self.project, num=2, ttl=60)
+
+        claim_id, messages = self.controller.create(
+            self.queue_name, {'ttl': 100, 'grace': 30},
+            project=self.project)
+
+        messages = list(messages)
+        self.assertEqual([130, 130], [msg['ttl'] for msg in messages])
+
+        __, claimed = self.controller.get(self.queue_name, claim_id,
+                                          project=self.project)
+        self.assertEqual([130, 130], [msg['ttl'] for msg in claimed])
+
 
 @testing.requires_mongodb
 class MongodbSubscriptionTests(MongodbSetupMixin,
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import collections
+import itertools
 import time
 import uuid
 
@@ -25,6 +26,7 @@ from zaqar.common import cache as oslo_cache
 from zaqar.common import errors
 from zaqar import storage
 from zaqar.storage import mongodb
+from zaqar.storage.redis import claims
 from zaqar.storage.redis import controllers
 from zaqar.storage.redis import driver
 from zaqar.storage.redis import messages
@@ -199,6 +201,77 @@ class RedisDriverTest(testing.TestBase):
             except RuntimeError:
                 self.fail('version match failed')
 
+    def _new_driver(self):
+        oslo_cache.register_config(self.conf)
+        cache = oslo_cache.get_cache(self.conf)
+        return driver.DataDriver(self.conf, cache,
+                                 driver.ControlDriver(self.conf, cache))
+
+    @mock.patch.object(driver.DataDriver, '_get_operation_status')
+    @mock.patch.object(driver.DataDriver, '_health')
+    def test_health_tiers(self, mock_health, mock_probe):
+        mock_health.return_value = {'message_volume': {'total': 1}}
+        mock_probe.return_value = {'create_queue': {'succeeded': True}}
+        redis_driver = self._new_driver()
+
+        self.assertEqual({'storage_reachable': True},
+                         redis_driver.health(tier='liveness'))
+        self.assertFalse(mock_health.called)
+
+        health = redis_driver.health()
+        self.assertEqual({'total': 1}, health['message_volume'])
+        self.assertTrue(health['storage_reachable'])
+        self.assertNotIn('operation_status', health)
+
+        health = redis_driver.health(tier='probe')
+        self.assertTrue(health['operation_status']['create_queue'])
+        self.assertEqual(1, mock_health.call_count)
+        self.assertEqual(1, mock_probe.call_count)
+
+        self.assertRaises(ValueError, redis_driver.health, tier='all')
+
+    @mock.patch.object(driver.DataDriver, '_get_operation_status')
+    def test_health_probe_is_rate_limited(self, mock_probe):
+        redis_driver = self._new_driver()
+        self.conf.set_override('probe_interval', 60, group='health')
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+        redis_driver.health(tier='probe')
+        redis_driver.health(tier='probe')
+        self.assertEqual(1, mock_probe.call_count)
+
+        timeutils.advance_time_seconds(61)
+        redis_driver.health(tier='probe')
+        self.assertEqual(2, mock_probe.call_count)
+
+    @mock.patch.object(driver.DataDriver, '_health')
+    def test_health_kpis_are_refreshed_in_background(self, mock_health):
+        redis_driver = self._new_driver()
+        self.conf.set_override('kpi_cache_ttl', 30, group='health')
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+        mock_health.return_value = {'version': 1}
+        self.assertEqual(1, redis_driver.health()['version'])
+        self.assertEqual(1, redis_driver.health()['version'])
+        self.assertEqual(1, mock_health.call_count)
+
+        # NOTE: Stale KPIs are still served while they are refreshed
+        mock_health.return_value = {'version': 2}
+        timeutils.advance_time_seconds(31)
+        self.assertEqual(1, redis_driver.health()['version'])
+
+        for __ in range(100):
+            if not redis_driver._kpi_refreshing:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(2, mock_health.call_count)
+        self.assertEqual(2, redis_driver.health()['version'])
+
     def test_connection_url_invalid(self):
         self.assertRaises(errors.ConfigurationError,
                           driver.ConnectionURI,
@@ -299,6 +372,19 @@ class RedisQueuesTest(base.QueueControllerTest):
         super(RedisQueuesTest, self).tearDown()
         self.connection.flushdb()
 
+    def test_exists_is_cached_until_deleted(self):
+        self.controller.create('cached')
+
+        with mock.patch.object(self.connection, 'zrank',
+                               wraps=self.connection.zrank) as zrank:
+            for i in range(3):
+                self.assertTrue(self.controller.exists('cached'))
+
+            self.assertEqual(1, zrank.call_count)
+
+        self.controller.delete('cached')
+        self.assertFalse(self.controller.exists('cached'))
+
 
 @testing.requires_redis
 class RedisMessagesTest(base.MessageControllerTest):
@@ -356,6 +442,101 @@ class RedisMessagesTest(base.MessageControllerTest):
         num_removed = self.controller.gc()
         self.assertEqual(100, num_removed)
 
+    def test_count_excludes_expired_messages(self):
+        queue_name = 'count-expired'
+        self.queue_controller.create(queue_name)
+        self.controller.post(queue_name,
+                             [{'ttl': 0, 'body': {}}] * 3 +
+                             [{'ttl': 300, 'body': {}}] * 2,
+                             client_uuid=str(uuid.uuid4()))
+
+        # NOTE: Expired messages are not counted even before gc runs
+        self.assertEqual(5, self.connection.zcard(
+            utils.msgset_key(queue_name)))
+        self.assertEqual(2, self.controller._count(queue_name, None))
+
+    def test_gc_removes_expired_messages_by_range(self):
+        queue_name = 'gc-expired-range'
+        self.queue_controller.create(queue_name)
+        self.controller.post(queue_name,
+                             [{'ttl': 0, 'body': {}}] * 3 +
+                             [{'ttl': 300, 'body': {}}] * 2,
+                             client_uuid=str(uuid.uuid4()))
+
+        self.assertEqual(3, self.controller._remove_expired(queue_name,
+                                                            None))
+
+        # NOTE: The expiry index covers every message, so there is no
+        # need for gc to check for the message hashes one by one.
+        self.assertTrue(self.controller._is_fully_indexed(queue_name, None))
+        self.assertEqual(0, self.controller.gc())
+
+        expires_key = utils.expires_msgset_key(queue_name)
+        self.assertEqual(2, self.connection.zcard(expires_key))
+        self.assertEqual(2, self.connection.zcard(
+            utils.msgset_key(queue_name)))
+
+    @mock.patch.object(messages, 'GC_BATCH_SIZE', 2)
+    def test_gc_resumes_where_it_left_off(self):
+        self.config(options.MESSAGE_REDIS_GROUP, gc_time_budget=60)
+        self.queue_controller.create(self.queue_name)
+        for _ in range(5):
+            self.controller.post(self.queue_name,
+                                 [{'ttl': 0, 'body': {}}],
+                                 client_uuid=str(uuid.uuid4()))
+
+        # NOTE: Force the messages to be visited one by one, as for a
+        # queue that older nodes have posted to.
+        self.connection.delete(utils.expires_msgset_key(self.queue_name))
+
+        # NOTE: Run out of time after the first batch of messages
+        now = time.time()
+        with mock.patch('time.time') as mock_time:
+            mock_time.side_effect = itertools.chain(
+                [now], itertools.repeat(now + 61))
+            self.assertEqual(2, self.controller.gc())
+
+        cursor = self.connection.hgetall(messages.GC_CURSOR_KEY_PREFIX + '0')
+        self.assertEqual(b'0', cursor[b'q'])
+        self.assertEqual(b'2', cursor[b'r'])
+
+        self.assertEqual(3, self.controller.gc())
+        self.assertFalse(self.connection.exists(
+            messages.GC_CURSOR_KEY_PREFIX + '0'))
+
+        stats = self.connection.hgetall(messages.GC_STATS_KEY)
+        self.assertEqual(b'5', stats[b'messages'])
+        self.assertEqual(b'2', stats[b'runs'])
+
+    def test_gc_splits_queues_by_shard(self):
+        self.config(options.MESSAGE_REDIS_GROUP, gc_shards=2)
+
+        queues = ['gc-shard-%d' % i for i in range(10)]
+        for queue in queues:
+            self.queue_controller.create(queue)
+            self.controller.post(queue, [{'ttl': 0, 'body': {}}],
+                                 client_uuid=str(uuid.uuid4()))
+
+        def shard_of(queue):
+            return messages._gc_shard(utils.msgset_key(queue).encode(), 2)
+
+        # NOTE: Another run holds the lease on shard 0
+        self.connection.set(messages.GC_LEASE_KEY_PREFIX + '0', 'other')
+
+        num_shard_1 = len([q for q in queues if shard_of(q) == 1])
+        self.assertEqual(num_shard_1, self.controller.gc())
+        for queue in queues:
+            self.assertEqual(int(shard_of(queue) == 0),
+                             self.connection.zcard(utils.msgset_key(queue)))
+
+        # All shards are taken, so there is nothing to do
+        self.connection.set(messages.GC_LEASE_KEY_PREFIX + '1', 'other')
+        self.assertEqual(0, self.controller.gc())
+
+        # The lease held by the other run is left alone
+        self.assertEqual(b'other', self.connection.get(
+            messages.GC_LEASE_KEY_PREFIX + '0'))
+
     def test_invalid_uuid(self):
         queue_name = 'invalid-uuid-test'
         msgs = [{
@@ -366,6 +547,113 @@ class RedisMessagesTest(base.MessageControllerTest):
         self.assertRaises(ValueError, self.controller.post, queue_name, msgs,
                           client_id)
 
+    def test_list_skips_claimed_and_echoed_messages(self):
+        queue_name = 'list-filtered'
+        poster, other = str(uuid.uuid4()), str(uuid.uuid4())
+        self.queue_controller.create(queue_name)
+
+        claimed_ids = self.controller.post(queue_name,
+                                           [{'ttl': 300, 'body': {}}] * 3,
+                                           client_uuid=other)
+        self.claim_controller.create(queue_name, {'ttl': 60, 'grace': 60},
+                                     limit=3)
+
+        own_ids = []
+        other_ids = []
+        for i in range(4):
+            own_ids += self.controller.post(queue_name,
+                                            [{'ttl': 300, 'body': i}],
+                                            client_uuid=poster)
+            other_ids += self.controller.post(queue_name,
+                                              [{'ttl': 300, 'body': i}],
+                                              client_uuid=other)
+
+        with mock.patch.object(self.connection, 'hgetall') as hgetall:
+            results = self.controller.list(queue_name, limit=3,
+                                           client_uuid=poster)
+            msgs = list(next(results))
+            self.assertFalse(hgetall.called)
+
+        self.assertEqual(other_ids[:3], [m['id'] for m in msgs])
+        marker = next(results)
+        self.assertEqual(other_ids[2], marker)
+
+        results = self.controller.list(queue_name, limit=3, marker=marker,
+                                       client_uuid=poster)
+        self.assertEqual(other_ids[3:], [m['id'] for m in next(results)])
+
+        results = self.controller.list(queue_name, limit=20, echo=True,
+                                       include_claimed=True,
+                                       client_uuid=poster)
+        msgs = list(next(results))
+        self.assertEqual(11, len(msgs))
+        self.assertEqual(claimed_ids, [m['id'] for m in msgs[:3]])
+
+    def test_bulk_delete_updates_claims_atomically(self):
+        queue_name = 'bulk-delete-script'
+        self.queue_controller.create(queue_name)
+        msg_ids = self.controller.post(queue_name,
+                                       [{'ttl': 300, 'body': {}}] * 20,
+                                       client_uuid=str(uuid.uuid4()))
+        claim_id, msgs = self.claim_controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=10)
+
+        with mock.patch.object(self.connection, 'exists') as exists:
+            self.controller.bulk_delete(queue_name, msg_ids[5:15])
+            self.assertFalse(exists.called)
+
+        self.assertEqual(10, self.connection.zcard(
+            utils.msgset_key(queue_name)))
+        claim = self.claim_controller.get(queue_name, claim_id)[1]
+        self.assertEqual(msg_ids[:5], [m['id'] for m in claim])
+        self.assertEqual(b'5', self.connection.hget(claim_id, 'n'))
+        self.assertEqual(5, self.claim_controller._count_messages(queue_name,
+                                                                  None))
+
+    def test_delete_checks_claim_in_script(self):
+        queue_name = 'delete-script'
+        self.queue_controller.create(queue_name)
+        msg_ids = self.controller.post(queue_name,
+                                       [{'ttl': 300, 'body': {}}] * 2,
+                                       client_uuid=str(uuid.uuid4()))
+        claim_id, msgs = self.claim_controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=1)
+
+        self.assertRaises(storage.errors.MessageIsClaimed,
+                          self.controller.delete, queue_name, msg_ids[0])
+        self.assertRaises(storage.errors.MessageNotClaimed,
+                          self.controller.delete, queue_name, msg_ids[1],
+                          claim=claim_id)
+
+        other_id, msgs = self.claim_controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=1)
+        self.assertRaises(storage.errors.MessageNotClaimedBy,
+                          self.controller.delete, queue_name, msg_ids[0],
+                          claim=other_id)
+
+        self.controller.delete(queue_name, msg_ids[0], claim=claim_id)
+        self.assertFalse(self.connection.exists(msg_ids[0]))
+        self.assertEqual(b'0', self.connection.hget(claim_id, 'n'))
+
+        # NOTE: Deleting a message that is already gone is a no-op
+        self.controller.delete(queue_name, msg_ids[0], claim=claim_id)
+
+    def test_pop_does_not_persist_a_claim(self):
+        queue_name = 'pop-script'
+        self.queue_controller.create(queue_name)
+        msg_ids = self.controller.post(queue_name,
+                                       [{'ttl': 300, 'body': {}}] * 5,
+                                       client_uuid=str(uuid.uuid4()))
+
+        msgs = self.controller.pop(queue_name, 3)
+        self.assertEqual(msg_ids[:3], [m['id'] for m in msgs])
+        self.assertEqual(0, self.connection.zcard(utils.scope_claims_set(
+            queue_name, None, 'claims')))
+        self.assertEqual(2, self.connection.zcard(
+            utils.available_msgset_key(queue_name)))
+        self.assertEqual(0, self.connection.zcard(
+            utils.claimed_msgset_key(queue_name)))
+
 
 @testing.requires_redis
 class RedisClaimsTest(base.ClaimControllerTest):
@@ -466,6 +754,361 @@ class RedisClaimsTest(base.ClaimControllerTest):
         num_removed = self.controller._gc(self.queue_name, None)
         self.assertEqual(5, num_removed)
 
+    def test_claim_moves_messages_between_indexes(self):
+        queue_name = 'claim-index'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}] * 10,
+                                     client_uuid=str(uuid.uuid4()))
+
+        available_key = utils.available_msgset_key(queue_name)
+        claimed_key = utils.claimed_msgset_key(queue_name)
+        self.assertEqual(10, self.connection.zcard(available_key))
+        self.assertEqual(0, self.connection.zcard(claimed_key))
+
+        claim_id, messages = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=4)
+        claimed_ids = [m['id'] for m in messages]
+
+        self.assertEqual(6, self.connection.zcard(available_key))
+        self.assertEqual(4, self.connection.zcard(claimed_key))
+
+        # NOTE: The next claim should pick up right after the
+        # messages that were already claimed.
+        claim_id_2, messages = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=4)
+        self.assertFalse(set(claimed_ids) & set(m['id'] for m in messages))
+        self.assertEqual(2, self.connection.zcard(available_key))
+
+        # Releasing a claim makes its messages available again
+        self.controller.delete(queue_name, claim_id)
+        claim_id, messages = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=10)
+        self.assertTrue(set(claimed_ids) <= set(m['id'] for m in messages))
+        self.assertEqual(6, len(messages))
+        self.assertEqual(0, self.connection.zcard(available_key))
+
+    def test_expired_claim_messages_are_claimable(self):
+        queue_name = 'claim-index-expired'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}] * 5,
+                                     client_uuid=str(uuid.uuid4()))
+
+        now = timeutils.utcnow_ts()
+        timeutils_utcnow = 'oslo_utils.timeutils.utcnow_ts'
+
+        with mock.patch(timeutils_utcnow) as mock_utcnow:
+            mock_utcnow.return_value = now - 10
+            claim_id, messages = self.controller.create(
+                queue_name, {'ttl': 1, 'grace': 60}, limit=5)
+
+        self.assertEqual(5, len(messages))
+
+        claim_id, messages = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=5)
+        self.assertEqual(5, len(messages))
+
+        claimed_key = utils.claimed_msgset_key(queue_name)
+        self.assertEqual(5, self.connection.zcard(claimed_key))
+
+    def test_renew_and_release_only_touch_owned_messages(self):
+        queue_name = 'claim-renew-owned'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 600, 'body': {}}] * 3,
+                                     client_uuid=str(uuid.uuid4()))
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=3)
+        owned_id, stolen_id = msgs[0]['id'], msgs[2]['id']
+
+        # NOTE: Simulate the message having been claimed by someone else
+        # after this claim expired.
+        other_claim = str(uuid.uuid4())
+        self.connection.hmset(stolen_id, {'c': other_claim, 'c.e': 1})
+        key_ttl = self.connection.ttl(owned_id)
+
+        self.controller.update(queue_name, claim_id,
+                               {'ttl': 120, 'grace': 60})
+
+        claim_expires = int(self.connection.hget(claim_id, 'e'))
+        self.assertEqual(claim_expires,
+                         int(self.connection.hget(owned_id, 'c.e')))
+        self.assertEqual(b'1', self.connection.hget(stolen_id, 'c.e'))
+
+        # The message outlives the claim, so its TTL is left alone
+        self.assertEqual(b'600', self.connection.hget(owned_id, 't'))
+        self.assertTrue(self.connection.ttl(owned_id) <= key_ttl)
+
+        self.controller.delete(queue_name, claim_id)
+        self.assertEqual(b'', self.connection.hget(owned_id, 'c'))
+        self.assertEqual(other_claim.encode(),
+                         self.connection.hget(stolen_id, 'c'))
+        self.assertFalse(self.connection.exists(claim_id))
+
+    def test_claim_extends_message_key_ttl(self):
+        queue_name = 'claim-key-ttl'
+        self.queue_controller.create(queue_name)
+        short_id, long_id = self.message_controller.post(
+            queue_name,
+            [{'ttl': 60, 'body': {}}, {'ttl': 600, 'body': {}}],
+            client_uuid=str(uuid.uuid4()))
+
+        self.controller.create(queue_name, {'ttl': 100, 'grace': 60})
+
+        # NOTE: The message would have expired while claimed, so its
+        # key TTL is extended to cover the claim plus the grace period.
+        self.assertTrue(100 < self.connection.ttl(short_id) <= 160)
+
+        # The key TTL of a message that outlives the claim is unchanged
+        self.assertTrue(160 < self.connection.ttl(long_id) <= 600)
+
+    def test_claim_drops_expired_messages(self):
+        queue_name = 'claim-expired'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 0, 'body': {}}] * 3 +
+                                     [{'ttl': 300, 'body': {}}],
+                                     client_uuid=str(uuid.uuid4()))
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60})
+        self.assertEqual(1, len(msgs))
+
+        # NOTE: Expired IDs are dropped from every index by the claim
+        for key in (utils.msgset_key(queue_name),
+                    utils.claimed_msgset_key(queue_name),
+                    utils.expires_msgset_key(queue_name)):
+            self.assertEqual(1, self.connection.zcard(key))
+
+        self.assertEqual(0, self.connection.zcard(
+            utils.available_msgset_key(queue_name)))
+
+    def test_renew_updates_expiry_index(self):
+        queue_name = 'claim-renew-expires'
+        self.queue_controller.create(queue_name)
+        msg_id, = self.message_controller.post(
+            queue_name, [{'ttl': 60, 'body': {}}],
+            client_uuid=str(uuid.uuid4()))
+        expires_key = utils.expires_msgset_key(queue_name)
+        posted = self.connection.zscore(expires_key, msg_id)
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 100, 'grace': 60})
+        claimed = self.connection.zscore(expires_key, msg_id)
+        self.assertTrue(posted + 100 <= claimed)
+
+        self.controller.update(queue_name, claim_id,
+                               {'ttl': 300, 'grace': 60})
+        self.assertTrue(claimed + 200 <= self.connection.zscore(
+            expires_key, msg_id))
+
+    def test_claim_migrates_legacy_msgset(self):
+        queue_name = 'claim-index-legacy'
+        indexed_key = messages.CLAIM_INDEXED_MSGSETS_KEY
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}] * 10,
+                                     client_uuid=str(uuid.uuid4()))
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=3)
+        claimed_ids = set(m['id'] for m in msgs)
+
+        # NOTE: Simulate a queue that was populated before the
+        # available/claimed indexes were introduced.
+        msgset_key = utils.msgset_key(queue_name)
+        self.connection.delete(utils.available_msgset_key(queue_name))
+        self.connection.delete(utils.claimed_msgset_key(queue_name))
+        self.connection.srem(indexed_key, msgset_key)
+        self.controller._indexed_msgsets.clear()
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=10)
+
+        self.assertEqual(7, len(msgs))
+        self.assertFalse(claimed_ids & set(m['id'] for m in msgs))
+        self.assertTrue(self.connection.sismember(indexed_key, msgset_key))
+        self.assertEqual(10, self.connection.zcard(
+            utils.claimed_msgset_key(queue_name)))
+
+    @mock.patch.object(claims, 'MIGRATION_BATCH_SIZE', 3)
+    def test_legacy_msgset_migration_is_bounded(self):
+        queue_name = 'claim-index-bounded'
+        indexed_key = messages.CLAIM_INDEXED_MSGSETS_KEY
+        cursors_key = messages.CLAIM_INDEX_CURSORS_KEY
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}] * 10,
+                                     client_uuid=str(uuid.uuid4()))
+
+        msgset_key = utils.msgset_key(queue_name)
+        available_key = utils.available_msgset_key(queue_name)
+        self.connection.delete(available_key)
+        self.connection.srem(indexed_key, msgset_key)
+
+        self.assertFalse(self.controller._index_legacy_messages(
+            queue_name, None, max_batches=2))
+        self.assertEqual(6, self.connection.zcard(available_key))
+        self.assertEqual(b'6', self.connection.hget(cursors_key, msgset_key))
+
+        # NOTE: Resumes from the saved rank rather than starting over
+        with mock.patch.object(self.controller, '_reindex',
+                               wraps=self.controller._reindex) as reindex:
+            self.assertFalse(self.controller._index_legacy_messages(
+                queue_name, None, max_batches=1))
+            self.assertEqual(3, len(reindex.call_args[0][2]))
+
+        self.assertTrue(self.controller._index_legacy_messages(
+            queue_name, None, max_batches=None))
+        self.assertEqual(10, self.connection.zcard(available_key))
+        self.assertTrue(self.connection.sismember(indexed_key, msgset_key))
+        self.assertIsNone(self.connection.hget(cursors_key, msgset_key))
+
+    def test_first_post_marks_queue_indexed(self):
+        queue_name = 'claim-index-new'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}],
+                                     client_uuid=str(uuid.uuid4()))
+
+        msgset_key = utils.msgset_key(queue_name)
+        self.assertTrue(self.connection.sismember(
+            messages.CLAIM_INDEXED_MSGSETS_KEY, msgset_key))
+
+        with mock.patch.object(self.connection, 'zrangebyscore') as zrange:
+            self.controller.create(queue_name, {'ttl': 60, 'grace': 60})
+            self.assertFalse(zrange.called)
+
+    def test_gc_indexes_messages_posted_by_old_nodes(self):
+        queue_name = 'claim-index-upgrade'
+        self.queue_controller.create(queue_name)
+        msg_ids = self.message_controller.post(
+            queue_name, [{'ttl': 300, 'body': {}}] * 3,
+            client_uuid=str(uuid.uuid4()))
+
+        # NOTE: A node running the previous release only adds the
+        # message to the msgset.
+        available_key = utils.available_msgset_key(queue_name)
+        self.connection.zrem(available_key, msg_ids[1])
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=3)
+        self.assertEqual(2, len(msgs))
+
+        self.message_controller.gc()
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=3)
+        self.assertEqual([msg_ids[1]], [m['id'] for m in msgs])
+
+    def test_count_messages_uses_claimed_index(self):
+        queue_name = 'claim-count'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}] * 10,
+                                     client_uuid=str(uuid.uuid4()))
+
+        self.assertEqual(0, self.controller._count_messages(queue_name,
+                                                            None))
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=4)
+        self.assertEqual(4, self.controller._count_messages(queue_name,
+                                                            None))
+
+        with mock.patch.object(self.controller,
+                               '_count_messages_by_claim') as by_claim:
+            self.controller._count_messages(queue_name, None)
+            self.assertFalse(by_claim.called)
+
+        self.controller.delete(queue_name, claim_id)
+        self.assertEqual(0, self.controller._count_messages(queue_name,
+                                                            None))
+
+    def test_reconcile_fixes_claimed_index_drift(self):
+        queue_name = 'claim-reconcile'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}] * 10,
+                                     client_uuid=str(uuid.uuid4()))
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=4)
+
+        claimed_key = utils.claimed_msgset_key(queue_name)
+        available_key = utils.available_msgset_key(queue_name)
+        unclaimed_id = self.connection.zrange(available_key, 0, 0)[0]
+        now = timeutils.utcnow_ts()
+
+        # Introduce some drift: a message that does not exist, a message
+        # that is not claimed, and a claimed message with a stale score.
+        self.connection.zadd(claimed_key, now + 1000, str(uuid.uuid4()))
+        self.connection.zadd(claimed_key, now + 1000, unclaimed_id)
+        self.connection.zadd(claimed_key, now + 1000, msgs[0]['id'])
+        self.assertEqual(6, self.controller._count_messages(queue_name,
+                                                            None))
+
+        self.assertEqual(3, self.controller._reconcile(queue_name, None))
+        self.assertEqual(4, self.controller._count_messages(queue_name,
+                                                            None))
+        self.assertEqual(0, self.controller._reconcile(queue_name, None))
+
+    @mock.patch.object(claims, 'RECONCILE_BATCH_SIZE', 2)
+    def test_reconcile_checks_every_claimed_entry(self):
+        queue_name = 'claim-reconcile-paging'
+        self.queue_controller.create(queue_name)
+        id_a, id_b = self.message_controller.post(
+            queue_name, [{'ttl': 300, 'body': {}}] * 2,
+            client_uuid=str(uuid.uuid4()))
+        self.controller.create(queue_name, {'ttl': 60, 'grace': 60})
+
+        # NOTE: Rescoring the first entry moves it past the others, so
+        # paging through the index by offset would skip the ghost.
+        now = timeutils.utcnow_ts()
+        id_d = str(uuid.uuid4())
+        claimed_key = utils.claimed_msgset_key(queue_name)
+        self.connection.hset(id_a, 'c.e', now + 5000)
+        self.connection.hset(id_b, 'c.e', now + 2000)
+        self.connection.zadd(claimed_key, now + 1500, id_a)
+        self.connection.zadd(claimed_key, now + 2000, id_b)
+        self.connection.zadd(claimed_key, now + 2500, id_d)
+
+        self.assertEqual(2, self.controller._reconcile(queue_name, None))
+        self.assertEqual(now + 5000, self.connection.zscore(claimed_key,
+                                                            id_a))
+        self.assertIsNone(self.connection.zscore(claimed_key, id_d))
+        self.assertEqual(2, self.connection.zcard(claimed_key))
+
+    def test_reconcile_moves_claimed_messages_out_of_available(self):
+        queue_name = 'claim-reconcile-available'
+        self.queue_controller.create(queue_name)
+        self.message_controller.post(queue_name,
+                                     [{'ttl': 300, 'body': {}}] * 5,
+                                     client_uuid=str(uuid.uuid4()))
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=2)
+
+        msgset_key = utils.msgset_key(queue_name)
+        claimed_key = utils.claimed_msgset_key(queue_name)
+        available_key = utils.available_msgset_key(queue_name)
+        claimed_id = msgs[0]['id']
+        rank = self.connection.zscore(msgset_key, claimed_id)
+        self.connection.zrem(claimed_key, claimed_id)
+        self.connection.zadd(available_key, rank, claimed_id)
+        self.connection.zadd(available_key, 1000, str(uuid.uuid4()))
+
+        self.assertEqual(2, self.controller._reconcile(queue_name, None))
+        self.assertEqual(3, self.connection.zcard(available_key))
+        self.assertEqual(2, self.controller._count_messages(queue_name,
+                                                            None))
+
+        claim_id, msgs = self.controller.create(
+            queue_name, {'ttl': 60, 'grace': 60}, limit=5)
+        self.assertNotIn(claimed_id, [m['id'] for m in msgs])
+
 
 @testing.requires_redis
 class RedisSubscriptionTests(base.SubscriptionControllerTest):
@@ -12,6 +12,7 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import mock
 import six
 
 from zaqar.storage import sqlalchemy
@@ -34,6 +35,34 @@ class SqlalchemyQueueTests(DBCreateMixin, base.QueueControllerTest):
     controller_class = controllers.QueueController
     control_driver_class = sqlalchemy.ControlDriver
 
+    def test_metadata_is_cached_until_changed(self):
+        self.controller.create('cached', metadata={'color': 'red'})
+
+        with mock.patch.object(self.driver, 'run',
+                               wraps=self.driver.run) as run:
+            metadata = self.controller.get_metadata('cached', None)
+            self.assertEqual({'color': 'red'}, metadata)
+            self.assertEqual(1, run.call_count)
+
+            # NOTE: Changing the returned value must not change the
+            # cached one.
+            metadata['color'] = 'blue'
+            self.assertEqual({'color': 'red'},
+                             self.controller.get_metadata('cached', None))
+            self.assertEqual(1, run.call_count)
+
+            self.controller.set_metadata('cached', {'color': 'green'}, None)
+            self.assertEqual({'color': 'green'},
+                             self.controller.get_metadata('cached', None))
+            self.assertEqual(3, run.call_count)
+
+        self.assertTrue(self.controller.exists('cached'))
+        self.controller.delete('cached')
+        self.assertFalse(self.controller.exists('cached'))
+
+        stats = self.driver.queue_cache.stats()
+        self.assertEqual(1, stats['hits'])
+
 
 class SqlalchemyPoolsTest(DBCreateMixin, base.PoolsControllerTest):
     config_file = 'wsgi_sqlalchemy.conf'
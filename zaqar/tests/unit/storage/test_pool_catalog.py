@@ -74,6 +74,22 @@ class PoolCatalogTest(testing.TestBase):
         self.pools_ctrl.drop_all()
         super(PoolCatalogTest, self).tearDown()
 
+    def test_pool_id_uses_local_cache(self):
+        self.catalog._local_cache = oslo_cache.LRUCache(10, 5)
+        self.catalog._cache_purge_hook = mock.Mock()
+        backend = self.catalog._cache
+
+        with mock.patch.object(backend, 'get', wraps=backend.get) as get:
+            for i in range(3):
+                self.assertEqual(self.pool, self.catalog._pool_id(
+                    self.queue, self.project))
+
+            self.assertEqual(1, get.call_count)
+
+        self.catalog.deregister(self.queue, self.project)
+        self.assertEqual(0, len(self.catalog._local_cache))
+        self.assertTrue(self.catalog._cache_purge_hook.called)
+
     def test_lookup_loads_correct_driver(self):
         storage = self.catalog.lookup(self.queue, self.project)
         self.assertIsInstance(storage._storage, mongodb.DataDriver)
@@ -90,6 +106,43 @@ class PoolCatalogTest(testing.TestBase):
         self.catalog.deregister(self.queue, self.project)
         self.assertIsNone(self.catalog.lookup(self.queue, self.project))
 
+    def test_lookup_caches_unmapped_queues(self):
+        self.catalog._unmapped_cache = oslo_cache.LRUCache(10, 5)
+
+        with mock.patch.object(self.catalogue_ctrl, 'get',
+                               wraps=self.catalogue_ctrl.get) as get:
+            for i in range(3):
+                self.assertIsNone(self.catalog.lookup('not', 'mapped'))
+
+            self.assertEqual(1, get.call_count)
+
+        # Registering the queue makes it visible right away
+        self.catalog.register('not', 'mapped')
+        storage = self.catalog.lookup('not', 'mapped')
+        self.assertIsInstance(storage._storage, mongodb.DataDriver)
+
+    def test_prefetch_warms_mappings(self):
+        self.catalog._unmapped_cache = oslo_cache.LRUCache(10, 5)
+        self.catalog.prefetch([self.queue, 'not_mapped'], self.project)
+
+        with mock.patch.object(self.catalogue_ctrl, 'get') as get:
+            self.assertIsNotNone(self.catalog.lookup(self.queue,
+                                                     self.project))
+            self.assertIsNone(self.catalog.lookup('not_mapped',
+                                                  self.project))
+            self.assertFalse(get.called)
+
+    def test_register_does_not_remap_queue(self):
+        with mock.patch.object(self.catalogue_ctrl, 'get_or_insert',
+                               wraps=self.catalogue_ctrl.get_or_insert) as gi:
+            self.catalog.register(self.queue, self.project,
+                                  flavor=self.flavor)
+            self.assertEqual(1, gi.call_count)
+
+        self.assertEqual(self.pool,
+                         self.catalogue_ctrl.get(self.project,
+                                                 self.queue)['pool'])
+
     def test_register_leads_to_successful_lookup(self):
         self.catalog.register('not_yet', 'mapped')
         storage = self.catalog.lookup('not_yet', 'mapped')
@@ -36,7 +36,7 @@ class TestHealthMongoDB(base.V2Base):
 
     def test_basic(self):
         path = self.url_prefix + '/health'
-        body = self.simulate_get(path)
+        body = self.simulate_get(path, query_string='tier=probe')
         health = jsonutils.loads(body[0])
         self.assertEqual(falcon.HTTP_200, self.srmock.status)
         self.assertTrue(health['storage_reachable'])
@@ -44,6 +44,29 @@ class TestHealthMongoDB(base.V2Base):
         for op in health['operation_status']:
             self.assertTrue(health['operation_status'][op]['succeeded'])
 
+    def test_default_tier_skips_probe(self):
+        path = self.url_prefix + '/health'
+        body = self.simulate_get(path)
+        health = jsonutils.loads(body[0])
+        self.assertEqual(falcon.HTTP_200, self.srmock.status)
+        self.assertTrue(health['storage_reachable'])
+        self.assertIsNotNone(health['message_volume'])
+        self.assertNotIn('operation_status', health)
+
+    @mock.patch.object(mongo.driver.DataDriver, '_health')
+    def test_liveness(self, mock_driver_get):
+        path = self.url_prefix + '/health'
+        body = self.simulate_get(path, query_string='tier=liveness')
+        health = jsonutils.loads(body[0])
+        self.assertEqual(falcon.HTTP_200, self.srmock.status)
+        self.assertEqual({'storage_reachable': True}, health)
+        self.assertFalse(mock_driver_get.called)
+
+    def test_bad_tier(self):
+        path = self.url_prefix + '/health'
+        self.simulate_get(path, query_string='tier=everything')
+        self.assertEqual(falcon.HTTP_400, self.srmock.status)
+
     @mock.patch.object(mongo.driver.DataDriver, '_health')
     def test_message_volume(self, mock_driver_get):
         def _health():
@@ -67,7 +90,7 @@ class TestHealthMongoDB(base.V2Base):
         mock_messages_delete.side_effect = errors.NotPermitted()
 
         path = self.url_prefix + '/health'
-        body = self.simulate_get(path)
+        body = self.simulate_get(path, query_string='tier=probe')
         health = jsonutils.loads(body[0])
         self.assertEqual(falcon.HTTP_200, self.srmock.status)
         op_status = health['operation_status']
@@ -34,8 +34,14 @@ class Resource(object):
     @decorators.TransportLog("Health item")
     @acl.enforce("health:get")
     def on_get(self, req, resp, **kwargs):
+        tier = req.get_param('tier') or 'kpi'
+        if tier not in self._driver.HEALTH_TIERS:
+            description = (_(u'Health tier must be one of: %s.') %
+                           ', '.join(self._driver.HEALTH_TIERS))
+            raise wsgi_errors.HTTPBadRequestAPI(description)
+
         try:
-            resp_dict = self._driver.health()
+            resp_dict = self._driver.health(tier=tier)
             resp.body = utils.to_json(resp_dict)
         except Exception as ex:
             LOG.exception(ex)
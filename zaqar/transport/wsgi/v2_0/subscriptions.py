@@ -19,7 +19,6 @@ from oslo_log import log as logging
 from oslo_utils import netutils
 from oslo_utils import timeutils
 import six
-from stevedore import driver
 
 from zaqar.common import decorators
 from zaqar.i18n import _
@@ -187,11 +186,10 @@ class CollectionResource(object):
             options = document.get('options', {})
             url = netutils.urlsplit(subscriber)
             ttl = document.get('ttl', self._default_subscription_ttl)
-            mgr = driver.DriverManager('zaqar.notification.tasks', url.scheme,
-                                       invoke_on_load=True)
             req_data = req.headers.copy()
             req_data.update(req.env)
-            mgr.driver.register(subscriber, options, ttl, project_id, req_data)
+            task = notifier.get_task(url.scheme)
+            task.register(subscriber, options, ttl, project_id, req_data)
 
             created = self._subscription_controller.create(queue_name,
                                                            subscriber,